@@ -8,29 +8,67 @@ import os
 import traceback
 from camel.agents import ChatAgent
 from camel.models import ModelFactory
-from camel.types import ModelPlatformType, RoleType
+from camel.types import ModelPlatformType, RoleType, OpenAIBackendRole
 from camel.messages import BaseMessage
 import time
 import json
 import os
 from datetime import datetime
 import textwrap
-from typing import Union, List, Dict, Any, cast
+from typing import Union, List, Dict, Any, Iterator, cast
 import io
 from schemas import HealthOutputSchema, validate_output
+from stream_parser import ContentStreamParser
+import http_pool
+from response_cache import ResponseCache
+from semantic_cache import SemanticCache
+import hashlib
 
 
 load_dotenv('API.env')
 
+SUMMARY_PROMPT = """你负责整理健康咨询的对话记录。
+请把已有摘要和新的对话合并为一份简洁的中文摘要，保留：
+- 用户的基本情况、健康状况和健康目标
+- 已给出的关键建议
+- 仍需跟进的问题
+不超过300字，只输出摘要正文，不要输出JSON。"""
+
 class AgentService:
-    def __init__(self, config: dict, system_prompt: str):
+    def __init__(self, config: dict, system_prompt: str, cache: ResponseCache = None,
+                 semantic_cache: SemanticCache = None, use_memory: bool = True,
+                 memory_token_limit: int = None):
+        """
+        use_memory: 是否由代理记忆携带历史；为False时每轮只发送系统提示和本轮消息，
+                    历史由调用方（ContextAssembler）随消息发送
+        memory_token_limit: 代理记忆的 token 上限，超出时丢弃最旧的消息
+        """
+        api_key = os.getenv("SILICONFLOW_API_KEY")
+        self.system_prompt = system_prompt
+        self.use_memory = use_memory
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        # 代理记忆中已有对话的摘要（逐条累积哈希），记忆为空时为空串
+        self.memory_digest = ""
+        # 不同提示词/参数的代理在语义缓存中互不共享回复
+        self.cache_namespace = hashlib.sha256(
+            json.dumps({"system": system_prompt, "config": config}, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        ).hexdigest()[:16]
         self.model = ModelFactory.create(
             model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
             model_type="deepseek-ai/DeepSeek-R1",
             model_config_dict=config,
-            url='https://api.siliconflow.cn',
-            api_key=os.getenv("SILICONFLOW_API_KEY")
+            url=http_pool.API_BASE_URL,
+            api_key=api_key
         )
+        # 流式输出和摘要直接调用接口，使用基于共享keep-alive连接池的客户端
+        self.api_key = api_key
+        self.client = http_pool.get_openai_client(api_key)
+        # camel 把额外参数同时传给内部的 OpenAI 和 AsyncOpenAI，无法传入同步连接池；
+        # 建好模型后把其同步客户端换成共享客户端，代理的 step 也复用同一连接池。
+        # 异步连接池绑定事件循环，achat 在调用时取当前事件循环的客户端，不经过模型
+        if hasattr(self.model, "_client"):
+            self.model._client = self.client
         self.agent = ChatAgent(
             model=self.model,
             output_language="中文",
@@ -39,20 +77,174 @@ class AgentService:
                 role_type=RoleType.ASSISTANT,
                 content=system_prompt,
                 meta_dict={"身份": "健康管理师"}
-            )
+            ),
+            token_limit=memory_token_limit
         )
 
-    def chat(self, message: str) -> Union[HealthOutputSchema, str]:
-        """发送消息并返回响应"""
+    def chat(self, message: str, question: str = None) -> Union[HealthOutputSchema, str]:
+        """发送消息并返回响应
+
+        question 为预处理后的用户原始问题，本轮不带历史和摘要时启用语义近似缓存
+        """
+        context = self._cache_context()
+        cached = self._lookup_cache(message, question, context)
+        if cached is not None:
+            return cached
+
+        self._forget_if_stateless()
         response = self.agent.step(input_message=message)
         raw_content = response.msgs[0].content
-        
+        # step 已把本轮对话写入代理记忆
+        self._advance_digest("user", message)
+        self._advance_digest("assistant", raw_content)
+        return self._finish(message, raw_content, question, context)
+
+    def chat_stream(self, message: str, question: str = None) -> Iterator[Union[str, HealthOutputSchema]]:
+        """流式发送消息
+
+        依次产出 content 字段的文本增量(str)，
+        结束时产出完整解析后的 HealthOutputSchema
+        """
+        context = self._cache_context()
+        cached = self._lookup_cache(message, question, context)
+        if cached is not None:
+            yield cached.content
+            yield cached
+            return
+
+        openai_messages = self._prepare_messages(message)
+        request_config = dict(self.model.model_config_dict)
+        request_config["stream"] = True
+        stream = self.client.chat.completions.create(
+            messages=openai_messages,
+            model=self.model.model_type,
+            **request_config
+        )
+
+        parser = ContentStreamParser()
+        chunks = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            chunks.append(delta)
+            text = parser.feed(delta)
+            if text:
+                yield text
+
+        raw_content = "".join(chunks)
+        self._record_reply(raw_content)
+        yield self._finish(message, raw_content, question, context)
+
+    async def achat(self, message: str, question: str = None) -> HealthOutputSchema:
+        """异步发送消息并返回响应（使用调用方事件循环的共享异步连接池）"""
+        context = self._cache_context()
+        cached = self._lookup_cache(message, question, context)
+        if cached is not None:
+            return cached
+
+        openai_messages = self._prepare_messages(message)
+        request_config = dict(self.model.model_config_dict)
+        request_config.pop("stream", None)
+        response = await http_pool.get_async_openai_client(self.api_key).chat.completions.create(
+            messages=openai_messages,
+            model=self.model.model_type,
+            **request_config
+        )
+        raw_content = response.choices[0].message.content or ""
+        self._record_reply(raw_content)
+        return self._finish(message, raw_content, question, context)
+
+    def restore_memory(self, messages: List[Dict[str, Any]], max_messages: int = 40):
+        """用历史记录重建代理记忆（会话被回收后重新创建时调用）"""
+        if not self.use_memory:
+            return
+        self.agent.reset()
+        self.memory_digest = ""
+        for msg in messages[-max_messages:]:
+            if msg["role"] == RoleType.USER:
+                self._remember_user(msg["content"])
+            elif msg["role"] == RoleType.ASSISTANT:
+                self._record_reply(msg["content"])
+
+    def summarize(self, previous_summary: str, transcript: str) -> str:
+        """把一段较早的对话合并进滚动摘要（不经过代理记忆和缓存）"""
+        content = f"已有摘要:\n{previous_summary or '（无）'}\n\n新的对话:\n{transcript}"
+        response = self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            model=self.model.model_type,
+            temperature=0.3
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    def _prepare_messages(self, message: str) -> list:
+        """把用户消息写入代理记忆，返回本次请求的完整消息列表"""
+        self._forget_if_stateless()
+        self._remember_user(message)
+        openai_messages, _ = self.agent.memory.get_context()
+        return openai_messages
+
+    def _forget_if_stateless(self):
+        """不使用代理记忆时，清空上一轮留下的对话，只保留系统提示"""
+        if not self.use_memory:
+            self.agent.reset()
+            self.memory_digest = ""
+
+    def _remember_user(self, message: str):
+        """把用户消息写入代理记忆"""
+        user_msg = BaseMessage.make_user_message(role_name="user", content=message)
+        self.agent.update_memory(user_msg, OpenAIBackendRole.USER)
+        self._advance_digest("user", message)
+
+    def _record_reply(self, raw_content: str):
+        """把模型回复写入代理记忆"""
+        self.agent.record_message(
+            BaseMessage.make_assistant_message(role_name="assistant", content=raw_content)
+        )
+        self._advance_digest("assistant", raw_content)
+
+    def _advance_digest(self, role: str, content: str):
+        payload = json.dumps([self.memory_digest, role, content], ensure_ascii=False)
+        self.memory_digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _cache_context(self) -> str:
+        """本轮请求之前代理记忆的摘要；不使用代理记忆时每轮都从空记忆开始"""
+        return self.memory_digest if self.use_memory else ""
+
+    def _cache_key(self, message: str, context: str) -> str:
+        return ResponseCache.make_key(self.system_prompt, self.model.model_config_dict, message, context)
+
+    @staticmethod
+    def _semantic_allowed(message: str, question: str, context: str) -> bool:
+        """语义缓存只按问题本身检索，本轮带有历史或摘要时（记忆非空，或发送的消息不是问题本身）不使用"""
+        return bool(question) and not context and message == question
+
+    def _lookup_cache(self, message: str, question: str = None, context: str = "") -> Union[HealthOutputSchema, None]:
+        """依次查询精确缓存和语义近似缓存，命中时同样写入代理记忆以保持对话连贯"""
+        output = None
+        if self.cache is not None:
+            output = self.cache.get(self._cache_key(message, context))
+        if output is None and self.semantic_cache is not None and self._semantic_allowed(message, question, context):
+            match = self.semantic_cache.get(self.cache_namespace, question)
+            if match is not None:
+                output = match.output
+        if output is not None:
+            self._remember_user(message)
+            self._record_reply(output.to_json())
+        return output
+
+    def _finish(self, message: str, raw_content: str, question: str = None, context: str = "") -> HealthOutputSchema:
+        """解析模型输出，格式正确的回复写入缓存"""
         # 尝试解析为JSON，如果失败则使用默认格式
         try:
             parsed = json.loads(raw_content)
             # 验证输出格式
             output_schema = validate_output(parsed)
-            return output_schema
         except (json.JSONDecodeError, ValueError) as e:
             # 格式不符合时创建默认结构
             default_output = HealthOutputSchema(
@@ -62,7 +254,13 @@ class AgentService:
                 needs_follow_up=False
             )
             print(f"⚠️ 输出格式错误，使用默认结构: {str(e)}")
-            return output_schema
+            return default_output
+
+        if self.cache is not None:
+            self.cache.put(self._cache_key(message, context), output_schema)
+        if self.semantic_cache is not None and self._semantic_allowed(message, question, context):
+            self.semantic_cache.add(self.cache_namespace, question, output_schema)
+        return output_schema
 
     # def chat(self, user_id: str, message: str, history: list) -> Union[HealthOutputSchema, str]:
     #     """发送消息并返回响应（包含完整的对话历史）"""
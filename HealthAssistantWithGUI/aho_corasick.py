@@ -0,0 +1,144 @@
+# aho_corasick.py
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+class AhoCorasick:
+    """多模式字符串匹配自动机（Aho-Corasick）
+
+    把全部词条构建成一棵带失败指针的字典树，扫描文本一遍即可找出所有词条的所有出现位置，
+    耗时只与文本长度和命中次数有关，与词表大小无关。patterns 为 词条 -> 值，
+    值可以是替换文本或任意附加信息；词条的插入顺序即优先级（序号越小越优先）。
+    构建完成后只读，可在多个线程和多个预处理器实例间共享。
+    tables 为 tables() 导出的状态表（可经JSON保存），给出时直接载入，不再重新构建。
+    """
+
+    # 共享的自动机：词表内容 -> 自动机，相同词表只构建一次
+    _shared = OrderedDict()
+    _shared_lock = threading.Lock()
+    SHARED_MAX = 16
+
+    def __init__(self, patterns: Dict[str, Any], tables: Dict[str, Any] = None):
+        self.words = [w for w in patterns if w]
+        self.values = [patterns[w] for w in self.words]
+        if tables is not None:
+            self._load_tables(tables)
+            return
+        self._goto = [{}]     # 节点 -> {字符: 子节点}
+        self._fail = [0]
+        self._output = [()]   # 节点 -> 在此结束的词条序号（含经失败指针可达的后缀词条）
+
+        for index, word in enumerate(self.words):
+            node = 0
+            for char in word:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][char] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                node = child
+            self._output[node] = (index,)
+
+        # 按层次遍历设置失败指针，并把后缀词条合并到输出中
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                if self._output[fail]:
+                    self._output[child] = self._output[child] + self._output[fail]
+
+    def tables(self) -> Dict[str, Any]:
+        """导出状态表（只含JSON可表示的类型），供 tables 参数载入
+
+        转移表展开为每个节点的出边字符串和按顺序排列的全部子节点，比嵌套对象解析得快
+        """
+        return {
+            "words": self.words,
+            "chars": ["".join(node) for node in self._goto],
+            "children": [child for node in self._goto for child in node.values()],
+            "fail": self._fail,
+            "output": [[node, *indexes] for node, indexes in enumerate(self._output) if indexes]
+        }
+
+    def _load_tables(self, tables: Dict[str, Any]):
+        """载入状态表并校验，表与词表不一致或已损坏时抛出 ValueError"""
+        if tables["words"] != self.words:
+            raise ValueError("自动机状态表与词表不一致")
+        chars, children, fail = tables["chars"], tables["children"], tables["fail"]
+        size = len(chars)
+        if (not size or len(fail) != size or len(children) != sum(map(len, chars))
+                or (children and not 0 < min(children) <= max(children) < size)
+                or not 0 <= min(fail) <= max(fail) < size):
+            raise ValueError("自动机状态表已损坏")
+        child_iter = iter(children)
+        # 大多数节点是叶子；载入后只读，叶子共用一个空表
+        leaf = {}
+        goto = [dict(zip(node, islice(child_iter, len(node)))) if node else leaf for node in chars]
+        output = [()] * size
+        indexes = [index for entry in tables["output"] for index in entry[1:]]
+        if indexes and not 0 <= min(indexes) <= max(indexes) < len(self.words):
+            raise ValueError("自动机状态表已损坏")
+        for node, *entry in tables["output"]:
+            output[node] = tuple(entry)
+        self._goto, self._fail, self._output = goto, list(fail), output
+
+    @classmethod
+    def shared(cls, patterns: Dict[str, Any], tables: Dict[str, Any] = None) -> "AhoCorasick":
+        """返回词表对应的共享自动机，相同内容的词表复用已构建的实例
+
+        尚未构建时，给出 tables 则从状态表载入
+        """
+        key = tuple(patterns.items())
+        with cls._shared_lock:
+            automaton = cls._shared.get(key)
+            if automaton is not None:
+                cls._shared.move_to_end(key)
+                return automaton
+        automaton = cls(patterns, tables)
+        with cls._shared_lock:
+            cls._shared[key] = automaton
+            while len(cls._shared) > cls.SHARED_MAX:
+                cls._shared.popitem(last=False)
+        return automaton
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """按结束位置顺序产出所有命中 (起始位置, 结束位置, 词条序号)"""
+        goto, fail, output, words = self._goto, self._fail, self._output, self.words
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                end = position + 1
+                for index in output[node]:
+                    yield end - len(words[index]), end, index
+
+    def replace(self, text: str) -> str:
+        """一遍扫描替换所有词条：重叠时取最左、其次最长、再次优先级最高的一个"""
+        matches = sorted(self.iter_matches(text), key=lambda m: (m[0], m[0] - m[1], m[2]))
+        if not matches:
+            return text
+        parts: List[str] = []
+        position = 0
+        for start, end, index in matches:
+            if start < position:
+                continue
+            parts.append(text[position:start])
+            parts.append(self.values[index])
+            position = end
+        parts.append(text[position:])
+        return "".join(parts)
@@ -7,25 +7,50 @@ from history_manager import HistoryManager
 from schemas import HealthInputSchema, HealthOutputSchema, validate_input, validate_output
 import json
 from preprocessor import InputPreprocessor  # 引入预处理模块
+from fanout import AgentFanout
+from summarizer import HistoryCompactor
+from session_pool import SessionPool
+from history_export import read_records
+from history_search import HistorySearch, parse_query
 import re
 import ast
 import operator as op
 
 class CLIInterface:
-    def __init__(self, agents: List[dict], history_managers: List[HistoryManager], user_id: str):
+    def __init__(self, agents: List[dict], history: HistoryManager, user_id: str,
+                 fanout: AgentFanout = None, compactor: HistoryCompactor = None,
+                 sessions: SessionPool = None, search: HistorySearch = None,
+                 preprocessor: InputPreprocessor = None):
         """
-        agents: [{"name": str, "service": AgentService}, ...]
-        history_managers: [HistoryManager, ...]
+        agents: [{"id": str, "name": str, "service": AgentService, "context": ContextAssembler,
+                  "history": AgentHistory}, ...]
+                提供 sessions 时可省略 "service"
+        history: HistoryManager - 所有代理共用的统一历史
         user_id: str - 当前用户ID
+        fanout: AgentFanout - 并发调用所有代理，默认新建
+        compactor: HistoryCompactor - 后台滚动摘要，为None时不压缩旧对话
+        sessions: SessionPool - 按用户隔离的代理会话池，为None时所有用户共用 "service"
+        search: HistorySearch - 历史全文检索，默认新建
+        preprocessor: InputPreprocessor - 输入预处理器，默认新建（使用内置规则）
         """
         self.agents = agents
-        self.history_managers = history_managers
+        self.history = history
         self.user_id = user_id
-        self.preprocessor = InputPreprocessor()
+        self.fanout = fanout or AgentFanout()
+        self.compactor = compactor
+        self.sessions = sessions
+        self.search = search or HistorySearch(history)
+        self.preprocessor = preprocessor or InputPreprocessor()
         self.security_log = []  # 安全日志
         self.security_log_file = "security_events.log"  # 新增日志文件
         self.SECURITY_THRESHOLD = 5  # 5次安全事件后触发终止
     
+    def service_for(self, agent_index: int, user_id: str):
+        """获取指定用户在该代理下的 AgentService"""
+        if self.sessions is None:
+            return self.agents[agent_index]["service"]
+        return self.sessions.get(user_id, agent_index)
+
     def safe_execute(self, func, *args, **kwargs):
         """安全执行函数，限制潜在危险操作"""
         try:
@@ -60,13 +85,11 @@ class CLIInterface:
             print()
             time.sleep(speed * 2)
 
-    def display_output(self, output: HealthOutputSchema):
-        """完整显示自然文本格式"""
-        # 创建自然语言格式回复
-        full_response = f"{output.content}\n\n"
-    
+    def format_footer(self, output: HealthOutputSchema) -> str:
+        """生成回复末尾的来源、建议类型等附加信息"""
+        footer = ""
         if output.sources:
-            full_response += f"🔍 信息来源: {', '.join(output.sources)}\n"
+            footer += f"🔍 信息来源: {', '.join(output.sources)}\n"
     
         advice_types = {
             "general": "💡 一般建议",
@@ -74,53 +97,107 @@ class CLIInterface:
             "exercise": "🏃 运动建议",
             "warning": "⚠️ 重要提示"
         }
-        full_response += f"{advice_types.get(output.advice_type, '💡 建议')}\n"
+        footer += f"{advice_types.get(output.advice_type, '💡 建议')}\n"
         if output.needs_follow_up:
-            full_response += "❗ 建议: 请尽快咨询专业医生\n"
+            footer += "❗ 建议: 请尽快咨询专业医生\n"
     
-            full_response += f"📊 置信度: {output.confidence*100:.1f}%"
+            footer += f"📊 置信度: {output.confidence*100:.1f}%"
+        return footer
+
+    def display_output(self, output: HealthOutputSchema):
+        """完整显示自然文本格式"""
+        # 创建自然语言格式回复
+        full_response = f"{output.content}\n\n"
+        full_response += self.format_footer(output)
     
         # 流式输出完整内容
         self.simulate_streaming(full_response)
 
+    def render_fanout(self, events, on_complete, error_prefix: str = "请求失败"):
+        """按到达顺序显示多个代理的并发回复
+
+        同一时间只有一个代理占用终端实时输出，其余代理的增量先缓存；
+        当前代理结束后，先补齐已完成的代理，再把终端交给仍在输出的代理。
+        on_complete(i, output) 在代理 i 的回复显示完毕后调用。
+        """
+        buffers = {}    # 代理序号 -> 尚未显示的增量
+        results = {}    # 已完成但尚未显示的代理: 代理序号 -> (事件类型, 数据)
+        streamed = set()
+        current = None  # 当前占用终端的代理
+
+        def take_floor(i):
+            print(f"\n🤖 {self.agents[i]['name']}: ", end='')
+            print("".join(buffers.pop(i, [])), end='', flush=True)
+
+        def finish(i):
+            kind, payload = results.pop(i)
+            if kind == AgentFanout.ERROR:
+                if i in streamed:
+                    print()
+                print(f"⚠️ {error_prefix}: {str(payload)}")
+                return
+            if i not in streamed:
+                # 模型未按JSON输出content时，直接显示完整内容
+                print(payload.content, end='')
+            print("\n")
+            footer = self.format_footer(payload)
+            if footer:
+                print(footer.rstrip("\n"))
+            on_complete(i, payload)
+
+        for kind, i, payload in events:
+            if kind == AgentFanout.DELTA:
+                streamed.add(i)
+                if current is None:
+                    current = i
+                    take_floor(i)
+                if current == i:
+                    print(payload, end='', flush=True)
+                else:
+                    buffers.setdefault(i, []).append(payload)
+                continue
+
+            results[i] = (kind, payload)
+            if current is not None and current != i:
+                continue
+            if current is None:
+                take_floor(i)
+            finish(i)
+            current = None
+
+            while results:
+                j = next(iter(results))
+                take_floor(j)
+                finish(j)
+            if buffers:
+                current = next(iter(buffers))
+                take_floor(current)
+
     def show_welcome_messages(self, user_id: str, histories: list):
         """显示欢迎消息"""
+        jobs = []
         for i, agent_info in enumerate(self.agents):
-            print(f"\n🤖 {agent_info['name']}: ", end='')
-            start_time = time.time()
-
             prompt = (
                 f"用户上次讨论: {histories[i][-1]['content'][:30]}..."
                 if histories[i] and histories[i][-1].get('content')
                 else "请向新用户问好"
             )
+            jobs.append((i, self.service_for(i, user_id), prompt))
 
-            try:
-                response = agent_info["service"].chat(prompt)
+        start_time = time.time()
 
-                # 处理不同类型的响应
-                if isinstance(response, HealthOutputSchema):
-                    self.display_output(response)
-                    assistant_msg = response.content
-                else:
-                    self.simulate_streaming(response)
-                    assistant_msg = response
-                
-                # 保存到历史记录
-                new_msg = {
-                    "role": RoleType.ASSISTANT,
-                    "content": assistant_msg,
-                    "timestamp": datetime.now().isoformat()
-                }
-                if not histories[i]:
-                    histories[i] = [new_msg]
-                else:
-                    histories[i].append(new_msg)
-                
-                self.history_managers[i].save(user_id, histories[i])
-                print(f"⏱️ 耗时: {time.time() - start_time:.2f}s")
-            except Exception as e:
-                print(f"⚠️ 错误: {str(e)}")
+        def save_reply(i, response):
+            # 保存到历史记录
+            new_msg = {
+                "role": RoleType.ASSISTANT,
+                "content": response.content,
+                "timestamp": datetime.now().isoformat()
+            }
+            histories[i].append(new_msg)
+            self.agents[i]["history"].append(user_id, [new_msg])
+            print(f"⏱️ 耗时: {time.time() - start_time:.2f}s")
+
+        self.render_fanout(self.fanout.stream(jobs), save_reply, error_prefix="错误")
 
     def process_user_input(self, user_id: str, user_input: str, histories: list):
         """处理用户输入并获取AI响应"""
@@ -147,48 +224,43 @@ class CLIInterface:
             print(f"⚠️ 输入格式错误: {str(e)}")
             return
 
-        # 处理每个Agent的响应
+        # 用户消息只保存一次，所有代理共享
+        user_msg = {
+            "role": RoleType.USER,
+            "content": user_input,
+            "timestamp": datetime.now().isoformat()
+        }
+        self.history.append(user_id, [user_msg])
+
+        # 为每个Agent构建上下文
+        jobs = []
         for i, agent_info in enumerate(self.agents):
-            # 添加用户消息
-            user_msg = {
-                "role": RoleType.USER,
-                "content": user_input,
+            # 构建上下文（不含本轮消息），长度由上下文组装器的 token 预算控制
+            summary = agent_info["history"].load_summary(user_id)
+            full_input = agent_info["context"].build(histories[i], user_input, summary)
+            histories[i].append(user_msg)
+            jobs.append((i, self.service_for(i, user_id), full_input))
+
+        # 并发获取所有Agent的回复，先完成的先显示
+        start_time = time.time()
+
+        def save_reply(i, response):
+            # 保存本轮的回复
+            reply = {
+                "role": RoleType.ASSISTANT,
+                "content": response.content,
                 "timestamp": datetime.now().isoformat()
             }
-            histories[i].append(user_msg)
+            histories[i].append(reply)
+            self.agents[i]["history"].append(user_id, [reply])
+            print(f"⏱️ 耗时: {time.time() - start_time:.2f}s")
 
-            # 构建上下文
-            context = "\n".join(
-                f"{'用户' if m['role'] == RoleType.USER else '助手'}: {m['content']}"
-                for m in histories[i][-6:]
-            )
-            full_input = f"对话上下文:\n{context}\n\n请回复: {user_input}"
+        self.render_fanout(self.fanout.stream(jobs, question=user_input), save_reply)
 
-        # 获取回复
-            print(f"\n🤖 {agent_info['name']}: ", end='')
-            start_time = time.time()
-            try:
-                response = agent_info["service"].chat(full_input)
-            
-                # 处理不同类型的响应
-                if isinstance(response, HealthOutputSchema):
-                    self.display_output(response)
-                    assistant_msg = response.content
-                else:
-                    self.simulate_streaming(response)
-                    assistant_msg = response
-
-                # 保存回复
-                histories[i].append({
-                    "role": RoleType.ASSISTANT,
-                    "content": assistant_msg,
-                    "timestamp": datetime.now().isoformat()
-                })
-                self.history_managers[i].save(user_id, histories[i])
-                print(f"⏱️ 耗时: {time.time() - start_time:.2f}s")
-            
-            except Exception as e:
-                print(f"⚠️ 请求失败: {str(e)}")
+        # 对话间隙在后台把较早的对话压缩进滚动摘要
+        if self.compactor is not None:
+            for i, agent_info in enumerate(self.agents):
+                self.compactor.schedule(self.service_for(i, user_id), agent_info["history"], user_id)
 
     #以下是GUI
     # def process_user_input(self, user_id: str, user_input: str, histories: list):
@@ -237,6 +309,49 @@ class CLIInterface:
     #             print(f"⚠️ 请求失败: {str(e)}")
 
 
+    def load_histories(self, user_id: str) -> list:
+        """读取每个代理构建上下文所需的最近消息"""
+        histories = [agent_info["history"].load_recent(user_id, agent_info["context"].history_window)
+                     for agent_info in self.agents]
+        print(f"加载历史记录: {self.history.count(user_id)}条")
+        return histories
+
+    def import_history(self, filename: str):
+        """从导出文件批量导入当前用户的历史记录"""
+        if not filename:
+            print("用法: /import 文件名")
+            return
+        try:
+            records = read_records(filename, {a["name"]: a["id"] for a in self.agents})
+        except Exception as e:
+            print(f"⚠️ 读取失败: {str(e)}")
+            return
+        start_time = time.time()
+        result = self.history.bulk_import(self.user_id, records)
+        print(f"✅ 导入{result['imported']}条，重复{result['duplicates']}条，"
+              f"无效{result['invalid']}条，其中写入归档{result['archived']}条，耗时 {time.time() - start_time:.2f}s")
+
+    def search_history(self, text: str):
+        """检索历史记录，默认只检索当前用户，user:* 检索所有用户"""
+        query, filters = parse_query(text)
+        if not query:
+            print("用法: /search 关键词 [user:ID|*] [agent:代理标识|user] [from:2025-01-01] [to:2025-12-31]")
+            return
+        user_id = filters.get("user", self.user_id)
+        start_time = time.time()
+        results = self.search.search(
+            query,
+            user_id=None if user_id == "*" else user_id,
+            agent=filters.get("agent"),
+            date_from=filters.get("from"),
+            date_to=filters.get("to")
+        )
+        names = {a["id"]: a["name"] for a in self.agents}
+        print(f"🔍 找到 {len(results)} 条结果，耗时 {(time.time() - start_time) * 1000:.1f}ms")
+        for result in results:
+            speaker = "用户" if result["role"] == "user" else names.get(result["agent"], result["agent"] or "未知代理")
+            print(f"[{result['timestamp'][:19].replace('T', ' ')}] {result['user_id']} · {speaker}: {result['snippet']}")
+
     def adjust_parameters(self):
         """调整参数（示例）"""
         print("\n=== 参数调整 ===")
@@ -250,17 +365,15 @@ class CLIInterface:
         # user_id = input("请输入用户ID: ").strip() or "default_user"
         print("\n=== 健康管理师咨询系统 ===")
         print(f"当前用户: {self.user_id}")
-        print("可用指令:\n  /params - 调整参数\n  /exit - 退出\n  /clear - 清除历史记录\n  /switch - 切换用户")
+        print("可用指令:\n  /params - 调整参数\n  /exit - 退出\n  /clear - 清除历史记录\n  /switch - 切换用户\n"
+              "  /import 文件名 - 导入历史记录（.json/.jsonl/.csv）\n"
+              "  /search 关键词 [user:ID|*] [agent:代理标识|user] [from:日期] [to:日期] - 检索历史记录")
 
         # 初始化安全计数器
         security_count = 0  # ✅ 每个会话独立的计数器
 
-     # 初始化历史记录
-        histories = []
-        for i, manager in enumerate(self.history_managers):
-            history = manager.load(self.user_id)
-            histories.append(history)
-            print(f"{self.agents[i]['name']} 加载历史记录: {len(history)}条")
+     # 初始化历史记录（只读取构建上下文所需的最近消息）
+        histories = self.load_histories(self.user_id)
     
         # 主对话循环
         while True:
@@ -276,25 +389,16 @@ class CLIInterface:
                 if not user_input:
                     continue
                 
-                # 1. 预处理用户输入 - 新增
-                processed_input = self.preprocessor.preprocess(user_input)
-                
-                # 2. 验证预处理结果 - 新增
-                is_valid, error_info = self.preprocessor.validate(processed_input)
-                #error_type,error_msg=error_info
-                if not is_valid:
-                    if isinstance(error_info, tuple) and len(error_info) == 2:
-                        error_type, error_msg = error_info
-                    else:
-                    # 处理其他类型的错误信息
-                        error_type = "验证错误"
-                        error_msg = str(error_info)
+                # 预处理用户输入：一遍得到规范化文本和判定结果
+                result = self.preprocessor.preprocess(user_input)
+                if not result.ok:
+                    error_type, error_msg = result.error_type, result.message
                     print(f"⚠️ {error_msg}")
                     if error_type in ["安全防护", "敏感内容过滤"]:
                         self.log_security_event(
                         event_type=error_type,
                         user_input=original_input,
-                        details=error_msg
+                        details=f"{error_msg}（规则: {result.rule}，位置: {result.spans}）"
                     )
                         security_count += 1
                         
@@ -309,35 +413,41 @@ class CLIInterface:
                             break  # 终止会话
                     continue
                  # 使用处理后的输入
-                user_input = processed_input
+                user_input = result.text
 
                 if user_input.lower() in ['/exit', '退出']:
-                    for i, manager in enumerate(self.history_managers):
-                        manager.save(self.user_id, histories[i])
+                    self.history.flush()
                     print("对话已保存，再见！")
                     break
 
                 elif user_input.lower() == '/clear':
-                    for manager in self.history_managers:
-                        manager.clear(self.user_id)
+                    self.history.clear(self.user_id)
+                    if self.sessions is not None:
+                        self.sessions.discard(self.user_id)
                     print("✅ 历史记录已清除")
                     # 重新加载空历史
-                    histories = []
-                    for i, manager in enumerate(self.history_managers):
-                        histories.append(manager.load(self.user_id))
+                    histories = [[] for _ in self.agents]
                     continue
                 
                 elif user_input.lower() == '/params':
                     self.adjust_parameters()
                     continue
+
+                elif user_input.lower().startswith('/search'):
+                    self.search_history(user_input[len('/search'):].strip())
+                    continue
+
+                elif user_input.lower().startswith('/import'):
+                    self.import_history(user_input[len('/import'):].strip())
+                    histories = self.load_histories(self.user_id)
+                    continue
                 
                 # 处理用户输入
                 self.process_user_input(self.user_id, user_input, histories)
             
             except KeyboardInterrupt:
                 print("\n⚠️ 中断检测，正在保存历史记录...")
-                for i, manager in enumerate(self.history_managers):
-                    manager.save(self.user_id, histories[i])
+                self.history.flush()
                 break
             except Exception as e:
                 print(f"\n⚠️ 系统错误: {str(e)}")
@@ -346,17 +456,12 @@ class CLIInterface:
                 new_user_id = input("请输入新用户ID: ").strip() or "default_user"
                 if new_user_id != self.user_id:
                     # 保存当前用户历史
-                    for i, manager in enumerate(self.history_managers):
-                        manager.save(self.user_id, histories[i])
+                    self.history.flush()
                     
                     # 切换到新用户
                     self.user_id = new_user_id
                     print(f"已切换到用户: {self.user_id}")
                     
                     # 加载新用户历史
-                    histories = []
-                    for i, manager in enumerate(self.history_managers):
-                        history = manager.load(self.user_id)
-                        histories.append(history)
-                        print(f"{self.agents[i]['name']} 加载历史记录: {len(history)}条")
+                    histories = self.load_histories(self.user_id)
                 continue
\ No newline at end of file
@@ -0,0 +1,83 @@
+# context_assembler.py
+import math
+import re
+from typing import List, Dict, Any
+
+from camel.types import RoleType
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+class ContextAssembler:
+    """每轮发送给代理的上下文组装器
+
+    两种模式二选一，避免同一段历史被重复发送：
+    - history: 由组装器从历史记录中挑选对话并随消息发送，代理记忆每轮清空
+    - memory:  只发送本轮消息，由代理记忆携带历史，记忆按同一预算裁剪
+    history 模式下从最新一轮向前选取，超出 token 预算的最旧对话被丢弃，
+    因此每轮的提示词长度不会随会话增长。已被滚动摘要覆盖的旧对话由摘要代替。
+    """
+
+    MODE_HISTORY = "history"
+    MODE_MEMORY = "memory"
+
+    def __init__(self, token_budget: int = 2000, mode: str = MODE_HISTORY, history_window: int = 50):
+        """history_window: 每轮最多从历史记录中读取的消息条数，预算一般在此之前就已用完"""
+        if mode not in (self.MODE_HISTORY, self.MODE_MEMORY):
+            raise ValueError(f"未知的上下文模式: {mode}")
+        self.token_budget = token_budget
+        self.mode = mode
+        self.history_window = history_window
+        self.last_prompt_tokens = 0
+
+    @property
+    def uses_agent_memory(self) -> bool:
+        return self.mode == self.MODE_MEMORY
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        """估算 token 数：中日韩字符按1个计，其余字符约4个计1个"""
+        cjk = len(_CJK_PATTERN.findall(text))
+        other = len(re.sub(r'\s+', '', text)) - cjk
+        return cjk + math.ceil(other / 4)
+
+    @staticmethod
+    def format_message(message: Dict[str, Any]) -> str:
+        return f"{'用户' if message['role'] == RoleType.USER else '助手'}: {message['content']}"
+
+    def build(self, history: List[Dict[str, Any]], user_input: str, summary: Dict[str, Any] = None) -> str:
+        """组装本轮发送的消息
+
+        history: 本轮之前的对话记录（不含 user_input）
+        summary: HistoryManager.load_summary 返回的滚动摘要
+        """
+        summary_text = (summary or {}).get("text", "")
+        covered_until = (summary or {}).get("covered_until", "")
+        if self.uses_agent_memory or not (history or summary_text):
+            self.last_prompt_tokens = self.count_tokens(user_input)
+            return user_input
+
+        header = "对话上下文:\n"
+        if summary_text:
+            header = f"既往对话摘要:\n{summary_text}\n\n" + header
+        footer = f"\n\n请回复: {user_input}"
+        used = self.count_tokens(header) + self.count_tokens(footer)
+
+        # 从最新的消息向前选取，直到用完预算或遇到已被摘要覆盖的消息
+        selected = []
+        for message in reversed(history):
+            if covered_until and message.get("timestamp", "") <= covered_until:
+                break
+            line = self.format_message(message)
+            cost = self.count_tokens(line)
+            if used + cost > self.token_budget:
+                break
+            selected.append(line)
+            used += cost
+
+        if not selected and not summary_text:
+            self.last_prompt_tokens = self.count_tokens(user_input)
+            return user_input
+        self.last_prompt_tokens = used
+        selected.reverse()
+        return header + "\n".join(selected) + footer
@@ -0,0 +1,78 @@
+# fanout.py
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple, Any
+
+from schemas import HealthOutputSchema
+
+
+class AgentFanout:
+    """把同一轮消息并发发送给多个代理
+
+    每个代理的流式回复在线程池中运行，事件按到达顺序汇总到一个队列，
+    调用方在自己的线程里依次消费，先返回的回复可以先显示。
+    max_concurrency 限制同时进行的模型请求数。
+    """
+
+    DELTA = "delta"
+    DONE = "done"
+    ERROR = "error"
+
+    def __init__(self, max_concurrency: int = 4):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency 必须大于等于1")
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="agent-fanout"
+        )
+
+    def stream(self, jobs: List[Tuple[int, Any, str]], **chat_kwargs) -> Iterator[Tuple[str, int, Any]]:
+        """并发执行 jobs: [(代理序号, AgentService, 消息), ...]
+
+        chat_kwargs 原样传给每个代理的 chat_stream（如 question）。
+
+        产出事件 (类型, 代理序号, 数据)：
+        - ("delta", i, str)                 content 文本增量
+        - ("done", i, HealthOutputSchema)   代理回复完成
+        - ("error", i, Exception)           代理请求失败
+        """
+        events = queue.Queue()
+        cancelled = threading.Event()
+
+        for index, service, message in jobs:
+            self._executor.submit(self._run_job, index, service, message, chat_kwargs, events, cancelled)
+
+        remaining = len(jobs)
+        try:
+            while remaining:
+                event = events.get()
+                if event[0] != self.DELTA:
+                    remaining -= 1
+                yield event
+        finally:
+            # 调用方提前退出（如 KeyboardInterrupt）时通知工作线程停止产出
+            cancelled.set()
+
+    def _run_job(self, index: int, service, message: str, chat_kwargs: dict,
+                 events: queue.Queue, cancelled: threading.Event):
+        """在工作线程中消费单个代理的流式回复"""
+        try:
+            output = None
+            for piece in service.chat_stream(message, **chat_kwargs):
+                if cancelled.is_set():
+                    return
+                if isinstance(piece, HealthOutputSchema):
+                    output = piece
+                else:
+                    events.put((self.DELTA, index, piece))
+            if output is None:
+                raise RuntimeError("流式响应意外中断")
+            events.put((self.DONE, index, output))
+        except Exception as e:
+            events.put((self.ERROR, index, e))
+
+    def shutdown(self):
+        """关闭线程池"""
+        self._executor.shutdown(wait=False)
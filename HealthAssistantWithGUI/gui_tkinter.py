@@ -2,6 +2,7 @@ import tkinter as tk
 from tkinter import scrolledtext, messagebox, simpledialog, ttk
 import threading
 import json
+from collections import deque
 from datetime import datetime
 from PIL import Image, ImageTk
 import io
@@ -13,17 +14,40 @@ from agent import AgentService
 from history_manager import HistoryManager
 from preprocessor import InputPreprocessor
 from camel.types import RoleType
-from schemas import HealthOutputSchema
+from fanout import AgentFanout
+from history_export import export_to_file, format_for, read_records, FORMATS
+from persistence_queue import PersistenceQueue
+from history_search import HistorySearch, parse_query
 
 class HealthAgentGUI:
-    def __init__(self, root, agents, history_manager, initial_user_id):
+    def __init__(self, root, agents, history, initial_user_id, fanout=None, compactor=None,
+                 sessions=None, persistence=None, search=None, preprocessor=None, max_overflow=200,
+                 display_limit=200):
         self.root = root
         # 使用传入的服务而不是自己创建
         self.agents = agents
-        self.history_managers = history_manager  # 修改为复数形式
-        
-        # 初始化预处理器
-        self.preprocessor = InputPreprocessor()
+        # 所有代理共用的统一历史，单个代理的视图为 agents[i]["history"]
+        self.history = history
+        # 并发调用所有代理
+        self.fanout = fanout or AgentFanout()
+        # 后台滚动摘要（可选）
+        self.compactor = compactor
+        # 按用户隔离的代理会话池（可选，为None时所有用户共用 "service"）
+        self.sessions = sessions
+        # 历史写入由后台写线程完成，Tk 主线程只提交操作
+        self.persistence = persistence or PersistenceQueue()
+        # 写入队列已满时暂存的操作，按提交顺序稍后重试，界面线程不等待；
+        # 暂存也有上限，接近上限时不再接受新的消息和操作
+        self._overflow = deque()
+        self.max_overflow = max_overflow
+        self._overflow_lock = threading.Lock()
+        # 历史全文检索
+        self.search = search or HistorySearch(history)
+        # 聊天区显示的最近消息条数，完整历史可导出或检索
+        self.display_limit = display_limit
+        
+        # 初始化预处理器（可由 RuleWatcher 热加载规则）
+        self.preprocessor = preprocessor or InputPreprocessor()
         self.user_id = initial_user_id
         self.is_processing = False
         
@@ -78,6 +102,18 @@ class HealthAgentGUI:
             bg="#1a73e8"
         )
         status_label.pack(side=tk.RIGHT, padx=20)
+
+        # 待写入历史的操作数，队列为空时不显示
+        self.queue_var = tk.StringVar(value="")
+        queue_label = tk.Label(
+            title_frame, 
+            textvariable=self.queue_var, 
+            font=("Microsoft YaHei", 9), 
+            fg="white", 
+            bg="#1a73e8"
+        )
+        queue_label.pack(side=tk.RIGHT)
+        self.root.after(500, self.update_queue_depth)
         
         # 聊天历史区域
         chat_frame = tk.Frame(main_frame, bg="white", bd=1, relief=tk.SUNKEN)
@@ -162,6 +198,100 @@ class HealthAgentGUI:
             )
             btn.pack(side=tk.LEFT, padx=(0, 5))
 
+        # 搜索框：支持 user:ID|* agent:代理标识|user from:日期 to:日期 过滤
+        search_btn = tk.Button(
+            toolbar, 
+            text="搜索", 
+            command=self.search_history,
+            font=("Microsoft YaHei", 9),
+            bg="#f8f9fa",
+            fg="#5f6368",
+            relief=tk.FLAT
+        )
+        search_btn.pack(side=tk.RIGHT)
+        self.search_entry = ttk.Entry(toolbar, width=30)
+        self.search_entry.pack(side=tk.RIGHT, padx=(0, 5))
+        self.search_entry.bind("<Return>", lambda event: self.search_history())
+
+    def update_queue_depth(self):
+        """定期在状态栏显示持久化队列的深度"""
+        depth = self.persistence.depth + len(self._overflow)
+        self.queue_var.set(f"待写入: {depth}" if depth else "")
+        self.root.after(500, self.update_queue_depth)
+
+    def submit_write(self, func, *args, block=False):
+        """把写操作交给写线程，返回是否已接受
+
+        队列已满时暂存到溢出队列并在状态栏提示，稍后按原顺序重试；
+        已有暂存的操作时新操作也排在其后，保证写入顺序不变。
+        暂存也已满时：block 为True则先把暂存的操作依次提交、等待写线程腾出空位（不能丢弃的写入），
+        否则不提交并返回False，由调用方提示用户稍后再试。
+        """
+        with self._overflow_lock:
+            if not self._overflow and self.persistence.try_submit(func, *args):
+                return True
+            if len(self._overflow) >= self.max_overflow:
+                if not block:
+                    self.root.after(0, lambda: self.status_var.set("历史写入繁忙，请稍后再试"))
+                    return False
+                self._drain_overflow()
+                self.persistence.submit(func, *args)
+                return True
+            self._overflow.append((func, args))
+            pending = len(self._overflow)
+            retry = pending == 1
+        self.root.after(0, lambda: self.status_var.set(f"历史写入繁忙，{pending}项操作稍后写入"))
+        if retry:
+            self.root.after(200, self.retry_overflow)
+        return True
+
+    def writes_backlogged(self) -> bool:
+        """暂存的写操作是否已接近上限（留出一轮对话的用户消息和全部回复的空位）"""
+        return len(self._overflow) + len(self.agents) + 1 > self.max_overflow
+
+    def flush_overflow(self):
+        """把暂存的写操作按顺序提交到写线程，队列已满时等待写线程腾出空位"""
+        with self._overflow_lock:
+            self._drain_overflow()
+
+    def _drain_overflow(self):
+        # 需持有 _overflow_lock
+        while self._overflow:
+            func, args = self._overflow.popleft()
+            self.persistence.submit(func, *args)
+
+    def retry_overflow(self):
+        """把暂存的写操作依次提交到写线程，队列仍满时稍后再试"""
+        with self._overflow_lock:
+            while self._overflow and self.persistence.try_submit(self._overflow[0][0], *self._overflow[0][1]):
+                self._overflow.popleft()
+            pending = bool(self._overflow)
+        if pending:
+            self.root.after(200, self.retry_overflow)
+
+    def run_after_writes(self, work, done, action):
+        """在写线程中执行 work（排在已提交的写入之后，读到的历史是完整的），
+        完成后在界面线程调用 done(结果)；出错时弹窗提示，文件I/O不在 Tk 线程中进行"""
+        def job():
+            try:
+                result = work()
+            except Exception as e:
+                self.root.after(0, lambda m=str(e): messagebox.showerror("错误", f"{action}失败：{m}"))
+                self.root.after(0, lambda: self.status_var.set(f"{action}失败"))
+                return
+            self.root.after(0, lambda: done(result))
+
+        if self.submit_write(job):
+            self.status_var.set(f"正在{action}...")
+        else:
+            messagebox.showwarning("请稍候", f"历史写入繁忙，暂时无法{action}，请稍后再试")
+
+    def service_for(self, agent_index):
+        """获取当前用户在该代理下的 AgentService"""
+        if self.sessions is None:
+            return self.agents[agent_index]["service"]
+        return self.sessions.get(self.user_id, agent_index)
+
     def display_message(self, sender, message, tag=None):
         """在聊天历史中显示消息"""
         self.chat_history.configure(state='normal')
@@ -191,6 +321,10 @@ class HealthAgentGUI:
         if self.is_processing:
             messagebox.showwarning("请稍候", "正在处理上一个请求，请稍后再试")
             return
+        if self.writes_backlogged():
+            # 背压：写入跟不上时不再接受新的对话，暂存的写入不会无限增长
+            messagebox.showwarning("请稍候", "历史记录写入繁忙，请稍后再发送")
+            return
             
         raw_input = self.user_input.get("1.0", tk.END).strip()
         if not raw_input:
@@ -199,15 +333,12 @@ class HealthAgentGUI:
         # 清空输入框
         self.user_input.delete("1.0", tk.END)
         
-        # 预处理输入
-        preprocessed = self.preprocessor.preprocess(raw_input)
-        
-        # 验证输入
-        is_valid, error_info = self.preprocessor.validate(preprocessed)
-        if not is_valid:
-            error_type, error_msg = error_info
-            self.display_message("系统", f"{error_type}：{error_msg}", "error")
+        # 预处理输入：一遍得到规范化文本和判定结果
+        result = self.preprocessor.preprocess(raw_input)
+        if not result.ok:
+            self.display_message("系统", f"{result.error_type}：{result.message}", "error")
             return
+        preprocessed = result.text
         
         # 显示用户消息
         self.display_message("您", raw_input, "user")
@@ -261,48 +392,75 @@ class HealthAgentGUI:
 
     #以下是流式响应
     def get_all_agents_response(self, preprocessed_input):
-        """获取所有代理的响应（流式输出）"""
-        for i, agent_info in enumerate(self.agents):
-            try:
-                # 获取Agent响应
-                response = agent_info["service"].chat(preprocessed_input)
+        """并发获取所有代理的响应（流式输出）
+
+        每个代理在聊天区有独立的显示区域，先返回的内容先显示
+        """
+        # 无论中途出现什么错误，最后都要重置处理状态，否则界面会一直停在“思考中”
+        finished = set()
+        streamed = set()
+        try:
+            # 等待上一轮的消息写入完成，读取的上下文才完整（在工作线程中等待，不阻塞界面）
+            self.persistence.drain(timeout=10)
+            jobs = []
+            for i, agent_info in enumerate(self.agents):
+                try:
+                    # 构建上下文（不含本轮消息），长度由上下文组装器的 token 预算控制
+                    history = agent_info["history"].load_recent(self.user_id, agent_info["context"].history_window)
+                    summary = agent_info["history"].load_summary(self.user_id)
+                    full_input = agent_info["context"].build(history, preprocessed_input, summary)
+                    jobs.append((i, self.service_for(i), full_input))
+                except Exception as e:
+                    finished.add(i)
+                    self.report_agent_error(i, e)
+            # 用户消息只保存一次，所有代理共享
+            self.save_to_history(RoleType.USER, preprocessed_input)
+
+            for kind, i, payload in self.fanout.stream(jobs, question=preprocessed_input):
+                agent_name = self.agents[i]['name']
+
+                if kind == AgentFanout.DELTA:
+                    # 模型每返回一段就在主线程中追加显示
+                    if i not in streamed:
+                        streamed.add(i)
+                        self.root.after(0, lambda n=agent_name, k=i: self.begin_stream(n, stream_id=k))
+                    self.root.after(0, lambda t=payload, k=i: self.append_stream(t, stream_id=k))
+
+                elif kind == AgentFanout.DONE:
+                    finished.add(i)
+                    # 在主线程中完成显示并保存
+                    final_response = {
+                        "agent_name": agent_name,
+                        "content": payload.content,
+                        "advice_type": payload.advice_type,
+                        "agent_index": i,
+                        "streamed": i in streamed
+                    }
+                    self.root.after(0, lambda r=final_response: self.finalize_response(r))
 
-                # #以下是长记忆性
-                # # 获取当前代理的历史记录
-                # current_history = self.history_managers[i].load(self.user_id)
-                
-                # # 获取Agent响应（传递用户ID、消息和历史记录）
-                # response = agent_info["service"].chat(
-                #     self.user_id, 
-                #     preprocessed_input,
-                #     current_history  # 传递完整的历史记录
-                # )
-                
-                # 解析响应
-                if isinstance(response, HealthOutputSchema):
-                    agent_response = response.content
-                    advice_type = response.advice_type
-                    status_text = f"{agent_info['name']}: {advice_type}建议"
-                elif isinstance(response, dict) and 'content' in response:
-                    agent_response = response['content']
-                    advice_type = response.get('advice_type', '未知')
-                    status_text = f"{agent_info['name']}: {advice_type}建议"
                 else:
-                    agent_response = str(response)
-                    status_text = f"{agent_info['name']}: 回复"
-                
-                # 在主线程中启动流式输出
-                final_response = {
-                    "agent_name": agent_info['name'],
-                    "content": agent_response,
-                    "advice_type": advice_type,
-                    "agent_index": i
-                }
-                self.root.after(0, lambda r=final_response: self.finalize_response(r))
-                
-            except Exception as e:
-                error_msg = f"{agent_info['name']}处理出错：{str(e)}"
-                self.root.after(0, lambda: self.display_message("系统", error_msg, "error"))
+                    finished.add(i)
+                    self.report_agent_error(i, payload, i in streamed)
+
+            # 对话间隙在后台把较早的对话压缩进滚动摘要
+            if self.compactor is not None:
+                for i, agent_info in enumerate(self.agents):
+                    self.compactor.schedule(self.service_for(i), agent_info["history"], self.user_id)
+        except Exception as e:
+            # 尚未回复的代理各自显示错误
+            for i in range(len(self.agents)):
+                if i not in finished:
+                    self.report_agent_error(i, e, i in streamed)
+            self.root.after(0, lambda: self.status_var.set("处理出错"))
+        finally:
+            self.root.after(0, self.finish_processing)
+
+    def report_agent_error(self, agent_index, error, streamed=False):
+        """在主线程中显示某个代理的错误（工作线程调用），已开始的流式显示区域先结束"""
+        error_msg = f"{self.agents[agent_index]['name']}处理出错：{str(error)}"
+        if streamed:
+            self.root.after(0, lambda k=agent_index: self.end_stream(stream_id=k))
+        self.root.after(0, lambda m=error_msg: self.display_message("系统", m, "error"))
     
     # def finalize_response(self, response_data):
     #     """处理并显示最终响应"""
@@ -328,23 +486,27 @@ class HealthAgentGUI:
         agent_name = response_data["agent_name"]
         content = response_data["content"]
         
-        # 使用流式输出显示回复
-        self.stream_message(agent_name, content, "agent")
+        agent_index = response_data["agent_index"]
+        
+        if response_data.get("streamed"):
+            # 内容已实时显示，结束该代理的显示区域
+            self.end_stream(stream_id=agent_index)
+        else:
+            # 模型未按JSON输出content时，直接显示完整回复
+            self.display_message(agent_name, content, "agent")
         
         # 保存到历史记录
-        agent_index = response_data["agent_index"]
         self.save_to_history(RoleType.ASSISTANT, content, agent_index)
         
         # 更新状态
-        self.status_var.set(f"{agent_name} 正在回复...")
-        
-        # 如果是最后一个代理回复，重置处理状态
-        if agent_index == len(self.agents) - 1:
-            self.is_processing = False
-            self.status_var.set(f"{agent_name} 已回复")
+        self.status_var.set(f"{agent_name} 已回复")
 
-    def save_to_history(self, role, content, agent_index):
-        """保存消息到历史记录"""
+    def finish_processing(self):
+        """所有代理均已回复，重置处理状态"""
+        self.is_processing = False
+
+    def save_to_history(self, role, content, agent_index=None):
+        """保存消息到历史记录，agent_index为None时保存为所有代理共享的用户消息"""
         # 构建消息记录
         timestamp = datetime.now().isoformat()
         message_record = {
@@ -353,31 +515,48 @@ class HealthAgentGUI:
             "timestamp": timestamp
         }
         
-        # 获取当前历史记录
-        current_history = self.history_managers[agent_index].load(self.user_id)
-        
-        # 添加新记录
-        current_history.append(message_record)
-        
-        # 保存历史
-        self.history_managers[agent_index].save(self.user_id, current_history)
+        # 交给后台写线程追加到历史记录末尾，队列已满时暂存稍后写入，不阻塞界面
+        # 对话消息不能丢弃：暂存也满时等待写线程（send_message 已在积压时拒绝新输入，一般不会发生）
+        if agent_index is None:
+            self.submit_write(self.history.append, self.user_id, [message_record], block=True)
+        else:
+            self.submit_write(self.agents[agent_index]["history"].append, self.user_id, [message_record], block=True)
 
     
     
+    def agent_name(self, agent_id):
+        """统一历史中 agent 字段对应的代理名称"""
+        return next((a["name"] for a in self.agents if a["id"] == agent_id), "未知代理")
+
+    def recent_history(self, user_id):
+        """所有代理最近 display_limit 条消息（按时间顺序），只读取窗口内的消息，应在写线程中调用"""
+        return list(self.history.iter_history(user_id, limit=self.display_limit))
+
     def load_history(self):
-        """加载所有代理的历史记录并显示"""
-        for i, manager in enumerate(self.history_managers):
-            history = manager.load(self.user_id)
-            agent_name = self.agents[i]["name"]
+        """在写线程中读取最近的历史记录，读完后在界面线程按时间顺序显示"""
+        user_id = self.user_id
+
+        def done(records):
+            # 期间已切换用户时不覆盖当前显示
+            if user_id == self.user_id:
+                self.display_history(records)
+                self.status_var.set("就绪")
+
+        self.run_after_writes(lambda: self.recent_history(user_id), done, "加载历史记录")
+
+    def display_history(self, records):
+        """清空聊天区并显示已加载的历史记录"""
+        self.chat_history.configure(state='normal')
+        self.chat_history.delete(1.0, tk.END)
+        self.chat_history.configure(state='disabled')
+        for record in records:
+            role = record["role"]
+            content = record["content"]
             
-            for record in history:
-                role = record["role"]
-                content = record["content"]
-                
-                if role == RoleType.USER:
-                    self.display_message("您", content, "user")
-                elif role == RoleType.ASSISTANT:
-                    self.display_message(agent_name, content, "agent")
+            if role == RoleType.USER:
+                self.display_message("您", content, "user")
+            elif role == RoleType.ASSISTANT:
+                self.display_message(self.agent_name(record.get("agent")), content, "agent")
 
     
     
@@ -385,13 +564,16 @@ class HealthAgentGUI:
     def clear_history(self):
         """清除所有聊天历史"""
         if messagebox.askyesno("确认", "确定要清除所有聊天历史吗？"):
+            # 清除所有历史记录（排在已提交的写入之后执行）
+            if not self.submit_write(self.history.clear, self.user_id):
+                messagebox.showwarning("请稍候", "历史写入繁忙，暂时无法清除，请稍后再试")
+                return
             self.chat_history.configure(state='normal')
             self.chat_history.delete(1.0, tk.END)
             self.chat_history.configure(state='disabled')
             
-            # 清除所有历史记录
-            for manager in self.history_managers:
-                manager.clear(self.user_id)
+            if self.sessions is not None:
+                self.sessions.discard(self.user_id)
             self.status_var.set("历史记录已清除")
 
     def save_history(self):
@@ -405,99 +587,113 @@ class HealthAgentGUI:
         if filename:
             if not filename.endswith('.json'):
                 filename += '.json'
-            
-            try:
-                # 合并所有代理的历史记录
-                all_history = []
-                for i, manager in enumerate(self.history_managers):
-                    history = manager.load(self.user_id)
-                    agent_name = self.agents[i]["name"]
-                    for record in history:
-                        record["agent"] = agent_name
-                    all_history.extend(history)
+            user_id = self.user_id
+            agent_names = {a["id"]: a["name"] for a in self.agents}
+
+            def work():
+                # 统一历史已按时间顺序包含所有代理的消息
+                all_history = self.history.load(user_id)
+                for record in all_history:
+                    record["role"] = record["role"].value
+                    if "agent" in record:
+                        record["agent"] = agent_names.get(record["agent"], "未知代理")
                 
                 with open(filename, 'w', encoding='utf-8') as f:
                     json.dump(all_history, f, ensure_ascii=False, indent=2)
-                self.status_var.set(f"历史记录已保存到 {filename}")
-            except Exception as e:
-                messagebox.showerror("错误", f"保存失败：{str(e)}")
+
+            self.run_after_writes(work, lambda _: self.status_var.set(f"历史记录已保存到 {filename}"), "保存")
 
     def load_history_dialog(self):
-        """加载历史记录对话框"""
+        """加载历史记录对话框（支持 .json/.jsonl/.csv）"""
         filename = simpledialog.askstring("加载历史记录", "输入文件名：")
         if filename and os.path.exists(filename):
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-                
-                # 清除当前历史
-                self.chat_history.configure(state='normal')
-                self.chat_history.delete(1.0, tk.END)
-                self.chat_history.configure(state='disabled')
-                
-                # 保存新历史
-                for record in history:
-                    agent_name = record.get("agent", "未知代理")
-                    agent_index = next((i for i, a in enumerate(self.agents) if a["name"] == agent_name), -1)
-                    if agent_index >= 0:
-                        # 保存到对应的历史管理器
-                        self.save_to_history(
-                            RoleType(record["role"]),
-                            record["content"],
-                            agent_index
-                        )
-                
-                # 显示新历史
-                self.load_history()
-                self.status_var.set(f"已加载历史记录：{filename}")
-            except Exception as e:
-                messagebox.showerror("错误", f"加载失败：{str(e)}")
+            user_id = self.user_id
+            agent_ids = {a["name"]: a["id"] for a in self.agents}
+
+            def work():
+                records = read_records(filename, agent_ids)
+                # 校验、去重后一次写入，消息按原时间戳合并进已有历史
+                result = self.history.bulk_import(user_id, records)
+                return result, self.recent_history(user_id)
+
+            def done(outcome):
+                result, records = outcome
+                # 重新显示历史（期间已切换用户时不覆盖当前显示）
+                if user_id == self.user_id:
+                    self.display_history(records)
+                self.status_var.set(
+                    f"已加载历史记录：{filename}（导入{result['imported']}条，"
+                    f"重复{result['duplicates']}条，无效{result['invalid']}条，其中写入归档{result['archived']}条）"
+                )
+
+            self.run_after_writes(work, done, "加载")
 
     def export_history(self):
-        """导出历史记录为文本文件"""
+        """导出历史记录，按扩展名选择格式（.txt/.jsonl/.csv/.md）"""
         filename = simpledialog.askstring(
             "导出历史记录", 
-            "输入文件名：", 
+            "输入文件名（支持 .txt/.jsonl/.csv/.md）：", 
             initialvalue=f"chat_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
         )
         
         if filename:
-            if not filename.endswith('.txt'):
-                filename += '.txt'
+            fmt = format_for(filename)
+            if not filename.endswith(FORMATS[fmt].extension):
+                filename += FORMATS[fmt].extension
             
+            user_id = self.user_id
+            agent_names = {a["id"]: a["name"] for a in self.agents}
+
+            def work():
+                # 从存储后端分批读取并逐条写入，不在内存中保留完整历史
+                return export_to_file(self.history, [user_id], filename, fmt, agent_names)
+
+            self.run_after_writes(
+                work, lambda count: self.status_var.set(f"历史记录已导出到 {filename}（{count}条）"), "导出")
+
+    def search_history(self):
+        """在后台线程中检索历史记录，结果显示在新窗口中"""
+        query, filters = parse_query(self.search_entry.get().strip())
+        if not query:
+            return
+        user_id = filters.get("user", self.user_id)
+        self.status_var.set("正在检索...")
+
+        def run():
+            start = time.time()
             try:
-                with open(filename, 'w', encoding='utf-8') as f:
-                    # 获取所有历史记录
-                    all_history = []
-                    for i, manager in enumerate(self.history_managers):
-                        history = manager.load(self.user_id)
-                        agent_name = self.agents[i]["name"]
-                        for record in history:
-                            record["agent"] = agent_name
-                        all_history.extend(history)
-                    
-                    # 按时间排序
-                    all_history.sort(key=lambda x: x.get("timestamp", ""))
-                    
-                    for record in all_history:
-                        role = "您" if record["role"] == RoleType.USER else record["agent"]
-                        timestamp = record.get("timestamp", "")
-                        
-                        if timestamp:
-                            try:
-                                dt = datetime.fromisoformat(timestamp)
-                                timestamp_str = dt.strftime("%Y-%m-%d %H:%M:%S")
-                            except:
-                                timestamp_str = timestamp
-                        else:
-                            timestamp_str = ""
-                        
-                        f.write(f"[{timestamp_str}] {role}：\n")
-                        f.write(record["content"] + "\n\n")
-                
-                self.status_var.set(f"历史记录已导出到 {filename}")
+                results = self.search.search(
+                    query,
+                    user_id=None if user_id == "*" else user_id,
+                    agent=filters.get("agent"),
+                    date_from=filters.get("from"),
+                    date_to=filters.get("to")
+                )
             except Exception as e:
-                messagebox.showerror("错误", f"导出失败：{str(e)}")
+                self.root.after(0, lambda m=str(e): messagebox.showerror("错误", f"检索失败：{m}"))
+                return
+            elapsed = (time.time() - start) * 1000
+            self.root.after(0, lambda: self.show_search_results(query, results, elapsed))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def show_search_results(self, query, results, elapsed):
+        """显示检索结果"""
+        self.status_var.set(f"找到 {len(results)} 条结果（{elapsed:.1f}ms）")
+        window = tk.Toplevel(self.root)
+        window.title(f"搜索：{query}")
+        window.geometry("600x400")
+        text = scrolledtext.ScrolledText(window, wrap=tk.WORD, font=("Microsoft YaHei", 10), padx=10, pady=10)
+        text.pack(fill=tk.BOTH, expand=True)
+        text.tag_config("meta", foreground="#5f6368", font=("Microsoft YaHei", 9))
+        if not results:
+            text.insert(tk.END, "没有找到相关的历史记录")
+        for result in results:
+            speaker = "您" if result["role"] == "user" else self.agent_name(result["agent"])
+            timestamp = result["timestamp"][:19].replace("T", " ")
+            text.insert(tk.END, f"[{timestamp}] {result['user_id']} · {speaker}\n", "meta")
+            text.insert(tk.END, result["snippet"] + "\n\n")
+        text.configure(state='disabled')
 
     def open_settings(self):
         """打开设置窗口"""
@@ -528,25 +724,28 @@ class HealthAgentGUI:
             
             # 如果用户ID发生变化
             if new_user_id != self.user_id:
-                # 保存当前用户的所有历史记录
-                for manager in self.history_managers:
-                    manager.save(self.user_id, manager.load(self.user_id))
-                
                 # 更新用户ID
                 self.user_id = new_user_id
                 
                 # 清除当前聊天显示
-                self.chat_history.configure(state='normal')
-                self.chat_history.delete(1.0, tk.END)
-                self.chat_history.configure(state='disabled')
+                self.display_history([])
                 
-                # 加载新用户的历史记录
-                self.load_history()
-                self.status_var.set(f"已切换到用户: {self.user_id}")
+                # 在写线程中保存当前用户的所有历史记录，再加载新用户的历史记录
+                def work():
+                    self.history.flush()
+                    return self.recent_history(new_user_id)
+
+                def done(records):
+                    if new_user_id == self.user_id:
+                        self.display_history(records)
+                        self.status_var.set(f"已切换到用户: {self.user_id}")
+
+                self.run_after_writes(work, done, "切换用户")
             else:
                 # 更新敏感词
                 sensitive_words = [w.strip() for w in sensitive_entry.get().split(",") if w.strip()]
                 self.preprocessor.sensitive_words = sensitive_words
+                self.preprocessor.compile_rules()
                 self.status_var.set("设置已保存")
                 
             settings.destroy()
@@ -556,10 +755,26 @@ class HealthAgentGUI:
     def on_closing(self):
         """关闭窗口时的处理"""
         if messagebox.askokcancel("退出", "确定要退出健康助手吗？"):
-            # 保存所有历史
-            for manager in self.history_managers:
-                manager.save(self.user_id, manager.load(self.user_id))
-            self.root.destroy()
+            # 排在队列中的写入之后写入所有未保存的历史，界面保持响应，写完后再关闭窗口
+            self.is_processing = True  # 关闭期间不再接受新消息
+            # 窗口关闭后不再有 root.after 重试，暂存的操作在此全部交给写线程
+            self.flush_overflow()
+            self.persistence.submit(self.history.flush)
+            self.close_when_saved(time.monotonic() + 30)
+
+    def close_when_saved(self, deadline):
+        """定期检查待写入的操作，全部写完或超时后关闭窗口"""
+        pending = self.persistence.depth + len(self._overflow)
+        if pending and time.monotonic() < deadline:
+            self.status_var.set(f"正在保存历史记录（{pending}条待写入）...")
+            self.root.after(100, self.close_when_saved, deadline)
+            return
+        if pending:
+            # 窗口关闭后由 main 继续等待写线程
+            print("⚠️ 历史记录未能在30秒内全部写入")
+        else:
+            self.persistence.close(timeout=0)
+        self.root.destroy()
 
 
 
@@ -578,6 +793,32 @@ class HealthAgentGUI:
         self.streaming_delay = delay
         self.stream_next_char()
 
+    def begin_stream(self, agent_name, tag="agent", stream_id=0):
+        """为模型实时返回的回复开辟显示区域
+
+        区域末尾预留的空行之前放置一个标记，之后该代理的文本都插入到
+        标记处，多个代理同时输出时互不干扰
+        """
+        mark = f"stream_{stream_id}"
+        self.chat_history.configure(state='normal')
+        self.chat_history.insert(tk.END, f"{agent_name}：\n", tag)
+        self.chat_history.insert(tk.END, "\n\n", tag)
+        self.chat_history.mark_set(mark, "end-3c")
+        self.chat_history.mark_gravity(mark, tk.RIGHT)
+        self.chat_history.configure(state='disabled')
+        self.chat_history.see(tk.END)
+
+    def append_stream(self, text, tag="agent", stream_id=0):
+        """在对应代理的显示区域追加一段文本"""
+        self.chat_history.configure(state='normal')
+        self.chat_history.insert(f"stream_{stream_id}", text, tag)
+        self.chat_history.configure(state='disabled')
+        self.chat_history.see(f"stream_{stream_id}")
+
+    def end_stream(self, stream_id=0):
+        """结束对应代理的实时回复"""
+        self.chat_history.mark_unset(f"stream_{stream_id}")
+
     def stream_next_char(self):
         """显示下一个字符"""
         if self.streaming_index < len(self.streaming_content):
@@ -0,0 +1,363 @@
+# history_archive.py
+"""聊天历史压缩归档层
+
+很少再读取的旧消息从热存储移入压缩归档文件，HistoryManager 读取时自动拼接归档与热数据。
+
+命令行用法（归档所有用户的旧消息）:
+  python -m history_archive [--age-days 30] [--codec zlib|gzip|lzma]
+                            [--backend journal] [--history chat_history.json] [--db chat_history.db]
+"""
+import argparse
+import gzip
+import json
+import lzma
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import List, Dict, Any, Iterator
+
+from history_store import FileLock, BACKEND_JOURNAL, create_store, visible_to
+
+# 压缩算法名 -> (压缩, 解压)
+CODECS = {
+    "gzip": (gzip.compress, gzip.decompress),
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress)
+}
+
+
+class HistoryArchive:
+    """压缩归档文件
+
+    文件平时只追加，由若干块组成：每块是一行JSON块头加紧随其后的压缩数据。块头记录
+    用户、消息条数、首尾时间戳、压缩算法和数据长度，打开时只读块头建立索引（跳过数据），
+    查询时只解压与所需时间范围相交的块，最近解压过的块缓存在内存中。
+    清除用户时追加删除标记，之前的块不再可见。replace 整体改写一个用户的归档：新块带暂存标记，
+    全部写完后再追加提交标记，提交前中断时旧块仍然有效。写入在跨进程锁内完成，其他进程
+    读取前按文件大小发现新增的块；写入中断留下的不完整尾部在下次写入前截掉。
+
+    被删除和被替换的块仍留在文件中，compact 重写文件只保留有效的块。清除用户后立即压缩，
+    其归档消息不会留在磁盘上；关闭时无效数据超过 compact_ratio 也会压缩。其他进程发现
+    文件被替换（inode 变化）后重新打开并建立索引。
+    """
+
+    def __init__(self, archive_file: str, codec: str = "zlib", chunk_size: int = 200, cache_chunks: int = 8,
+                 min_compact_bytes: int = 1 << 20, compact_ratio: float = 0.5):
+        if codec not in CODECS:
+            raise ValueError(f"未知的压缩算法: {codec}")
+        self.archive_file = archive_file
+        self.codec = codec
+        self.chunk_size = chunk_size
+        self.cache_chunks = cache_chunks
+        self.min_compact_bytes = min_compact_bytes
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(archive_file + '.lock')
+
+        # 统计信息
+        self.chunks_read = 0
+        self.compactions = 0
+
+        open(archive_file, 'ab').close()
+        self._open()
+
+    def _open(self):
+        self._file = open(self.archive_file, 'rb')
+        # user_id -> [块头, ...]，块头中的 start 为块头位置、offset 为数据位置
+        self._index = {}
+        self._staged = {}   # (user_id, 暂存标记) -> [块头, ...]，提交后替换该用户的块
+        self._end = 0       # 已建立索引的文件位置
+        self._cache = OrderedDict()  # 数据位置 -> 解压后的消息
+        self._sync()
+
+    def _sync(self):
+        """读取其他进程（或本进程）新追加的块头"""
+        with self._lock:
+            try:
+                replaced = os.stat(self.archive_file).st_ino != os.fstat(self._file.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = False
+            if replaced:
+                # 文件已被其他进程压缩重写
+                self._file.close()
+                self._open()
+                return
+            size = os.fstat(self._file.fileno()).st_size
+            if size < self._end:
+                # 文件被替换或截短，重新建立索引
+                self._index.clear()
+                self._staged.clear()
+                self._cache.clear()
+                self._end = 0
+            self._file.seek(self._end)
+            while self._end < size:
+                line = self._file.readline()
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    header = json.loads(line)
+                except ValueError:
+                    break
+                offset = self._end + len(line)
+                length = header.get("length", 0)
+                if offset + length > size:
+                    break  # 数据尚未写完
+                user_id = header["user_id"]
+                if header.get("deleted"):
+                    self._index.pop(user_id, None)
+                elif "commit" in header:
+                    chunks = self._staged.pop((user_id, header["commit"]), [])
+                    if chunks:
+                        self._index[user_id] = chunks
+                    else:
+                        self._index.pop(user_id, None)
+                elif "staged" in header:
+                    self._staged.setdefault((user_id, header["staged"]), []).append(
+                        dict(header, offset=offset, start=self._end))
+                else:
+                    self._index.setdefault(user_id, []).append(dict(header, offset=offset, start=self._end))
+                self._end = offset + length
+                self._file.seek(self._end)
+
+    def _write(self, blocks: List[bytes]) -> bool:
+        with self._lock, self._file_lock:
+            self._sync()
+            try:
+                with open(self.archive_file, 'r+b') as f:
+                    if os.fstat(f.fileno()).st_size > self._end:
+                        # 截掉中断的写入留下的不完整尾部
+                        f.truncate(self._end)
+                    f.seek(self._end)
+                    for block in blocks:
+                        f.write(block)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                print(f"⚠️ 归档写入失败: {str(e)}")
+                return False
+            self._sync()
+            return True
+
+    @staticmethod
+    def _header(header: Dict[str, Any]) -> bytes:
+        return (json.dumps(header, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _blocks(self, user_id: str, messages: List[Dict[str, Any]], **extra) -> List[bytes]:
+        compress = CODECS[self.codec][0]
+        blocks = []
+        for start in range(0, len(messages), self.chunk_size):
+            chunk = messages[start:start + self.chunk_size]
+            raw = json.dumps(chunk, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            data = compress(raw)
+            blocks.append(self._header(dict({
+                "user_id": user_id,
+                "count": len(chunk),
+                "first": chunk[0].get("timestamp", ""),
+                "last": chunk[-1].get("timestamp", ""),
+                "codec": self.codec,
+                "raw": len(raw),
+                "length": len(data)
+            }, **extra)) + data)
+        return blocks
+
+    def add(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """把按时间排序的消息（序列化格式）按 chunk_size 分块压缩后追加，消息应晚于已归档的消息"""
+        blocks = self._blocks(user_id, messages)
+        return self._write(blocks) if blocks else True
+
+    def replace(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """用按时间排序的消息整体替换用户的归档（用于插入早于已归档消息的记录）"""
+        token = uuid.uuid4().hex
+        blocks = self._blocks(user_id, messages, staged=token)
+        blocks.append(self._header({"user_id": user_id, "commit": token, "length": 0}))
+        with self._lock:
+            if not self._write(blocks):
+                return False
+            self._maybe_compact()
+            return True
+
+    def clear(self, user_id: str) -> bool:
+        """清除用户的归档，并立即压缩文件，清除的消息不留在磁盘上"""
+        with self._lock:
+            self._sync()
+            if user_id not in self._index:
+                return True
+            if not self._write([self._header({"user_id": user_id, "deleted": True, "length": 0})]):
+                return False
+            return self.compact()
+
+    def garbage(self) -> int:
+        """文件中已删除或被替换的块（含标记行）占用的字节数"""
+        with self._lock:
+            self._sync()
+            live = sum(h["offset"] + h["length"] - h["start"] for chunks in self._index.values() for h in chunks)
+            return self._end - live
+
+    def _maybe_compact(self):
+        if self._end >= self.min_compact_bytes and self.garbage() > self._end * self.compact_ratio:
+            self.compact()
+
+    def compact(self) -> bool:
+        """重写归档文件，只保留各用户有效的块（块头中的暂存标记一并去掉）"""
+        with self._lock, self._file_lock:
+            self._sync()
+            temp_file = f"{self.archive_file}.{os.getpid()}.tmp"
+            try:
+                with open(temp_file, 'wb') as out:
+                    for chunks in self._index.values():
+                        for header in chunks:
+                            self._file.seek(header["offset"])
+                            data = self._file.read(header["length"])
+                            out.write(self._header({k: v for k, v in header.items()
+                                                    if k not in ("offset", "start", "staged")}) + data)
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(temp_file, self.archive_file)
+            except Exception as e:
+                print(f"⚠️ 归档压缩失败: {str(e)}")
+                try:
+                    os.remove(temp_file)
+                except OSError:
+                    pass
+                return False
+            self._file.close()
+            self._open()
+            self.compactions += 1
+            return True
+
+    def _chunk(self, header: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """解压一个块（需持有锁）"""
+        offset = header["offset"]
+        messages = self._cache.get(offset)
+        if messages is not None:
+            self._cache.move_to_end(offset)
+            return messages
+        self._file.seek(offset)
+        data = self._file.read(header["length"])
+        messages = json.loads(CODECS[header["codec"]][1](data))
+        self.chunks_read += 1
+        self._cache[offset] = messages
+        while len(self._cache) > self.cache_chunks:
+            self._cache.popitem(last=False)
+        return messages
+
+    def chunks(self, user_id: str) -> List[Dict[str, Any]]:
+        """用户的块头列表（按时间顺序）"""
+        with self._lock:
+            self._sync()
+            return list(self._index.get(user_id, []))
+
+    def count(self, user_id: str) -> int:
+        return sum(header["count"] for header in self.chunks(user_id))
+
+    def load(self, user_id: str, start: str = None, end: str = None) -> List[Dict[str, Any]]:
+        """返回时间戳在 [start, end) 内的归档消息，只解压时间范围相交的块"""
+        messages = []
+        with self._lock:
+            for header in self.chunks(user_id):
+                if (start is not None and header["last"] < start) or (end is not None and header["first"] >= end):
+                    continue
+                messages.extend(m for m in self._chunk(header)
+                                if (start is None or m.get("timestamp", "") >= start)
+                                and (end is None or m.get("timestamp", "") < end))
+        return messages
+
+    def load_before(self, user_id: str, before: str = None, limit: int = 50,
+                    agent: str = None) -> List[Dict[str, Any]]:
+        """返回时间戳早于 before 的最近 limit 条归档消息（按时间顺序），从最新的块向前解压
+
+        agent 不为None时只返回该代理可见的消息
+        """
+        if limit <= 0:
+            return []
+        collected = []
+        with self._lock:
+            for header in reversed(self.chunks(user_id)):
+                if before is not None and header["first"] >= before:
+                    continue
+                chunk = self._chunk(header)
+                if (before is not None and header["last"] >= before) or agent is not None:
+                    chunk = [m for m in chunk
+                             if (before is None or m.get("timestamp", "") < before) and visible_to(m, agent)]
+                collected[:0] = chunk
+                if len(collected) >= limit:
+                    break
+        return collected[-limit:]
+
+    def iter_messages(self, user_id: str) -> Iterator[Dict[str, Any]]:
+        """逐块解压，按时间顺序产出用户的全部归档消息"""
+        for header in self.chunks(user_id):
+            with self._lock:
+                chunk = self._chunk(header)
+            yield from chunk
+
+    def unarchived(self, user_id: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """去掉已在最后一个块中的消息（上次归档后未能从热存储删除时会出现）"""
+        with self._lock:
+            headers = self.chunks(user_id)
+            if not headers:
+                return messages
+            archived = {(m.get("timestamp"), m.get("content")) for m in self._chunk(headers[-1])}
+        return [m for m in messages if (m.get("timestamp"), m.get("content")) not in archived]
+
+    def users(self) -> List[str]:
+        with self._lock:
+            self._sync()
+            return list(self._index)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sync()
+            headers = [h for chunks in self._index.values() for h in chunks]
+            return {
+                "archive_users": len(self._index),
+                "archive_chunks": len(headers),
+                "archive_messages": sum(h["count"] for h in headers),
+                "archive_raw_bytes": sum(h["raw"] for h in headers),
+                "archive_bytes": sum(h["length"] for h in headers),
+                "archive_garbage_bytes": self.garbage(),
+                "archive_chunks_read": self.chunks_read,
+                "archive_compactions": self.compactions
+            }
+
+    def close(self):
+        with self._lock:
+            self._maybe_compact()
+            self._file.close()
+        self._file_lock.close()
+
+
+def main():
+    # 延迟导入：HistoryManager 依赖 camel
+    from history_manager import HistoryManager
+
+    parser = argparse.ArgumentParser(description="把较早的聊天历史移入压缩归档")
+    parser.add_argument("--age-days", type=float, default=30, help="早于该天数的消息移入归档")
+    parser.add_argument("--codec", choices=sorted(CODECS), default="zlib", help="压缩算法")
+    parser.add_argument("--backend", default=BACKEND_JOURNAL, help="历史存储后端")
+    parser.add_argument("--history", default="chat_history.json", help="统一历史文件")
+    parser.add_argument("--db", default="chat_history.db", help="sqlite 后端的数据库文件")
+    args = parser.parse_args()
+
+    manager = HistoryManager(
+        args.history,
+        create_store(args.backend, args.history, args.db),
+        archive=HistoryArchive(args.history + ".archive", codec=args.codec),
+        archive_age=args.age_days * 24 * 3600
+    )
+    start = time.time()
+    try:
+        total = sum(manager.archive_old(record["user_id"]) for record in manager.store.records())
+        stats = manager.archive.stats()
+    finally:
+        manager.close()
+    ratio = stats["archive_bytes"] / stats["archive_raw_bytes"] if stats["archive_raw_bytes"] else 0
+    print(f"归档完成：本次移入 {total} 条消息，归档共 {stats['archive_messages']} 条，"
+          f"压缩率 {ratio:.1%}，耗时 {time.time() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# history_export.py
+"""聊天历史导出与导入文件读取
+
+各用户的统一历史本身已按时间排序，导出时用 heapq.merge 对这些有序流做多路归并，
+边读边写，内存占用与历史总量无关。支持 TXT（与原导出格式相同）、JSONL、CSV 和 Markdown。
+JSON（图形界面“保存历史”的格式）、JSONL 和 CSV 文件可由 read_records 读回，
+交给 HistoryManager.bulk_import 导入。
+
+命令行用法（无需启动图形界面）:
+  python -m history_export --user default_user [--user 其他用户 ...] [--format txt|jsonl|csv|md]
+                           [-o 输出文件] [--backend journal] [--history chat_history.json] [--db chat_history.db]
+"""
+import argparse
+import csv
+import heapq
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Any, Iterable, Iterator, List
+
+from history_store import BACKEND_JOURNAL, create_store
+
+
+class ExportFormat:
+    """导出格式：header/footer 写在开头和结尾，write 每条消息调用一次"""
+
+    extension = ".txt"
+    encoding = "utf-8"
+
+    def header(self, f):
+        pass
+
+    def write(self, f, record: Dict[str, Any]):
+        raise NotImplementedError
+
+    def footer(self, f):
+        pass
+
+    @staticmethod
+    def format_time(timestamp: str) -> str:
+        if not timestamp:
+            return ""
+        try:
+            return datetime.fromisoformat(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return timestamp
+
+
+class TextFormat(ExportFormat):
+    def write(self, f, record):
+        f.write(f"[{self.format_time(record['timestamp'])}] {record['speaker']}：\n")
+        f.write(record["content"] + "\n\n")
+
+
+class JsonLinesFormat(ExportFormat):
+    extension = ".jsonl"
+    FIELDS = ("timestamp", "user_id", "role", "agent", "speaker", "content")
+
+    def write(self, f, record):
+        f.write(json.dumps({k: record[k] for k in self.FIELDS}, ensure_ascii=False) + "\n")
+
+
+class CsvFormat(ExportFormat):
+    extension = ".csv"
+    # 带BOM，Excel 可以直接识别中文
+    encoding = "utf-8-sig"
+
+    def header(self, f):
+        self._writer = csv.writer(f)
+        self._writer.writerow(JsonLinesFormat.FIELDS)
+
+    def write(self, f, record):
+        self._writer.writerow([record[k] for k in JsonLinesFormat.FIELDS])
+
+
+class MarkdownFormat(ExportFormat):
+    extension = ".md"
+
+    def header(self, f):
+        f.write(f"# 聊天记录导出\n\n导出时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+
+    def write(self, f, record):
+        f.write(f"### {record['speaker']} · {self.format_time(record['timestamp'])}\n\n")
+        f.write(record["content"] + "\n\n")
+
+
+FORMATS = {
+    "txt": TextFormat,
+    "jsonl": JsonLinesFormat,
+    "csv": CsvFormat,
+    "md": MarkdownFormat
+}
+
+
+def format_for(filename: str, default: str = "txt") -> str:
+    """按文件扩展名选择导出格式"""
+    extension = os.path.splitext(filename)[1].lower()
+    for name, cls in FORMATS.items():
+        if cls.extension == extension:
+            return name
+    return default
+
+
+def merge_streams(streams: Dict[str, Iterable[Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+    """对多个按时间排序的消息流做多路归并，产出带 user_id 的消息"""
+    def tagged(user_id, messages):
+        for message in messages:
+            yield dict(message, user_id=user_id)
+
+    return heapq.merge(*(tagged(u, m) for u, m in streams.items()),
+                       key=lambda m: m.get("timestamp", ""))
+
+
+def export_messages(streams: Dict[str, Iterable[Dict[str, Any]]], f, fmt: str = "txt",
+                    agent_names: Dict[str, str] = None) -> int:
+    """把归并后的消息逐条写入已打开的文件 f，返回写入的消息数
+
+    streams: user_id -> 按时间排序的消息（HistoryManager.stream 的结果）
+    agent_names: 代理标识 -> 显示名称，缺省时显示代理标识
+    """
+    agent_names = agent_names or {}
+    single_user = len(streams) == 1
+    writer = FORMATS[fmt]()
+    writer.header(f)
+    count = 0
+    for message in merge_streams(streams):
+        role = getattr(message["role"], "value", message["role"])
+        agent = message.get("agent")
+        if role == "user":
+            speaker = "您" if single_user else message["user_id"]
+        else:
+            speaker = agent_names.get(agent, agent or "未知代理")
+        writer.write(f, {
+            "timestamp": message.get("timestamp", ""),
+            "user_id": message["user_id"],
+            "role": role,
+            "agent": agent_names.get(agent, agent) if agent else "",
+            "speaker": speaker,
+            "content": message.get("content", "")
+        })
+        count += 1
+    writer.footer(f)
+    return count
+
+
+def export_to_file(manager, user_ids: List[str], filename: str, fmt: str = None,
+                   agent_names: Dict[str, str] = None, batch_size: int = 500) -> int:
+    """从 HistoryManager 分批读取用户历史并导出到文件，fmt 为None时按扩展名选择"""
+    fmt = fmt or format_for(filename)
+    streams = {user_id: manager.stream(user_id, batch_size) for user_id in user_ids}
+    # CSV 需要 newline='' 以免在 Windows 上多出空行
+    with open(filename, 'w', encoding=FORMATS[fmt].encoding, newline='' if fmt == "csv" else None) as f:
+        return export_messages(streams, f, fmt, agent_names)
+
+
+def read_records(filename: str, agent_ids: Dict[str, str] = None) -> List[Dict[str, Any]]:
+    """读取待导入的消息记录（.json 消息列表、.jsonl 或 .csv）
+
+    agent_ids: 代理显示名称 -> 代理标识，导出文件中的代理名称按此还原为标识
+    """
+    agent_ids = agent_ids or {}
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".jsonl":
+        with open(filename, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    elif extension == ".csv":
+        with open(filename, 'r', encoding='utf-8-sig', newline='') as f:
+            records = list(csv.DictReader(f))
+    else:
+        with open(filename, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        if not isinstance(records, list):
+            raise ValueError("文件内容不是消息列表")
+    for record in records:
+        if isinstance(record, dict) and record.get("agent"):
+            record["agent"] = agent_ids.get(record["agent"], record["agent"])
+    return records
+
+
+def main():
+    # 延迟导入：HistoryManager 依赖 camel，仅在命令行导出时需要
+    from history_manager import HistoryManager
+    from history_archive import HistoryArchive
+
+    parser = argparse.ArgumentParser(description="导出聊天历史")
+    parser.add_argument("--user", action="append", required=True, help="要导出的用户ID，可重复指定")
+    parser.add_argument("--format", choices=sorted(FORMATS), help="导出格式，默认按输出文件扩展名选择")
+    parser.add_argument("-o", "--output", help="输出文件，默认输出到标准输出")
+    parser.add_argument("--backend", default=BACKEND_JOURNAL, help="历史存储后端")
+    parser.add_argument("--history", default="chat_history.json", help="统一历史文件")
+    parser.add_argument("--db", default="chat_history.db", help="sqlite 后端的数据库文件")
+    parser.add_argument("--agent-name", action="append", default=[], metavar="代理标识=名称",
+                        help="代理的显示名称，可重复指定")
+    args = parser.parse_args()
+
+    agent_names = dict(item.split("=", 1) for item in args.agent_name if "=" in item)
+    manager = HistoryManager(args.history, create_store(args.backend, args.history, args.db),
+                             archive=HistoryArchive(args.history + ".archive"))
+    start = time.time()
+    try:
+        if args.output:
+            count = export_to_file(manager, args.user, args.output, args.format, agent_names)
+        else:
+            streams = {user_id: manager.stream(user_id) for user_id in args.user}
+            count = export_messages(streams, sys.stdout, args.format or "txt", agent_names)
+    finally:
+        manager.close()
+    print(f"导出完成：{count}条消息，耗时 {time.time() - start:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
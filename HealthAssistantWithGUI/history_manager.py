@@ -1,41 +1,71 @@
-import json
-import os
-import time
-from datetime import datetime
-from typing import List, Dict, Any
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Iterator, Optional
+import hashlib
+import heapq
+import itertools
 import traceback
+import threading
 from camel.types import RoleType
 from dotenv import load_dotenv
 
+from history_store import HistoryStore, JournalStore, bisect_timestamp, visible_to, window_before
+from history_archive import HistoryArchive
+
 class HistoryManager:
-    def __init__(self, history_file: str):
+    """聊天历史管理
+
+    负责消息角色的序列化和增量保存，实际读写交给存储后端（见 history_store）。
+    未指定后端时使用快照加追加日志的 JournalStore。
+
+    活跃用户的消息缓存在内存中（写回缓存）：save 只更新缓存并记录改动，
+    累计 flush_every 次改动或距第一次未写入的改动 flush_interval 秒后批量写入后端；
+    load 命中缓存时不读磁盘。退出、清空历史时调用 flush/close 强制写入。
+
+    只需要最近几条消息时使用 load_recent / iter_history，并用 append 追加新消息，
+    读写成本只与涉及的消息数有关，不随用户历史总量增长。
+
+    所有代理共用一份历史：用户消息只保存一次，代理回复带 agent 字段，
+    load 按存储顺序返回的就是合并后的时间线。单个代理的上下文通过 AgentHistory 读取。
+
+    提供 archive 时，archive_old 把早于 archive_age 秒的消息移入压缩归档，热存储只保留
+    较新的消息；所有读取接口自动拼接归档与热数据，只在需要时解压相关的归档块。
+    """
+
+    def __init__(self, history_file: str = None, store: HistoryStore = None,
+                 flush_interval: float = 2.0, flush_every: int = 20, max_cached_users: int = 256,
+                 archive: HistoryArchive = None, archive_age: float = None):
+        if store is None:
+            store = JournalStore(history_file)
         self.history_file = history_file
-        self._ensure_file()
+        self.store = store
+        self.archive = archive
+        self.archive_age = archive_age
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.max_cached_users = max_cached_users
 
-    def _ensure_file(self):
-        """确保文件存在且有效"""
-        if not os.path.exists(self.history_file):
-            self._safe_write([])
-        else:
-            try:
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    json.load(f)
-            except json.JSONDecodeError:
-                self._safe_write([])
-
-    def _safe_write(self, data: List[Dict]):
-        """原子写入文件"""
-        temp_file = self.history_file + '.tmp'
-        try:
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            if os.path.exists(temp_file):
-                os.replace(temp_file, self.history_file)
-        except Exception as e:
-            print(f"⚠️ 文件写入失败: {str(e)}")
+        # 后台摘要线程、定时写入线程与前台保存会同时读改写，需要串行化
+        self._lock = threading.RLock()
+        # user_id -> {"messages": 可序列化消息, "base": messages[0]在后端中的位置,
+        #             "flushed": 已写入后端的条数, "replace": 是否需整体替换}
+        # base 为0时缓存的是完整历史；只调用过 append 的用户只缓存尚未写入的新消息
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._pending_changes = 0
+        self._timer = None
+        self._listeners = []
 
     def save(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
-        """保存聊天历史"""
+        """保存聊天历史
+
+        以已保存的最后一条消息判断本次是否只是追加：匹配时只写入新增消息，
+        否则整体替换。修改已保存的较早消息时应先 clear 再保存。
+        """
+        with self._lock:
+            return self._save(user_id, messages)
+
+    def _save(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
         try:
             # 转换枚举值为可序列化的值
             serializable = []
@@ -48,66 +78,453 @@ class HistoryManager:
                     print(f"⚠️ 消息序列化失败: {str(e)}")
                     continue
 
-            # 读取现有记录
-            existing = []
-            try:
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    existing = json.load(f)
-            except json.JSONDecodeError:
-                existing = []
-
-            # 更新记录
-            updated = False
-            for record in existing:
-                if isinstance(record, dict) and record.get("user_id") == user_id:
-                    record["messages"] = serializable
-                    record["last_updated"] = datetime.now().isoformat()
-                    updated = True
-
-            if not updated:
-                existing.append({
-                    "user_id": user_id,
-                    "last_updated": datetime.now().isoformat(),
-                    "messages": serializable
-                })
-
-            self._safe_write(existing)
-            return True
+            entry = self._cached(user_id)
+            cached = entry["messages"]
+            count = len(cached)
+            if len(serializable) >= count and (count == 0 or serializable[count - 1] == cached[count - 1]):
+                if len(serializable) == count:
+                    return True
+                cached.extend(serializable[count:])
+                self._notify("append", user_id, serializable[count:])
+            else:
+                entry["messages"] = serializable
+                entry["replace"] = True
+                self._notify("replace", user_id)
+            return self._mark_dirty(user_id)
         except Exception as e:
             print(f"⚠️ 保存失败: {str(e)}")
             traceback.print_exc()
             return False
 
-    
+    def append(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """在用户历史末尾追加消息，无需先加载完整历史"""
+        serializable = []
+        for msg in messages:
+            try:
+                m = msg.copy()
+                m["role"] = msg["role"].value
+                serializable.append(m)
+            except Exception as e:
+                print(f"⚠️ 消息序列化失败: {str(e)}")
+        if not serializable:
+            return True
 
-    def load(self, user_id: str) -> List[Dict[str, Any]]:
-        """加载聊天历史"""
-        for _ in range(3):  # 重试机制
+        with self._lock:
             try:
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    records = json.load(f)
+                entry = self._cache.get(user_id)
+                if entry is None:
+                    count, _ = self.store.tail(user_id)
+                    entry = {"messages": [], "base": count, "flushed": count, "replace": False}
+                    self._cache[user_id] = entry
+                else:
+                    self._cache.move_to_end(user_id)
+                entry["messages"].extend(serializable)
+                self._notify("append", user_id, serializable)
+                return self._mark_dirty(user_id)
+            except Exception as e:
+                print(f"⚠️ 保存失败: {str(e)}")
+                traceback.print_exc()
+                return False
 
-                if not isinstance(records, list):
-                    return []
+    def bulk_import(self, user_id: str, records: List[Dict[str, Any]], agent: str = None) -> Dict[str, int]:
+        """批量导入消息，校验、去重后一次写入后端
 
+        records: 消息字典，role 可为字符串或 RoleType，须有非空 content 和 ISO 格式的 timestamp
+        agent: 代理回复未注明 agent 时归属的代理标识；用户消息不属于任何代理
+        与已有消息（含归档）或本批中时间戳和内容哈希都相同的记录视为重复。导入的消息按时间
+        合并进已有历史：全部晚于已有消息时追加写入，否则整体替换一次。早于最新归档消息的记录
+        与归档合并后整体替换该用户的归档（提交前中断时旧归档不变），写入失败时整批导入失败。
+        返回 {"imported": 导入数, "duplicates": 重复数, "invalid": 无效数, "archived": 其中写入归档的记录数}
+        """
+        result = {"imported": 0, "duplicates": 0, "invalid": 0, "archived": 0}
+        with self._lock:
+            try:
+                entry = self._cached(user_id)
+                existing = entry["messages"]
+                seen = {self._import_key(m) for m in existing}
+                chunks = self.archive.chunks(user_id) if self.archive is not None else []
+                archived_until = chunks[-1]["last"] if chunks else None
+                archive_seen = None
+                imported = []
+                old = []
                 for record in records:
-                    if isinstance(record, dict) and record.get("user_id") == user_id:
-                        messages = []
-                        for msg in record.get("messages", []):
-                            try:
-                                m = msg.copy()
-                                m["role"] = RoleType(msg["role"])
-                                messages.append(m)
-                            except ValueError:
-                                continue
-                        return messages
-                return []
-            except json.JSONDecodeError:
-                time.sleep(0.5)
+                    message = self._import_message(record, agent)
+                    if message is None:
+                        result["invalid"] += 1
+                        continue
+                    key = self._import_key(message)
+                    if archived_until is not None and message["timestamp"] <= archived_until:
+                        # 只在有记录落入归档时间范围时才解压归档
+                        if archive_seen is None:
+                            archive_seen = {self._import_key(m) for m in self.archive.iter_messages(user_id)}
+                        if key in archive_seen:
+                            result["duplicates"] += 1
+                            continue
+                    if key in seen:
+                        result["duplicates"] += 1
+                        continue
+                    seen.add(key)
+                    if archived_until is not None and message["timestamp"] < archived_until:
+                        old.append(message)
+                    else:
+                        imported.append(message)
+
+                if old:
+                    old.sort(key=lambda m: m["timestamp"])
+                    merged = list(heapq.merge(self.archive.iter_messages(user_id), old,
+                                              key=lambda m: m.get("timestamp", "")))
+                    if not self.archive.replace(user_id, merged):
+                        raise IOError("早于归档的记录写入归档失败")
+                    result["archived"] = len(old)
+                    result["imported"] = len(old)
+                if not imported:
+                    return result
+
+                imported.sort(key=lambda m: m["timestamp"])
+                if not existing or imported[0]["timestamp"] >= existing[-1].get("timestamp", ""):
+                    existing.extend(imported)
+                    self._notify("append", user_id, imported)
+                else:
+                    entry["messages"] = list(heapq.merge(existing, imported, key=lambda m: m.get("timestamp", "")))
+                    entry["replace"] = True
+                    self._notify("replace", user_id)
+                self._dirty.add(user_id)
+                if not self._flush_user(user_id):
+                    # 写入失败的改动保留在缓存中，稍后重试
+                    self._schedule_flush()
+                result["imported"] += len(imported)
+            except Exception as e:
+                print(f"⚠️ 导入失败: {str(e)}")
+                traceback.print_exc()
+            return result
+
+    @staticmethod
+    def _import_message(record: Dict[str, Any], agent: str) -> Optional[Dict[str, Any]]:
+        """校验并规范化一条导入记录（序列化格式），无效时返回None"""
+        if not isinstance(record, dict):
+            return None
+        try:
+            role = RoleType(getattr(record.get("role"), "value", record.get("role")))
+        except ValueError:
+            return None
+        content = record.get("content")
+        timestamp = record.get("timestamp")
+        if not isinstance(content, str) or not content.strip() or not isinstance(timestamp, str):
+            return None
+        try:
+            datetime.fromisoformat(timestamp)
+        except ValueError:
+            return None
+        message = {"role": role.value, "content": content, "timestamp": timestamp}
+        if role != RoleType.USER and (record.get("agent") or agent):
+            message["agent"] = record.get("agent") or agent
+        return message
+
+    @staticmethod
+    def _import_key(message: Dict[str, Any]) -> tuple:
+        return message.get("timestamp"), hashlib.sha1(message.get("content", "").encode("utf-8")).hexdigest()
+
+    def add_listener(self, callback):
+        """注册变更通知 callback(事件, user_id, 消息)
+
+        事件为 "append"（附带新增的序列化消息）、"replace"（用户历史被整体替换）或 "clear"。
+        回调在持有管理器锁时调用，应尽快返回。
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, event: str, user_id: str, messages: List[Dict[str, Any]] = None):
+        for callback in self._listeners:
+            try:
+                callback(event, user_id, messages)
+            except Exception as e:
+                print(f"⚠️ 历史变更通知失败: {str(e)}")
+
+    def _mark_dirty(self, user_id: str) -> bool:
+        self._dirty.add(user_id)
+        self._pending_changes += 1
+        if self._pending_changes >= self.flush_every:
+            return self.flush()
+        self._schedule_flush()
+        return True
+
+    def _cached(self, user_id: str) -> Dict[str, Any]:
+        """取出用户的完整历史缓存，未缓存或只缓存了新消息时从后端加载"""
+        entry = self._cache.get(user_id)
+        if entry is not None and entry["base"]:
+            self._flush_user(user_id)
+            entry = None
+        if entry is None:
+            stored = self.store.load(user_id)
+            entry = {"messages": stored, "base": 0, "flushed": len(stored), "replace": False}
+            self._cache[user_id] = entry
+            self._evict()
+        else:
+            self._cache.move_to_end(user_id)
+        return entry
+
+    def _full_entry(self, user_id: str) -> Dict[str, Any]:
+        """返回缓存的完整历史；只缓存了部分消息时先写入后端，返回None表示应直接读后端"""
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return None
+        if entry["base"]:
+            self._flush_user(user_id)
+            return None
+        self._cache.move_to_end(user_id)
+        return entry
+
+    def _evict(self):
+        """缓存用户数超出上限时淘汰最久未用且已写入的条目"""
+        if len(self._cache) <= self.max_cached_users:
+            return
+        for user_id in list(self._cache):
+            if len(self._cache) <= self.max_cached_users:
+                break
+            if user_id not in self._dirty:
+                del self._cache[user_id]
+
+    def _schedule_flush(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> bool:
+        """把缓存中的改动写入后端，全部成功时返回True"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            ok = True
+            for user_id in list(self._dirty):
+                ok = self._flush_user(user_id) and ok
+
+            self._pending_changes = 0
+            if self._dirty:
+                # 写入失败的改动保留在缓存中，稍后重试
+                self._schedule_flush()
+            self._evict()
+            return ok
+
+    def _flush_user(self, user_id: str) -> bool:
+        """把单个用户的改动写入后端"""
+        if user_id not in self._dirty:
+            return True
+        entry = self._cache[user_id]
+        messages = entry["messages"]
+        if entry["replace"]:
+            written = self.store.replace(user_id, list(messages))
+        else:
+            written = self.store.append(user_id, entry["flushed"],
+                                        messages[entry["flushed"] - entry["base"]:])
+        if written:
+            entry["flushed"] = entry["base"] + len(messages)
+            entry["replace"] = False
+            if entry["base"]:
+                # 只缓存新消息的条目，写入后不再保留这些消息
+                entry["messages"] = []
+                entry["base"] = entry["flushed"]
+            self._dirty.discard(user_id)
+        return written
+
+    def load(self, user_id: str) -> List[Dict[str, Any]]:
+        """加载完整聊天历史"""
+        try:
+            with self._lock:
+                stored = list(self._cached(user_id)["messages"])
+            if self.archive is not None:
+                stored[:0] = self.archive.load(user_id)
+        except Exception as e:
+            print(f"⚠️ 加载失败: {str(e)}")
+            return []
+        return self._deserialize(stored)
+
+    def load_recent(self, user_id: str, n: int) -> List[Dict[str, Any]]:
+        """加载最近的 n 条消息（按时间顺序）"""
+        try:
+            with self._lock:
+                entry = self._full_entry(user_id)
+                if entry is not None:
+                    stored = entry["messages"][-n:] if n > 0 else []
+                else:
+                    stored = self.store.load_recent(user_id, n)
+            if self.archive is not None and len(stored) < n:
+                # 热存储中的消息不够时，用归档中最新的消息补足
+                stored[:0] = self.archive.load_before(user_id, None, n - len(stored))
+        except Exception as e:
+            print(f"⚠️ 加载失败: {str(e)}")
+            return []
+        return self._deserialize(stored)
+
+    def iter_history(self, user_id: str, before: str = None, limit: int = 50,
+                     agent: str = None) -> Iterator[Dict[str, Any]]:
+        """按时间顺序逐条产出时间戳早于 before 的最近 limit 条消息
+
+        before 为None时从最新的消息开始；翻页时把上一页第一条消息的时间戳作为 before。
+        agent 不为None时只产出该代理可见的消息，由存储后端筛选（sqlite 后端在查询中按 agent 列筛选）。
+        """
+        try:
+            with self._lock:
+                entry = self._full_entry(user_id)
+                if entry is not None:
+                    stored = window_before(entry["messages"], before, limit, agent)
+                else:
+                    stored = self.store.load_before(user_id, before, limit, agent)
+            if self.archive is not None and len(stored) < limit:
+                # 归档消息都早于热存储中的消息
+                stored[:0] = self.archive.load_before(user_id, before, limit - len(stored), agent)
+        except Exception as e:
+            print(f"⚠️ 加载失败: {str(e)}")
+            return
+        for msg in stored:
+            try:
+                m = msg.copy()
+                m["role"] = RoleType(msg["role"])
+                yield m
+            except (ValueError, KeyError):
+                continue
+
+    def stream(self, user_id: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """按时间顺序逐条产出完整历史，用于导出
+
+        先把该用户缓存中的改动写入后端，再从后端分批读取，不经过写回缓存。
+        """
+        with self._lock:
+            self._flush_user(user_id)
+        archived = self.archive.iter_messages(user_id) if self.archive is not None else ()
+        for msg in itertools.chain(archived, self.store.iter_messages(user_id, batch_size)):
+            try:
+                m = msg.copy()
+                m["role"] = RoleType(msg["role"])
+                yield m
+            except (ValueError, KeyError):
+                continue
+
+    def count(self, user_id: str) -> int:
+        """用户的消息总数"""
+        with self._lock:
+            archived = self.archive.count(user_id) if self.archive is not None else 0
+            entry = self._cache.get(user_id)
+            if entry is not None:
+                return archived + entry["base"] + len(entry["messages"])
+            return archived + self.store.tail(user_id)[0]
+
+    @staticmethod
+    def _deserialize(stored: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        messages = []
+        for msg in stored:
+            try:
+                m = msg.copy()
+                m["role"] = RoleType(msg["role"])
+                messages.append(m)
+            except (ValueError, KeyError):
                 continue
+        return messages
+
+    def clear(self, user_id: str) -> bool:
+        """清空用户历史（包括对话摘要），并写入其他用户未保存的改动"""
+        with self._lock:
+            self._cache.pop(user_id, None)
+            self._dirty.discard(user_id)
+            cleared = self.store.clear(user_id)
+            self._notify("clear", user_id)
+            if self.archive is not None:
+                cleared = self.archive.clear(user_id) and cleared
+            return self.flush() and cleared
+
+    def load_summary(self, user_id: str, agent: str = None) -> Dict[str, Any]:
+        """读取用户的滚动对话摘要，没有时返回None
+
+        每个代理的摘要分别保存在 {"agents": {代理标识: 摘要}} 中，agent 为None时返回整个记录。
+        """
+        summary = self.store.load_summary(user_id)
+        if agent is None:
+            return summary
+        return (summary or {}).get("agents", {}).get(agent)
+
+    def save_summary(self, user_id: str, summary: Dict[str, Any], agent: str = None) -> bool:
+        """保存用户的滚动对话摘要，与消息存放在同一条用户记录中"""
+        with self._lock:
+            if agent is not None:
+                current = self.store.load_summary(user_id) or {}
+                summary = dict(current, agents=dict(current.get("agents", {}), **{agent: summary}))
+            return self.store.save_summary(user_id, summary)
+
+    def stats(self) -> Dict[str, Any]:
+        """写回缓存与存储后端的统计，包括跨进程锁的等待时间、争用次数和版本冲突次数"""
+        with self._lock:
+            stats = dict(self.store.stats(), cached_users=len(self._cache), dirty_users=len(self._dirty))
+        if self.archive is not None:
+            stats.update(self.archive.stats())
+        return stats
+
+    def archive_old(self, user_id: str, now: datetime = None) -> int:
+        """把早于 archive_age 秒的消息移入压缩归档，返回移入的条数
+
+        先写归档再从热存储删除；两步之间中断时，下次归档会跳过已归档的消息。
+        """
+        if self.archive is None or self.archive_age is None:
+            return 0
+        cutoff = ((now or datetime.now()) - timedelta(seconds=self.archive_age)).isoformat()
+        with self._lock:
+            try:
+                entry = self._cached(user_id)
+                messages = entry["messages"]
+                split = bisect_timestamp(messages, cutoff)
+                if split == 0:
+                    return 0
+                old = self.archive.unarchived(user_id, messages[:split])
+                if old and not self.archive.add(user_id, old):
+                    return 0
+                entry["messages"] = messages[split:]
+                entry["replace"] = True
+                self._dirty.add(user_id)
+                self._flush_user(user_id)
+                return len(old)
             except Exception as e:
-                print(f"⚠️ 加载失败: {str(e)}")
-                return []
-        return []
-    
-    
\ No newline at end of file
+                print(f"⚠️ 归档失败: {str(e)}")
+                traceback.print_exc()
+                return 0
+
+    def close(self):
+        """写入未保存的改动并关闭存储后端"""
+        self.flush()
+        self.store.close()
+        if self.archive is not None:
+            self.archive.close()
+
+
+class AgentHistory:
+    """统一历史中单个代理可见的部分：全部用户消息加该代理自己的回复
+
+    提供与 HistoryManager 相同的窗口读取、追加和摘要接口，供上下文组装、
+    滚动摘要和会话恢复使用；窗口读取由存储后端按代理筛选，不加载完整历史。
+    """
+
+    def __init__(self, manager: HistoryManager, agent: str):
+        self.manager = manager
+        self.agent = agent
+
+    def visible(self, message: Dict[str, Any]) -> bool:
+        """用户消息没有 agent 字段，所有代理都可见"""
+        return visible_to(message, self.agent)
+
+    def load(self, user_id: str) -> List[Dict[str, Any]]:
+        return [m for m in self.manager.load(user_id) if self.visible(m)]
+
+    def load_recent(self, user_id: str, n: int) -> List[Dict[str, Any]]:
+        return list(self.manager.iter_history(user_id, limit=n, agent=self.agent))
+
+    def iter_history(self, user_id: str, before: str = None, limit: int = 50) -> Iterator[Dict[str, Any]]:
+        yield from self.manager.iter_history(user_id, before, limit, agent=self.agent)
+
+    def append(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """追加本代理的回复，自动标记 agent 字段（用户消息应通过 HistoryManager 保存一次）"""
+        return self.manager.append(user_id, [dict(m, agent=self.agent) for m in messages])
+
+    def load_summary(self, user_id: str) -> Dict[str, Any]:
+        return self.manager.load_summary(user_id, self.agent)
+
+    def save_summary(self, user_id: str, summary: Dict[str, Any]) -> bool:
+        return self.manager.save_summary(user_id, summary, self.agent)
@@ -0,0 +1,235 @@
+# history_search.py
+import math
+import re
+import threading
+from collections import deque
+from typing import List, Dict, Any, Tuple
+
+# 中日韩字符连续段按相邻两字切分，字母数字按整词切分
+_TOKEN_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """切分词项：中文按字符二元组（单字时保留单字），其他按字母数字串"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def index_terms(text: str) -> Dict[str, int]:
+    """文档的索引词项及词频：tokenize 的结果再加上中文单字，单字查询也能命中多字文本"""
+    terms = {}
+    for token in tokenize(text):
+        terms[token] = terms.get(token, 0) + 1
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if not run[0].isascii() and len(run) > 1:
+            for char in run:
+                terms[char] = terms.get(char, 0) + 1
+    return terms
+
+
+def parse_query(text: str) -> Tuple[str, Dict[str, str]]:
+    """拆出查询中的过滤条件 user:ID agent:代理标识 from:日期 to:日期，返回 (关键词, 过滤条件)"""
+    filters = {}
+    words = []
+    for word in text.split():
+        key, sep, value = word.partition(":")
+        if sep and key in ("user", "agent", "from", "to") and value:
+            filters[key] = value
+        else:
+            words.append(word)
+    return " ".join(words), filters
+
+
+class HistorySearch:
+    """聊天历史全文检索
+
+    倒排索引：词项 -> {文档号: 词频}，每条消息是一个文档。中文按字符二元组切分并另外
+    索引单字（文档长度只按二元组计），查询同样切分后按 BM25 打分；默认要求在满足过滤
+    条件的消息中包含全部词项，没有结果时放宽为包含任一词项。
+    首次检索时从 HistoryManager 读取所有用户的历史建立索引，之后通过 HistoryManager
+    的变更通知增量维护：追加的消息直接加入，清空的用户删除其文档，被整体替换的用户
+    在下次检索前重新索引。变更通知只入队，由检索线程处理，不会阻塞写入。
+    索引只保存在内存中，其他进程写入的消息在 rebuild 后可见。
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._lock = threading.Lock()
+        self._events = deque()
+        self._built = False
+        self._reset()
+        manager.add_listener(self._on_change)
+
+    def _reset(self):
+        self._postings = {}     # 词项 -> {文档号: 词频}
+        self._docs = {}         # 文档号 -> (user_id, agent, role, timestamp, content, 长度)
+        self._user_docs = {}    # user_id -> {文档号, ...}
+        self._keys = set()      # (user_id, timestamp, content)，防止建索引期间的变更重复加入
+        self._next_id = 0
+        self._total_length = 0
+        self._dead_postings = 0
+
+    def _on_change(self, event: str, user_id: str, messages: List[Dict[str, Any]] = None):
+        self._events.append((event, user_id, messages))
+
+    def _add(self, user_id: str, message: Dict[str, Any]):
+        content = message.get("content", "")
+        timestamp = message.get("timestamp", "")
+        key = (user_id, timestamp, content)
+        if not content or key in self._keys:
+            return
+        self._keys.add(key)
+        length = len(tokenize(content))
+        doc_id = self._next_id
+        self._next_id += 1
+        role = getattr(message.get("role"), "value", message.get("role"))
+        self._docs[doc_id] = (user_id, message.get("agent"), role, timestamp, content, length)
+        self._user_docs.setdefault(user_id, set()).add(doc_id)
+        self._total_length += length
+        for term, tf in index_terms(content).items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+
+    def _remove_user(self, user_id: str):
+        """删除用户的文档；倒排表中的旧条目在查询时跳过，累积过多时重建"""
+        for doc_id in self._user_docs.pop(user_id, ()):
+            _, _, _, timestamp, content, length = self._docs.pop(doc_id)
+            self._keys.discard((user_id, timestamp, content))
+            self._total_length -= length
+            self._dead_postings += length
+        if self._dead_postings > self._total_length:
+            self._compact()
+
+    def _compact(self):
+        docs = self._docs
+        self._postings = {}
+        for doc_id, doc in docs.items():
+            for term, tf in index_terms(doc[4]).items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+        self._dead_postings = 0
+
+    def _index_user(self, user_id: str):
+        for message in self.manager.stream(user_id):
+            self._add(user_id, message)
+
+    def _apply_events(self):
+        reindex = set()
+        while self._events:
+            event, user_id, messages = self._events.popleft()
+            if event == "append":
+                for message in messages:
+                    self._add(user_id, message)
+            elif event == "clear":
+                self._remove_user(user_id)
+                reindex.discard(user_id)
+            elif event == "replace":
+                reindex.add(user_id)
+        for user_id in reindex:
+            self._remove_user(user_id)
+            self._index_user(user_id)
+
+    def rebuild(self) -> int:
+        """重新读取所有用户的历史建立索引，返回文档数"""
+        with self._lock:
+            self._reset()
+            self._events.clear()
+            users = {record["user_id"] for record in self.manager.store.records()}
+            if self.manager.archive is not None:
+                users.update(self.manager.archive.users())
+            for user_id in users:
+                self._index_user(user_id)
+            self._built = True
+            self._apply_events()
+            return len(self._docs)
+
+    def search(self, query: str, user_id: str = None, agent: str = None,
+               date_from: str = None, date_to: str = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """按 BM25 得分返回最相关的消息
+
+        user_id: 只检索该用户；agent: 只检索该代理的回复，为 "user" 时只检索用户消息；
+        date_from / date_to: 日期范围（含两端），如 2025-01-01
+        """
+        if not self._built:
+            self.rebuild()
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            self._apply_events()
+
+            def allowed(doc):
+                doc_user, doc_agent, role, timestamp, _, _ = doc
+                if user_id is not None and doc_user != user_id:
+                    return False
+                if agent is not None and (role != "user" if agent == "user" else doc_agent != agent):
+                    return False
+                day = timestamp[:10]
+                return (date_from is None or day >= date_from) and (date_to is None or day <= date_to)
+
+            postings = [self._postings.get(t, {}) for t in terms]
+            if self._dead_postings:
+                postings = [{d: tf for d, tf in p.items() if d in self._docs} for p in postings]
+            # 先按过滤条件筛选，再决定是否放宽为包含任一词项
+            matched = [{d for d in p if allowed(self._docs[d])} for p in postings]
+            candidates = set.intersection(*matched)
+            if not candidates:
+                candidates = set().union(*matched)
+
+            count = len(self._docs)
+            average = self._total_length / count if count else 0
+            scores = {}
+            for term_postings in postings:
+                if not term_postings:
+                    continue
+                idf = math.log((count - len(term_postings) + 0.5) / (len(term_postings) + 0.5) + 1)
+                for doc_id in candidates:
+                    tf = term_postings.get(doc_id)
+                    if tf:
+                        length = self._docs[doc_id][5]
+                        norm = self.K1 * (1 - self.B + self.B * length / average) if average else self.K1
+                        scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+            results = []
+            for doc_id, score in ranked:
+                doc_user, doc_agent, role, timestamp, content, _ = self._docs[doc_id]
+                results.append({
+                    "user_id": doc_user,
+                    "agent": doc_agent,
+                    "role": role,
+                    "timestamp": timestamp,
+                    "content": content,
+                    "score": score,
+                    "snippet": self.snippet(content, query)
+                })
+            return results
+
+    @staticmethod
+    def snippet(content: str, query: str, width: int = 30) -> str:
+        """截取命中位置附近的文字"""
+        lowered = content.lower()
+        positions = [lowered.find(word) for word in query.lower().split()]
+        positions += [lowered.find(token) for token in tokenize(query)]
+        hits = [p for p in positions if p >= 0]
+        start = max(0, min(hits) - width) if hits else 0
+        end = start + width * 2 + max(len(query), 1)
+        text = content[start:end].replace("\n", " ")
+        return ("..." if start > 0 else "") + text + ("..." if end < len(content) else "")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "documents": len(self._docs),
+                "terms": len(self._postings),
+                "users": len(self._user_docs),
+                "pending_events": len(self._events)
+            }
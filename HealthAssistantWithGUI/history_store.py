@@ -0,0 +1,1222 @@
+# history_store.py
+import json
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只能保证进程内互斥
+    fcntl = None
+
+
+class FileLock:
+    """跨进程咨询锁（fcntl.flock），同一进程内可重入
+
+    先用线程锁串行化本进程内的线程，再对锁文件加 flock 与其他进程互斥。
+    记录获取次数、需要等待的次数（争用）以及累计和最长等待时间。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+        # 统计信息
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, blocking: bool = True) -> bool:
+        start = time.perf_counter()
+        contended = False
+        if not self._thread_lock.acquire(blocking=False):
+            if not blocking:
+                return False
+            contended = True
+            self._thread_lock.acquire()
+
+        self._depth += 1
+        if self._depth > 1:
+            return True
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                try:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    if not blocking:
+                        self._depth -= 1
+                        self._thread_lock.release()
+                        return False
+                    contended = True
+                    fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._depth -= 1
+            self._thread_lock.release()
+            raise
+
+        waited = time.perf_counter() - start
+        self.acquisitions += 1
+        self.contended += contended
+        self.wait_time += waited
+        self.max_wait = max(self.max_wait, waited)
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def close(self):
+        with self._thread_lock:
+            if self._fd is not None and self._depth == 0:
+                os.close(self._fd)
+                self._fd = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "lock_acquisitions": self.acquisitions,
+            "lock_contended": self.contended,
+            "lock_wait_total": round(self.wait_time, 6),
+            "lock_wait_max": round(self.max_wait, 6)
+        }
+
+
+class HistoryStore:
+    """聊天历史存储后端接口
+
+    HistoryManager 负责角色枚举的转换和增量比较，后端只处理可序列化的消息
+    （role 为字符串）。每个后端实例对应一份历史：所有代理共用的统一历史中，
+    代理回复以消息的 agent 字段区分，用户消息只保存一次。
+
+    多个进程可以共用同一份存储：写入在跨进程锁内完成，append 的 start 参数是写入方
+    所见的已保存条数（乐观版本号），与实际条数不一致时说明其他进程已写入，
+    新消息合并到末尾而不是覆盖对方的消息。
+    """
+
+    def __init__(self):
+        self.conflicts = 0
+
+    def load(self, user_id: str) -> List[Dict[str, Any]]:
+        """返回用户的全部消息"""
+        raise NotImplementedError
+
+    def tail(self, user_id: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """返回 (已保存消息数, 最后一条消息)，用于判断本次保存是否只是追加"""
+        messages = self.load(user_id)
+        return len(messages), messages[-1] if messages else None
+
+    def load_recent(self, user_id: str, n: int) -> List[Dict[str, Any]]:
+        """返回用户最近的 n 条消息（按时间顺序）"""
+        return self.load(user_id)[-n:] if n > 0 else []
+
+    def load_before(self, user_id: str, before: str = None, limit: int = 50,
+                    agent: str = None) -> List[Dict[str, Any]]:
+        """返回时间戳早于 before 的最近 limit 条消息（按时间顺序），before 为None时从最新开始
+
+        agent 不为None时只返回该代理可见的消息（见 visible_to）
+        """
+        return window_before(self.load(user_id), before, limit, agent)
+
+    def iter_messages(self, user_id: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """按时间顺序逐条产出用户的全部消息，支持分批读取的后端不会一次载入完整历史"""
+        yield from self.load(user_id)
+
+    def append(self, user_id: str, start: int, messages: List[Dict[str, Any]]) -> bool:
+        """在末尾追加消息，start 为写入方所见的已保存条数"""
+        raise NotImplementedError
+
+    def replace(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """整体替换用户的消息"""
+        raise NotImplementedError
+
+    def clear(self, user_id: str) -> bool:
+        """删除用户的消息和摘要"""
+        raise NotImplementedError
+
+    def load_summary(self, user_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save_summary(self, user_id: str, summary: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def records(self) -> List[Dict[str, Any]]:
+        """返回所有用户记录（JsonFileStore 格式），用于迁移"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """并发写入统计"""
+        return {"conflicts": self.conflicts}
+
+    def close(self):
+        pass
+
+    def _merge_append(self, stored_count: int, start: int, messages: List[Dict[str, Any]],
+                      newer: List[Dict[str, Any]] = ()) -> Tuple[int, List[Dict[str, Any]]]:
+        """版本检查：start 与实际条数一致时原样写入；否则合并到末尾，
+        并去掉其他进程在 start 之后已写入的相同消息（newer），返回 (写入位置, 消息)"""
+        if start == stored_count:
+            return start, messages
+        self.conflicts += 1
+        seen = {(m.get("timestamp"), m.get("content")) for m in newer}
+        return stored_count, [m for m in messages if (m.get("timestamp"), m.get("content")) not in seen]
+
+
+class JsonFileStore(HistoryStore):
+    """单个JSON文件存储（原有格式），每次写入都重写整个文件，适合小规模数据"""
+
+    def __init__(self, history_file: str):
+        super().__init__()
+        self.history_file = history_file
+        self._lock = FileLock(history_file + '.lock')
+
+    def _read(self) -> List[Dict[str, Any]]:
+        for _ in range(3):  # 重试机制
+            try:
+                with open(self.history_file, 'r', encoding='utf-8') as f:
+                    records = json.load(f)
+                return records if isinstance(records, list) else []
+            except FileNotFoundError:
+                return []
+            except json.JSONDecodeError:
+                time.sleep(0.5)
+        return []
+
+    def _safe_write(self, data: List[Dict]) -> bool:
+        """原子写入文件"""
+        temp_file = _temp_path(self.history_file)
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, self.history_file)
+            return True
+        except Exception as e:
+            print(f"⚠️ 文件写入失败: {str(e)}")
+            return False
+
+    def _update(self, user_id: str, change) -> bool:
+        """读改写该用户的记录，change(record) 就地修改记录"""
+        with self._lock:
+            records = self._read()
+            for record in records:
+                if isinstance(record, dict) and record.get("user_id") == user_id:
+                    break
+            else:
+                record = {"user_id": user_id, "messages": []}
+                records.append(record)
+            change(record)
+            return self._safe_write(records)
+
+    def load(self, user_id: str) -> List[Dict[str, Any]]:
+        for record in self._read():
+            if isinstance(record, dict) and record.get("user_id") == user_id:
+                return record.get("messages", [])
+        return []
+
+    def append(self, user_id: str, start: int, messages: List[Dict[str, Any]]) -> bool:
+        def change(record):
+            stored = record.get("messages", [])
+            _, merged = self._merge_append(len(stored), start, messages, stored[start:])
+            record["messages"] = stored + merged
+            record["last_updated"] = datetime.now().isoformat()
+        return self._update(user_id, change)
+
+    def replace(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
+        def change(record):
+            record["messages"] = list(messages)
+            record["last_updated"] = datetime.now().isoformat()
+        return self._update(user_id, change)
+
+    def clear(self, user_id: str) -> bool:
+        with self._lock:
+            records = [r for r in self._read() if r.get("user_id") != user_id]
+            return self._safe_write(records)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(super().stats(), **self._lock.stats())
+
+    def close(self):
+        self._lock.close()
+
+    def load_summary(self, user_id: str) -> Optional[Dict[str, Any]]:
+        for record in self._read():
+            if isinstance(record, dict) and record.get("user_id") == user_id:
+                return record.get("summary")
+        return None
+
+    def save_summary(self, user_id: str, summary: Dict[str, Any]) -> bool:
+        def change(record):
+            record["summary"] = summary
+            record.setdefault("last_updated", datetime.now().isoformat())
+        return self._update(user_id, change)
+
+    def records(self) -> List[Dict[str, Any]]:
+        return [r for r in self._read() if isinstance(r, dict) and "user_id" in r]
+
+
+class JournalStore(HistoryStore):
+    """快照加追加日志存储
+
+    history_file 是快照文件（格式与 JsonFileStore 相同），之后的改动以JSONL逐行追加到
+    history_file + '.journal'，保存一条新消息只需追加一行，与历史总量无关。
+    日志记录数达到 compact_threshold 后，由后台线程把日志合并进快照并清空日志。
+    日志中的追加记录带有起始位置，重放是幂等的，合并中途崩溃后重启也不会重复或丢失消息。
+
+    多个进程共用时，每次读写前在跨进程锁内读入其他进程追加的日志；
+    日志被其他进程轮转合并后重新加载快照。已读的日志保持打开，其 inode 在关闭前
+    不会被合并后新建的日志复用，按 inode 即可可靠地发现轮转。
+    """
+
+    def __init__(self, history_file: str, compact_threshold: int = 500, fsync: bool = True):
+        super().__init__()
+        self.history_file = history_file
+        self.journal_file = history_file + '.journal'
+        # 合并期间日志先改名为此文件，新的改动写入新日志
+        self.rotated_journal_file = history_file + '.journal.1'
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+
+        self._lock = FileLock(history_file + '.lock')
+        self._compact_lock = FileLock(history_file + '.compact.lock')
+        self._compact_thread = None
+        self._journal = None
+        self._reader = None         # 已读的日志文件
+        self._journal_offset = 0    # 已读入的日志字节数
+        self._journal_entries = 0
+        self._records = {}  # user_id -> 用户记录
+        with self._lock:
+            leftover = self._load_all()
+        # 上次合并未完成，立即补做，保证同一时刻最多只有一个轮转日志
+        if leftover:
+            self.compact()
+
+    def _load_all(self) -> bool:
+        """加载快照并重放日志，返回是否存在未完成合并留下的轮转日志"""
+        self._close_journal()
+        self._records = {}
+        try:
+            with open(self.history_file, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            records = []
+        except json.JSONDecodeError as e:
+            print(f"⚠️ 历史快照损坏，将从日志恢复: {str(e)}")
+            records = []
+
+        for record in records if isinstance(records, list) else []:
+            if isinstance(record, dict) and "user_id" in record:
+                record.setdefault("messages", [])
+                self._records[record["user_id"]] = record
+
+        leftover = os.path.exists(self.rotated_journal_file)
+        if leftover:
+            self._replay(self.rotated_journal_file, 0)
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._sync()
+        return leftover
+
+    def _sync(self):
+        """读入其他进程追加的日志（需持有锁）"""
+        try:
+            stat = os.stat(self.journal_file)
+        except FileNotFoundError:
+            stat = None
+        if self._reader is not None and (stat is None or stat.st_ino != os.fstat(self._reader.fileno()).st_ino
+                                         or stat.st_size < self._journal_offset):
+            # 日志已被轮转合并，从新快照重新加载
+            self._load_all()
+            return
+        if stat is None or stat.st_size == self._journal_offset:
+            return
+        if self._reader is None:
+            self._reader = open(self.journal_file, 'rb')
+        count, self._journal_offset = self._replay_from(self._reader, self._journal_offset)
+        self._journal_entries += count
+
+    def _replay(self, path: str, start: int) -> Tuple[int, int]:
+        """从字节位置 start 起按顺序重放日志，返回 (有效记录数, 读到的位置)
+
+        末尾没有换行的行可能正在写入，不计入读取位置；崩溃留下的半行无法解析，直接跳过。
+        """
+        if not os.path.exists(path):
+            return 0, start
+        with open(path, 'rb') as f:
+            return self._replay_from(f, start)
+
+    def _replay_from(self, f, start: int) -> Tuple[int, int]:
+        count = 0
+        offset = start
+        f.seek(start)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            try:
+                entry = json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            if isinstance(entry, dict) and "op" in entry:
+                self._apply(entry)
+                count += 1
+        return count, offset
+
+    def _apply(self, entry: Dict[str, Any]):
+        """把一条日志记录应用到内存中的记录"""
+        user_id = entry.get("user_id")
+        op = entry["op"]
+        if op == "clear":
+            self._records.pop(user_id, None)
+            return
+
+        record = self._records.get(user_id)
+        if record is None:
+            record = {"user_id": user_id, "last_updated": entry.get("time"), "messages": []}
+            self._records[user_id] = record
+
+        if op == "append":
+            # 切片赋值而非extend，同一条记录重放多次结果不变
+            record["messages"][entry["start"]:] = entry["messages"]
+            record["last_updated"] = entry.get("time")
+        elif op == "replace":
+            record["messages"] = list(entry["messages"])
+            record["last_updated"] = entry.get("time")
+        elif op == "summary":
+            record["summary"] = entry["summary"]
+
+    def _write_entry(self, entry: Dict[str, Any]) -> bool:
+        """追加一条日志记录并应用到内存（需持有锁且已同步）"""
+        entry["time"] = datetime.now().isoformat()
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8')
+        try:
+            if self._journal is None:
+                self._journal = self._open_journal()
+            self._journal.write(line)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+        except Exception as e:
+            print(f"⚠️ 日志写入失败: {str(e)}")
+            return False
+
+        self._apply(entry)
+        if self._reader is None:
+            self._reader = open(self.journal_file, 'rb')
+        self._journal_offset = self._journal.tell()
+        self._journal_entries += 1
+        if self._journal_entries >= self.compact_threshold:
+            self._start_compaction()
+        return True
+
+    def _open_journal(self):
+        journal = open(self.journal_file, 'ab')
+        # 上次崩溃可能留下没有换行的半行，补上换行，避免与下一条记录粘连
+        if journal.tell() > 0:
+            with open(self.journal_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    journal.write(b"\n")
+        return journal
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def _safe_write(self, data: List[Dict]) -> bool:
+        """原子写入快照"""
+        temp_file = _temp_path(self.history_file)
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.history_file)
+            return True
+        except Exception as e:
+            print(f"⚠️ 文件写入失败: {str(e)}")
+            return False
+
+    def _start_compaction(self):
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return
+        self._compact_thread = threading.Thread(target=self.compact, name="history-journal-compact", daemon=True)
+        self._compact_thread.start()
+
+    def compact(self) -> bool:
+        """把日志合并进快照
+
+        持锁期间只轮转日志并复制当前记录，写快照在锁外进行，不阻塞前台保存。
+        其他线程或进程正在合并时直接返回False。
+        """
+        if not self._compact_lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                self._sync()
+                self._close_journal()
+                if os.path.exists(self.journal_file):
+                    if os.path.exists(self.rotated_journal_file):
+                        # 上次合并未完成，把当前日志接在轮转日志之后
+                        with open(self.journal_file, 'rb') as src, open(self.rotated_journal_file, 'ab') as dst:
+                            dst.write(src.read())
+                        os.remove(self.journal_file)
+                    else:
+                        os.replace(self.journal_file, self.rotated_journal_file)
+                self._journal_offset = 0
+                self._journal_entries = 0
+                snapshot = self._copy_records()
+
+            if not self._safe_write(snapshot):
+                return False
+            # 删除轮转日志要持锁，避免其他进程读到旧快照后又找不到轮转日志
+            with self._lock:
+                try:
+                    os.remove(self.rotated_journal_file)
+                except FileNotFoundError:
+                    pass
+            return True
+        finally:
+            self._compact_lock.release()
+
+    def load(self, user_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._sync()
+            record = self._records.get(user_id)
+            return list(record["messages"]) if record else []
+
+    def load_recent(self, user_id: str, n: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._sync()
+            record = self._records.get(user_id)
+            return record["messages"][-n:] if record and n > 0 else []
+
+    def load_before(self, user_id: str, before: str = None, limit: int = 50,
+                    agent: str = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._sync()
+            record = self._records.get(user_id)
+            if not record:
+                return []
+            return window_before(record["messages"], before, limit, agent)
+
+    def records(self) -> List[Dict[str, Any]]:
+        """返回所有用户记录的副本（格式与快照相同）"""
+        with self._lock:
+            self._sync()
+            return self._copy_records()
+
+    def _copy_records(self) -> List[Dict[str, Any]]:
+        return [dict(record, messages=list(record["messages"])) for record in self._records.values()]
+
+    def tail(self, user_id: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+        with self._lock:
+            self._sync()
+            record = self._records.get(user_id)
+            messages = record["messages"] if record else []
+            return len(messages), messages[-1] if messages else None
+
+    def append(self, user_id: str, start: int, messages: List[Dict[str, Any]]) -> bool:
+        with self._lock:
+            self._sync()
+            record = self._records.get(user_id)
+            stored = record["messages"] if record else []
+            start, messages = self._merge_append(len(stored), start, messages, stored[start:])
+            if not messages:
+                return True
+            return self._write_entry({"op": "append", "user_id": user_id, "start": start, "messages": messages})
+
+    def replace(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
+        with self._lock:
+            self._sync()
+            return self._write_entry({"op": "replace", "user_id": user_id, "messages": messages})
+
+    def clear(self, user_id: str) -> bool:
+        with self._lock:
+            self._sync()
+            if user_id not in self._records:
+                return True
+            return self._write_entry({"op": "clear", "user_id": user_id})
+
+    def load_summary(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._sync()
+            record = self._records.get(user_id)
+            return record.get("summary") if record else None
+
+    def save_summary(self, user_id: str, summary: Dict[str, Any]) -> bool:
+        with self._lock:
+            self._sync()
+            return self._write_entry({"op": "summary", "user_id": user_id, "summary": summary})
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(super().stats(), **self._lock.stats())
+
+    def close(self):
+        """等待进行中的合并结束并关闭日志"""
+        thread = self._compact_thread
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            self._close_journal()
+        self._lock.close()
+        self._compact_lock.close()
+
+
+class SQLiteStore(HistoryStore):
+    """SQLite存储
+
+    多份历史（统一历史、旧版各代理的历史）共用一个数据库文件，以 history 列区分；
+    agent 列保存代理回复所属的代理，用户消息为空串。按 (user_id, history, timestamp, agent)
+    建索引，读取单个用户无需扫描其他用户的数据，按代理筛选也不必读出数据行。使用WAL模式，
+    读写互不阻塞，多个前端进程可以共用同一个数据库。消息的位置记录在 seq 列，追加写入只插入新增的行。
+    写事务以 BEGIN IMMEDIATE 开始，数据库被其他进程锁定时退避重试并计入争用统计。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            history TEXT NOT NULL,
+            agent TEXT NOT NULL DEFAULT '',
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_user_history_time
+            ON messages (user_id, history, timestamp, agent);
+        CREATE TABLE IF NOT EXISTS summaries (
+            user_id TEXT NOT NULL,
+            history TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            PRIMARY KEY (user_id, history)
+        );
+    """
+
+    # 语句保持不变并使用参数绑定，由 sqlite3 的语句缓存复用预编译结果
+    # 同一用户的消息按 seq 顺序插入，id 与 seq 同序，按 (timestamp, id) 排序可直接利用索引
+    COLUMNS = "role, content, timestamp, agent, extra"
+    SELECT_MESSAGES = (f"SELECT {COLUMNS} FROM messages "
+                       "WHERE user_id = ? AND history = ? ORDER BY timestamp, id")
+    SELECT_RECENT = (f"SELECT {COLUMNS} FROM messages "
+                     "WHERE user_id = ? AND history = ? ORDER BY timestamp DESC, id DESC LIMIT ?")
+    SELECT_BEFORE = (f"SELECT {COLUMNS} FROM messages "
+                     "WHERE user_id = ? AND history = ? AND timestamp < ? ORDER BY timestamp DESC, id DESC LIMIT ?")
+    # 单个代理可见的消息：用户消息（agent 为空串）加该代理的回复
+    SELECT_AGENT_RECENT = (f"SELECT {COLUMNS} FROM messages "
+                           "WHERE user_id = ? AND history = ? AND agent IN ('', ?) "
+                           "ORDER BY timestamp DESC, id DESC LIMIT ?")
+    SELECT_AGENT_BEFORE = (f"SELECT {COLUMNS} FROM messages "
+                           "WHERE user_id = ? AND history = ? AND agent IN ('', ?) AND timestamp < ? "
+                           "ORDER BY timestamp DESC, id DESC LIMIT ?")
+    SELECT_PAGE = (f"SELECT {COLUMNS}, id FROM messages "
+                   "WHERE user_id = ? AND history = ? AND (timestamp, id) > (?, ?) ORDER BY timestamp, id LIMIT ?")
+    SELECT_TAIL = ("SELECT COUNT(*), MAX(seq) FROM messages WHERE user_id = ? AND history = ?")
+    SELECT_AT = (f"SELECT {COLUMNS} FROM messages "
+                 "WHERE user_id = ? AND history = ? AND seq = ?")
+    SELECT_FROM = (f"SELECT {COLUMNS} FROM messages "
+                   "WHERE user_id = ? AND history = ? AND seq >= ? ORDER BY seq")
+    DELETE_USER = "DELETE FROM messages WHERE user_id = ? AND history = ?"
+    INSERT_MESSAGE = ("INSERT INTO messages (user_id, history, agent, seq, role, content, timestamp, extra) "
+                      "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+    SELECT_SUMMARY = "SELECT summary FROM summaries WHERE user_id = ? AND history = ?"
+    UPSERT_SUMMARY = "INSERT OR REPLACE INTO summaries (user_id, history, summary) VALUES (?, ?, ?)"
+    DELETE_SUMMARY = "DELETE FROM summaries WHERE user_id = ? AND history = ?"
+    SELECT_USERS = ("SELECT user_id FROM messages WHERE history = ? "
+                    "UNION SELECT user_id FROM summaries WHERE history = ?")
+
+    CORE_FIELDS = ("role", "content", "timestamp", "agent")
+
+    def __init__(self, db_file: str, history: str, busy_timeout: float = 10.0):
+        super().__init__()
+        self.db_file = db_file
+        self.history = history
+        self.busy_timeout = busy_timeout
+        self._lock = threading.Lock()
+        # 自行管理事务（isolation_level=None）
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, cached_statements=128,
+                                     isolation_level=None, timeout=busy_timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # 统计信息
+        self.lock_acquisitions = 0
+        self.lock_contended = 0
+        self.lock_wait_total = 0.0
+        self.lock_wait_max = 0.0
+
+        self._conn.executescript(self.SCHEMA)
+        # 建表完成后关闭内置的忙等待，写锁等待由 _transaction 重试并统计
+        self._conn.execute("PRAGMA busy_timeout = 0")
+
+    def _row(self, user_id: str, seq: int, message: Dict[str, Any]) -> tuple:
+        extra = {k: v for k, v in message.items() if k not in self.CORE_FIELDS}
+        return (user_id, self.history, message.get("agent") or "", seq, message["role"], message.get("content", ""),
+                message.get("timestamp", ""), json.dumps(extra, ensure_ascii=False) if extra else None)
+
+    @staticmethod
+    def _message(row: tuple) -> Dict[str, Any]:
+        role, content, timestamp, agent, extra = row
+        message = {"role": role, "content": content, "timestamp": timestamp}
+        if extra:
+            message.update(json.loads(extra))
+        if agent:
+            message["agent"] = agent
+        return message
+
+    def load(self, user_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(self.SELECT_MESSAGES, (user_id, self.history)).fetchall()
+        return [self._message(row) for row in rows]
+
+    def load_recent(self, user_id: str, n: int) -> List[Dict[str, Any]]:
+        if n <= 0:
+            return []
+        with self._lock:
+            rows = self._conn.execute(self.SELECT_RECENT, (user_id, self.history, n)).fetchall()
+        return [self._message(row) for row in reversed(rows)]
+
+    def load_before(self, user_id: str, before: str = None, limit: int = 50,
+                    agent: str = None) -> List[Dict[str, Any]]:
+        if limit <= 0:
+            return []
+        if agent is None:
+            if before is None:
+                return self.load_recent(user_id, limit)
+            sql, params = self.SELECT_BEFORE, (user_id, self.history, before, limit)
+        elif before is None:
+            sql, params = self.SELECT_AGENT_RECENT, (user_id, self.history, agent, limit)
+        else:
+            sql, params = self.SELECT_AGENT_BEFORE, (user_id, self.history, agent, before, limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._message(row) for row in reversed(rows)]
+
+    def iter_messages(self, user_id: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        # 按 (timestamp, id) 键集分页，每页单独加锁，导出期间不阻塞其他线程的读写
+        position = ("", 0)
+        while True:
+            with self._lock:
+                rows = self._conn.execute(self.SELECT_PAGE, (user_id, self.history, *position, batch_size)).fetchall()
+            for row in rows:
+                yield self._message(row[:5])
+            if len(rows) < batch_size:
+                return
+            position = (rows[-1][2], rows[-1][5])
+
+    def tail(self, user_id: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+        with self._lock:
+            count, last_seq = self._conn.execute(self.SELECT_TAIL, (user_id, self.history)).fetchone()
+            if not count:
+                return 0, None
+            row = self._conn.execute(self.SELECT_AT, (user_id, self.history, last_seq)).fetchone()
+        return count, self._message(row) if row else None
+
+    def append(self, user_id: str, start: int, messages: List[Dict[str, Any]]) -> bool:
+        def work(conn):
+            # 版本检查与写入在同一个写事务中完成
+            count = conn.execute(self.SELECT_TAIL, (user_id, self.history)).fetchone()[0]
+            newer = []
+            if count != start:
+                newer = [self._message(row) for row in conn.execute(self.SELECT_FROM, (user_id, self.history, start))]
+            position, merged = self._merge_append(count, start, messages, newer)
+            conn.executemany(self.INSERT_MESSAGE,
+                             [self._row(user_id, position + i, m) for i, m in enumerate(merged)])
+        return self._transaction(work)
+
+    def replace(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
+        rows = [self._row(user_id, i, m) for i, m in enumerate(messages)]
+        return self._write([
+            (self.DELETE_USER, [(user_id, self.history)]),
+            (self.INSERT_MESSAGE, rows)
+        ])
+
+    def clear(self, user_id: str) -> bool:
+        return self._write([
+            (self.DELETE_USER, [(user_id, self.history)]),
+            (self.DELETE_SUMMARY, [(user_id, self.history)])
+        ])
+
+    def load_summary(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(self.SELECT_SUMMARY, (user_id, self.history)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_summary(self, user_id: str, summary: Dict[str, Any]) -> bool:
+        return self._write([
+            (self.UPSERT_SUMMARY, [(user_id, self.history, json.dumps(summary, ensure_ascii=False))])
+        ])
+
+    def records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            users = [row[0] for row in self._conn.execute(self.SELECT_USERS, (self.history, self.history))]
+        records = []
+        for user_id in users:
+            record = {"user_id": user_id, "messages": self.load(user_id)}
+            summary = self.load_summary(user_id)
+            if summary:
+                record["summary"] = summary
+            records.append(record)
+        return records
+
+    def import_records(self, records: List[Dict[str, Any]]) -> int:
+        """在一个事务中导入 JsonFileStore 格式的用户记录，返回导入的消息数"""
+        statements = []
+        total = 0
+        for record in records:
+            user_id = record["user_id"]
+            messages = record.get("messages", [])
+            statements.append((self.DELETE_USER, [(user_id, self.history)]))
+            statements.append((self.INSERT_MESSAGE, [self._row(user_id, i, m) for i, m in enumerate(messages)]))
+            if record.get("summary"):
+                statements.append((self.UPSERT_SUMMARY,
+                                   [(user_id, self.history, json.dumps(record["summary"], ensure_ascii=False))]))
+            total += len(messages)
+        if not self._write(statements):
+            return 0
+        return total
+
+    def _write(self, statements: List[Tuple[str, List[tuple]]]) -> bool:
+        """在一个事务中批量执行写入"""
+        def work(conn):
+            for sql, rows in statements:
+                if rows:
+                    conn.executemany(sql, rows)
+        return self._transaction(work)
+
+    def _transaction(self, work) -> bool:
+        """在写事务中执行 work(conn)，数据库被锁定时退避重试直到 busy_timeout"""
+        with self._lock:
+            start = time.perf_counter()
+            delay = 0.005
+            contended = False
+            while True:
+                try:
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    break
+                except sqlite3.OperationalError as e:
+                    if "locked" not in str(e) or time.perf_counter() - start > self.busy_timeout:
+                        print(f"⚠️ 数据库写入失败: {str(e)}")
+                        return False
+                    contended = True
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.2)
+            waited = time.perf_counter() - start
+            self.lock_acquisitions += 1
+            self.lock_contended += contended
+            self.lock_wait_total += waited
+            self.lock_wait_max = max(self.lock_wait_max, waited)
+
+            try:
+                work(self._conn)
+                self._conn.execute("COMMIT")
+                return True
+            except sqlite3.Error as e:
+                self._conn.execute("ROLLBACK")
+                print(f"⚠️ 数据库写入失败: {str(e)}")
+                return False
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(super().stats(),
+                    lock_acquisitions=self.lock_acquisitions,
+                    lock_contended=self.lock_contended,
+                    lock_wait_total=round(self.lock_wait_total, 6),
+                    lock_wait_max=round(self.lock_wait_max, 6))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SegmentStore(HistoryStore):
+    """按用户分段的数据文件加字节偏移索引
+
+    数据文件 history_file + '.seg' 中每个段是一行紧凑JSON：完整段保存用户的整条记录，
+    增量段（带 "delta": true）只保存新追加的消息或新的摘要。旁路索引 history_file + '.seg.idx'
+    记录 user_id -> 段链 [(偏移, 长度), ...]，即最近的完整段及其后的增量段。
+    读取时通过 mmap 只解码该用户的段并按顺序合并，耗时与文件总大小无关。
+    追加消息和保存摘要只写一个增量段，写入量与历史长度无关；整体替换写新的完整段，
+    旧段成为垃圾。增量段超过 max_deltas 个时把该用户合并为一个完整段，
+    垃圾超过 compact_ratio 时重写数据文件，每个用户只保留合并后的一个段。
+    索引只在数据写入成功后追加，启动时会扫描最后一个索引位置之后的数据，
+    补上崩溃时未写入索引的段。多个进程共用时，每次读写前在跨进程锁内读入其他进程追加的索引行。
+    """
+
+    def __init__(self, history_file: str, compact_ratio: float = 0.5, min_compact_bytes: int = 1 << 20,
+                 fsync: bool = True, max_deltas: int = 32):
+        super().__init__()
+        self.history_file = history_file
+        self.data_file = history_file + '.seg'
+        self.index_file = self.data_file + '.idx'
+        self.compact_ratio = compact_ratio
+        self.min_compact_bytes = min_compact_bytes
+        self.fsync = fsync
+        self.max_deltas = max_deltas
+
+        self._lock = FileLock(self.data_file + '.lock')
+        self._index = {}  # user_id -> [(偏移, 长度), ...]
+        self._counts = {}  # user_id -> 已保存的消息数，追加时据此做版本检查而不必解码历史
+        self._index_pos = 0  # 已读入的索引字节数
+        self._data = None
+        self._index_out = None
+        self._map = None
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        if not os.path.exists(self.data_file):
+            # 首次使用时导入原有的快照和追加日志
+            legacy = JournalStore(self.history_file)
+            try:
+                self._rewrite(self._encode(record) for record in legacy.records())
+            finally:
+                legacy.close()
+
+        self._index = {}
+        self._data = open(self.data_file, 'r+b')
+        header = json.loads(self._data.readline())
+        self._header_end = self._data.tell()
+        indexed_end = self._load_index(header["generation"])
+        if indexed_end is None:
+            self._index = {}
+            indexed_end = self._header_end
+            self._write_index_file(header["generation"])
+        self._index_out = open(self.index_file, 'ab')
+        self._recover_tail(indexed_end)
+
+    def _close_files(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        for f in (self._data, self._index_out):
+            if f is not None:
+                f.close()
+        self._data = self._index_out = None
+
+    def _load_index(self, generation: int) -> Optional[int]:
+        """读取索引，返回已被索引覆盖的数据末尾位置；索引缺失或与数据文件不匹配时返回None"""
+        try:
+            with open(self.index_file, 'rb') as f:
+                header = f.readline()
+                if json.loads(header).get("generation") != generation:
+                    return None
+                self._index_pos = len(header)
+                return self._read_index_lines(f, self._header_end)
+        except (OSError, json.JSONDecodeError, AttributeError):
+            return None
+
+    def _read_index_lines(self, f, indexed_end: int) -> int:
+        """从文件当前位置读入完整的索引行，返回已被索引覆盖的数据末尾位置"""
+        size = os.path.getsize(self.data_file)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            self._index_pos += len(line)
+            try:
+                # 旧版索引行没有增量标记
+                user_id, offset, length, deleted, *delta = json.loads(line)
+            except (json.JSONDecodeError, ValueError, TypeError):
+                continue
+            if offset + length > size:
+                continue
+            indexed_end = max(indexed_end, offset + length)
+            self._apply_index(user_id, offset, length, deleted, bool(delta and delta[0]))
+        return indexed_end
+
+    def _apply_index(self, user_id: str, offset: int, length: int, deleted: bool, delta: bool):
+        """更新内存索引：增量段接到段链末尾，完整段开始新的段链"""
+        self._counts.pop(user_id, None)
+        if deleted:
+            self._index.pop(user_id, None)
+        elif delta and user_id in self._index:
+            self._index[user_id].append((offset, length))
+        else:
+            self._index[user_id] = [(offset, length)]
+
+    def _sync(self):
+        """读入其他进程写入的段（需持有锁）"""
+        try:
+            stat = os.stat(self.data_file)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != os.fstat(self._data.fileno()).st_ino:
+            # 数据文件已被其他进程压缩重写
+            self._close_files()
+            self._open()
+            return
+        if os.path.getsize(self.index_file) > self._index_pos:
+            with open(self.index_file, 'rb') as f:
+                f.seek(self._index_pos)
+                self._read_index_lines(f, self._header_end)
+
+    def _recover_tail(self, start: int):
+        """把 start 之后完整写入但未进索引的段补进索引"""
+        self._data.seek(start)
+        offset = start
+        for line in self._data:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            self._index_segment(record["user_id"], offset, len(line), record.get("deleted", False),
+                                record.get("delta", False))
+            offset += len(line)
+        # 截掉末尾写了一半的段
+        self._data.truncate(offset)
+
+    @staticmethod
+    def _encode(record: Dict[str, Any]) -> bytes:
+        return (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n").encode('utf-8')
+
+    def _rewrite(self, segments) -> int:
+        """用给定的段生成新的数据文件和索引，返回新的世代号"""
+        generation = time.time_ns()
+        temp_file = _temp_path(self.data_file)
+        index = {}
+        with open(temp_file, 'wb') as f:
+            f.write(self._encode({"segment_store": 1, "generation": generation}))
+            for segment in segments:
+                user_id = json.loads(segment)["user_id"]
+                index[user_id] = [(f.tell(), len(segment))]
+                f.write(segment)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.data_file)
+        self._index = index
+        self._write_index_file(generation)
+        return generation
+
+    def _write_index_file(self, generation: int):
+        temp_file = _temp_path(self.index_file)
+        with open(temp_file, 'wb') as f:
+            f.write(self._encode({"generation": generation}))
+            for user_id, chain in self._index.items():
+                for position, (offset, length) in enumerate(chain):
+                    f.write(self._encode([user_id, offset, length, False, position > 0]))
+            self._index_pos = f.tell()
+        os.replace(temp_file, self.index_file)
+
+    def _index_segment(self, user_id: str, offset: int, length: int, deleted: bool, delta: bool = False):
+        self._apply_index(user_id, offset, length, deleted, delta)
+        self._index_out.write(self._encode([user_id, offset, length, deleted, delta]))
+        self._index_out.flush()
+        self._index_pos = self._index_out.tell()
+
+    @staticmethod
+    def _merge(data, chain: List[Tuple[int, int]]) -> Dict[str, Any]:
+        """按顺序合并段链：完整段替换整条记录，增量段追加消息并覆盖其余字段"""
+        record = {}
+        for offset, length in chain:
+            segment = json.loads(data[offset:offset + length])
+            if segment.pop("delta", False):
+                messages = segment.pop("messages", None)
+                if messages:
+                    record.setdefault("messages", []).extend(messages)
+                record.update(segment)
+            else:
+                record = segment
+        return record
+
+    def _read(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._sync()
+            chain = self._index.get(user_id)
+            if chain is None:
+                return None
+            end = chain[-1][0] + chain[-1][1]
+            if self._map is None or len(self._map) < end:
+                # 文件增长后重新映射
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+            record = self._merge(self._map, chain)
+            self._counts[user_id] = len(record.get("messages", []))
+            return record
+
+    def _write(self, user_id: str, record: Optional[Dict[str, Any]], delta: bool = False) -> bool:
+        """追加用户的新段，record 为None表示删除该用户，delta 表示增量段（需持有锁且已同步）"""
+        deleted = record is None
+        if deleted:
+            record = {"user_id": user_id, "deleted": True}
+        elif delta:
+            record = dict(record, user_id=user_id, delta=True)
+        segment = self._encode(record)
+        try:
+            offset = self._data.seek(0, os.SEEK_END)
+            self._data.write(segment)
+            self._data.flush()
+            if self.fsync:
+                os.fsync(self._data.fileno())
+            self._index_segment(user_id, offset, len(segment), deleted, delta)
+        except Exception as e:
+            print(f"⚠️ 历史数据写入失败: {str(e)}")
+            return False
+        if delta and len(self._index.get(user_id, ())) > self.max_deltas:
+            # 增量段过多时把该用户合并为一个完整段，读取时不必逐段解码
+            return self._write(user_id, self._read(user_id))
+        self._maybe_compact(offset + len(segment))
+        return True
+
+    def _maybe_compact(self, size: int):
+        live = sum(length for chain in self._index.values() for _, length in chain)
+        if size >= self.min_compact_bytes and size - live > size * self.compact_ratio:
+            self.compact()
+
+    def compact(self):
+        """把每个用户的段链合并为一个完整段，重写数据文件和索引"""
+        with self._lock:
+            self._sync()
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._data.flush()
+            mapped = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self._rewrite(self._encode(self._merge(mapped, chain)) for chain in list(self._index.values()))
+            finally:
+                mapped.close()
+            self._close_files()
+            self._open()
+
+    def load(self, user_id: str) -> List[Dict[str, Any]]:
+        record = self._read(user_id)
+        return record.get("messages", []) if record else []
+
+    def append(self, user_id: str, start: int, messages: List[Dict[str, Any]]) -> bool:
+        """只把新消息写成增量段；已知条数与 start 一致时无需读取已有历史"""
+        with self._lock:
+            self._sync()
+            count = self._counts.get(user_id)
+            newer = ()
+            if count is None or count != start:
+                record = self._read(user_id)
+                stored = record.get("messages", []) if record else []
+                count, newer = len(stored), stored[start:]
+            _, merged = self._merge_append(count, start, messages, newer)
+            if not merged:
+                return True
+            delta = {"messages": merged, "last_updated": datetime.now().isoformat()}
+            if not self._write(user_id, delta, delta=True):
+                return False
+            self._counts[user_id] = count + len(merged)
+            return True
+
+    def replace(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
+        with self._lock:
+            record = self._read(user_id) or {"user_id": user_id}
+            record["messages"] = list(messages)
+            record["last_updated"] = datetime.now().isoformat()
+            return self._write(user_id, record)
+
+    def clear(self, user_id: str) -> bool:
+        with self._lock:
+            self._sync()
+            if user_id not in self._index:
+                return True
+            return self._write(user_id, None)
+
+    def load_summary(self, user_id: str) -> Optional[Dict[str, Any]]:
+        record = self._read(user_id)
+        return record.get("summary") if record else None
+
+    def save_summary(self, user_id: str, summary: Dict[str, Any]) -> bool:
+        with self._lock:
+            self._sync()
+            return self._write(user_id, {"summary": summary}, delta=True)
+
+    def records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._sync()
+            users = list(self._index)
+            return [record for record in map(self._read, users) if record]
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(super().stats(), **self._lock.stats())
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+        self._lock.close()
+
+
+def _temp_path(path: str) -> str:
+    """每个进程和线程使用不同的临时文件，避免并发写入互相覆盖"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def bisect_timestamp(messages: List[Dict[str, Any]], before: str) -> int:
+    """按时间排序的消息中第一条时间戳不早于 before 的位置"""
+    return bisect_left(messages, before, key=lambda m: m.get("timestamp", ""))
+
+
+def visible_to(message: Dict[str, Any], agent: str = None) -> bool:
+    """统一历史中的消息对代理是否可见：用户消息没有 agent 字段，所有代理都可见；agent 为None时全部可见"""
+    return agent is None or message.get("agent") in (None, agent)
+
+
+def window_before(messages: List[Dict[str, Any]], before: str = None, limit: int = 50,
+                  agent: str = None) -> List[Dict[str, Any]]:
+    """按时间排序的消息中，时间戳早于 before 且对 agent 可见的最近 limit 条"""
+    if limit <= 0:
+        return []
+    end = len(messages) if before is None else bisect_timestamp(messages, before)
+    if agent is None:
+        return messages[max(0, end - limit):end]
+    selected = []
+    for index in range(end - 1, -1, -1):
+        if visible_to(messages[index], agent):
+            selected.append(messages[index])
+            if len(selected) == limit:
+                break
+    selected.reverse()
+    return selected
+
+
+BACKEND_JSON = "json"
+BACKEND_JOURNAL = "journal"
+BACKEND_SQLITE = "sqlite"
+BACKEND_SEGMENT = "segment"
+
+
+def create_store(backend: str, history_file: str, db_file: str = None) -> HistoryStore:
+    """按名称创建存储后端
+
+    sqlite 后端以历史文件名（不含扩展名）作为历史标识（history 列），与迁移工具保持一致。
+    """
+    if backend == BACKEND_JSON:
+        return JsonFileStore(history_file)
+    if backend == BACKEND_JOURNAL:
+        return JournalStore(history_file)
+    if backend == BACKEND_SQLITE:
+        return SQLiteStore(db_file, agent_key(history_file))
+    if backend == BACKEND_SEGMENT:
+        return SegmentStore(history_file)
+    raise ValueError(f"未知的历史存储后端: {backend}")
+
+
+def agent_key(history_file: str) -> str:
+    """历史文件对应的历史标识，如 chat_history_1.json -> chat_history_1（旧版每个代理一份历史）"""
+    return os.path.splitext(os.path.basename(history_file))[0]
@@ -0,0 +1,102 @@
+# http_pool.py
+"""所有 AgentService 共享的HTTP连接池
+
+每个代理各建一个客户端会为同一个API主机重复建立TLS连接。
+这里按进程维护一个同步的 httpx 连接池（开启keep-alive，限制连接数），并在其上构建
+OpenAI 兼容客户端，供所有代理和会话复用。异步连接池绑定创建它的事件循环，
+因此按事件循环各建一个，事件循环被回收后随之释放。
+"""
+import asyncio
+import threading
+import weakref
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+API_BASE_URL = 'https://api.siliconflow.cn'
+
+# 所有请求都发往同一主机，连接池上限即单主机连接上限
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 60.0
+# R1生成较慢，读超时需要留足
+TIMEOUT = httpx.Timeout(connect=10.0, read=300.0, write=30.0, pool=30.0)
+
+_lock = threading.Lock()
+_http_client = None
+_openai_clients = {}
+# 事件循环 -> (异步连接池, {api_key: AsyncOpenAI})
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """获取共享的同步连接池"""
+    global _http_client
+    with _lock:
+        if _http_client is None or _http_client.is_closed:
+            _http_client = httpx.Client(limits=_limits(), timeout=TIMEOUT)
+        return _http_client
+
+
+def _async_entry():
+    """当前事件循环的异步连接池及其客户端（需在协程中调用）"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        entry = _async_clients.get(loop)
+        if entry is None or entry[0].is_closed:
+            entry = (httpx.AsyncClient(limits=_limits(), timeout=TIMEOUT), {})
+            _async_clients[loop] = entry
+        return entry
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """获取当前事件循环共享的异步连接池"""
+    return _async_entry()[0]
+
+
+def get_openai_client(api_key: str) -> OpenAI:
+    """获取基于共享连接池的同步客户端"""
+    http_client = get_http_client()
+    with _lock:
+        client = _openai_clients.get(api_key)
+        if client is None:
+            client = OpenAI(base_url=API_BASE_URL, api_key=api_key, http_client=http_client)
+            _openai_clients[api_key] = client
+        return client
+
+
+def get_async_openai_client(api_key: str) -> AsyncOpenAI:
+    """获取基于当前事件循环连接池的异步客户端（需在协程中调用）"""
+    http_client, clients = _async_entry()
+    with _lock:
+        client = clients.get(api_key)
+        if client is None:
+            client = AsyncOpenAI(base_url=API_BASE_URL, api_key=api_key, http_client=http_client)
+            clients[api_key] = client
+        return client
+
+
+def close():
+    """关闭同步连接池"""
+    global _http_client
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
+        _openai_clients.clear()
+
+
+async def aclose():
+    """关闭当前事件循环的异步连接池，应在事件循环结束前调用"""
+    with _lock:
+        entry = _async_clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[0].aclose()
@@ -17,9 +17,23 @@ import traceback
 import argparse
 from dotenv import load_dotenv
 import os
-from history_manager import HistoryManager
+from history_manager import HistoryManager, AgentHistory
+from history_store import create_store
+from history_archive import HistoryArchive
+from migrate_history import unify_once
 from agent import AgentService
 from cli_interface import CLIInterface
+from fanout import AgentFanout
+import http_pool
+from response_cache import ResponseCache
+from semantic_cache import SemanticCache
+from context_assembler import ContextAssembler
+from summarizer import HistoryCompactor
+from session_pool import SessionPool
+from persistence_queue import PersistenceQueue
+from history_search import HistorySearch
+from preprocessor import InputPreprocessor
+from rule_config import RuleWatcher
 from gui_tkinter import HealthAgentGUI  # 导入GUI模块
 import tkinter as tk  # 导入GUI库
 
@@ -27,19 +41,81 @@ load_dotenv('API.env')
 
 def main():
     # 配置
+    # id 是代理回复在统一历史中的 agent 字段；legacy_history_file 是旧版该代理单独的历史文件，
+    # 首次启动时自动合并进统一历史
     AGENT_CONFIGS = [
         {
+            "id": "gentle",
             "name": "AI健康管理师1号(温和)(temperature: 0.7, top_p: 0.9)",
             "config": {"temperature": 0.7, "top_p": 0.9},
-            "history_file": "chat_history_1.json"
+            "legacy_history_file": "chat_history_1.json",
+            "context_tokens": 2000
         },
         {
+            "id": "creative",
             "name": "AI健康管理师2号(创意)(temperature: 1.2, top_p: 0.8)",
             "config": {"temperature": 1.2, "top_p": 0.8},
-            "history_file": "chat_history_2.json"
+            "legacy_history_file": "chat_history_2.json",
+            "context_tokens": 2000
         }
     ]
 
+    # 所有代理共用的统一历史：用户消息只保存一次，代理回复以 agent 字段区分
+    HISTORY_FILE = "chat_history.json"
+    # 历史存储后端："journal" 快照加追加日志；"segment" 按用户分段的数据文件加偏移索引，适合很大的历史；
+    # "sqlite" 存入数据库；"json" 每次重写整个文件
+    # 切换到 sqlite 前可运行 python migrate_history.py 导入已有的 JSON 历史
+    HISTORY_BACKEND = "journal"
+    HISTORY_DB_FILE = "chat_history.db"
+    # 历史写回缓存：累计改动数或等待秒数达到其一即批量写入
+    HISTORY_FLUSH_EVERY = 20
+    HISTORY_FLUSH_INTERVAL = 2.0
+    # 压缩归档：早于该天数的消息在启动时移入归档文件，读取时自动拼接；压缩算法可选 zlib/gzip/lzma
+    # 也可运行 python -m history_archive 归档所有用户
+    HISTORY_ARCHIVE_DAYS = 30
+    HISTORY_ARCHIVE_CODEC = "zlib"
+    # 图形界面的历史写入队列上限，写线程跟不上时提交方等待
+    PERSIST_QUEUE_SIZE = 1000
+    # 队列已满时界面线程暂存写操作的上限，接近上限时不再接受新消息
+    PERSIST_OVERFLOW_SIZE = 200
+    # 图形界面启动和切换用户时显示的最近消息条数（在写线程中读取）
+    HISTORY_DISPLAY_LIMIT = 200
+
+    # 预处理规则文件（JSON 或 TOML，需带 version 字段），修改后自动热加载；文件不存在时使用内置规则
+    # 可运行 python -m rule_config --dump preprocess_rules.json 生成模板
+    RULES_FILE = "preprocess_rules.json"
+    RULES_CHECK_INTERVAL = 2.0
+    # 预处理结果记忆的条目上限，重复的输入（如“帮助”）直接返回记忆的结果
+    PREPROCESS_MEMO_SIZE = 4096
+
+    # 上下文模式："history" 每轮随消息发送裁剪后的历史；"memory" 由代理记忆携带历史
+    CONTEXT_MODE = ContextAssembler.MODE_HISTORY
+
+    # 滚动摘要：保留最近的消息原文，更早的对话在后台压缩为摘要
+    SUMMARY_KEEP_RECENT = 6
+    SUMMARY_MIN_NEW_MESSAGES = 10
+
+    # 会话池：每个用户与每个代理拥有独立会话，超出上限或闲置超时的会话被回收
+    MAX_SESSIONS = 64
+    SESSION_IDLE_TIMEOUT = 30 * 60
+
+    # 同时请求模型的代理数上限，超出的代理排队等待
+    MAX_CONCURRENT_AGENTS = 4
+
+    # 回复缓存：相同提示词、参数和上下文直接复用已校验的回复
+    RESPONSE_CACHE_FILE = "response_cache.json"
+    RESPONSE_CACHE_SIZE = 512
+    RESPONSE_CACHE_TTL = 7 * 24 * 3600
+
+    # 语义近似缓存：只用于不带历史和摘要的问题。字符相似度会把只差一个字的相反问题
+    # （低血压/高血压）判为相似、却认不出换了说法的同一问题，默认关闭
+    SEMANTIC_CACHE_ENABLED = False
+    SEMANTIC_CACHE_FILE = "semantic_cache.json"
+    # 相似度日志，调整阈值时设为文件名（如 "semantic_scores.jsonl"）开启；日志含用户问题原文，默认不写
+    SEMANTIC_SCORE_LOG = None
+    SEMANTIC_CACHE_SIZE = 2000
+    SEMANTIC_THRESHOLD = 0.95
+
     SYSTEM_PROMPT = """健康管理师身份设定：
     您是亲切专业的「国家高级健康管理师」拥有：
     1. 10年三甲医院临床营养科工作经验
@@ -107,35 +183,111 @@ def main():
     """
 
     # 初始化模块
-    history_managers = [HistoryManager(cfg["history_file"]) for cfg in AGENT_CONFIGS]
+    history = HistoryManager(
+        HISTORY_FILE,
+        create_store(HISTORY_BACKEND, HISTORY_FILE, HISTORY_DB_FILE),
+        flush_interval=HISTORY_FLUSH_INTERVAL,
+        flush_every=HISTORY_FLUSH_EVERY,
+        archive=HistoryArchive(HISTORY_FILE + ".archive", codec=HISTORY_ARCHIVE_CODEC),
+        archive_age=HISTORY_ARCHIVE_DAYS * 24 * 3600
+    )
+    unify_once(history.store, HISTORY_FILE,
+               {cfg["id"]: cfg["legacy_history_file"] for cfg in AGENT_CONFIGS},
+               HISTORY_BACKEND, HISTORY_DB_FILE, history.archive)
+
+    response_cache = ResponseCache(
+        max_entries=RESPONSE_CACHE_SIZE,
+        ttl=RESPONSE_CACHE_TTL,
+        persist_file=RESPONSE_CACHE_FILE
+    )
+    semantic_cache = SemanticCache(
+        threshold=SEMANTIC_THRESHOLD,
+        max_entries=SEMANTIC_CACHE_SIZE,
+        persist_file=SEMANTIC_CACHE_FILE,
+        score_log_file=SEMANTIC_SCORE_LOG
+    ) if SEMANTIC_CACHE_ENABLED else None
 
     agents = []
     for cfg in AGENT_CONFIGS:
         agents.append({
+            "id": cfg["id"],
             "name": cfg["name"],
-            "service": AgentService(cfg["config"], SYSTEM_PROMPT)
+            "context": ContextAssembler(token_budget=cfg["context_tokens"], mode=CONTEXT_MODE),
+            "history": AgentHistory(history, cfg["id"])
         })
 
+    def create_service(agent_index: int) -> AgentService:
+        cfg = AGENT_CONFIGS[agent_index]
+        context = agents[agent_index]["context"]
+        return AgentService(
+            cfg["config"], SYSTEM_PROMPT,
+            cache=response_cache,
+            semantic_cache=semantic_cache,
+            use_memory=context.uses_agent_memory,
+            memory_token_limit=cfg["context_tokens"] if context.uses_agent_memory else None
+        )
+
+    def rehydrate_service(service: AgentService, agent_index: int, user_id: str):
+        # history 模式下代理不保留记忆，无需恢复
+        if service.use_memory:
+            window = agents[agent_index]["context"].history_window
+            service.restore_memory(agents[agent_index]["history"].load_recent(user_id, window))
+
+    sessions = SessionPool(
+        factory=create_service,
+        rehydrate=rehydrate_service,
+        max_sessions=MAX_SESSIONS,
+        idle_timeout=SESSION_IDLE_TIMEOUT
+    )
+    fanout = AgentFanout(max_concurrency=MAX_CONCURRENT_AGENTS)
+    compactor = HistoryCompactor(
+        keep_recent=SUMMARY_KEEP_RECENT,
+        min_new_messages=SUMMARY_MIN_NEW_MESSAGES
+    )
+    # 历史全文检索，首次检索时建立索引，之后随历史写入增量更新
+    search = HistorySearch(history)
+    # 输入预处理器，规则文件变化时在后台重新编译并替换
+    preprocessor = InputPreprocessor(memo_size=PREPROCESS_MEMO_SIZE)
+    rule_watcher = RuleWatcher(RULES_FILE, preprocessor, interval=RULES_CHECK_INTERVAL)
+    rule_watcher.start()
+
     # 添加用户ID选择功能
     print("=== DeepSeek-R1 健康咨询系统 ===")
     user_id = input("请输入用户ID (直接回车使用默认ID): ").strip() or "default_user"
     print(f"当前用户: {user_id}\n")
+    archived = history.archive_old(user_id)
+    if archived:
+        print(f"已将 {archived} 条{HISTORY_ARCHIVE_DAYS}天前的消息移入压缩归档")
 
 
     # 直接启动 GUI 界面
     print("启动图形用户界面...")
+    persistence = None
     try:
         root = tk.Tk()
         # 使用第一个代理作为默认代理
-        app = HealthAgentGUI(root, agents, history_managers, user_id)
+        persistence = PersistenceQueue(maxsize=PERSIST_QUEUE_SIZE)
+        app = HealthAgentGUI(root, agents, history, user_id, fanout, compactor, sessions, persistence, search,
+                             preprocessor, max_overflow=PERSIST_OVERFLOW_SIZE, display_limit=HISTORY_DISPLAY_LIMIT)
         root.mainloop()
     except Exception as e:
         print(f"启动GUI时出错: {e}")
         traceback.print_exc()
         # GUI 启动失败时回退到 CLI
         print("GUI启动失败，回退到命令行界面...")
-        cli = CLIInterface(agents, history_managers, user_id)
+        cli = CLIInterface(agents, history, user_id, fanout, compactor, sessions, search, preprocessor)
         cli.run()
+    finally:
+        rule_watcher.close(timeout=5)
+        if persistence is not None:
+            persistence.close(timeout=30)
+        compactor.close(timeout=10)
+        response_cache.close(timeout=10)
+        if semantic_cache is not None:
+            semantic_cache.close(timeout=10)
+        history.close()
+        fanout.shutdown()
+        http_pool.close()
 
 
 if __name__ == "__main__":
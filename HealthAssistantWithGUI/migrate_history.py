@@ -0,0 +1,233 @@
+# migrate_history.py
+"""聊天历史迁移工具
+
+用法:
+  python migrate_history.py [--db chat_history.db] [历史文件 ...]
+      把 chat_history_*.json（连同未合并的追加日志）一次性导入SQLite数据库。
+      未指定文件时导入当前目录下所有 chat_history_*.json；导出的对话文件（消息列表）会被跳过。
+      重复运行时同一用户的数据会被覆盖，不会重复导入。
+  python migrate_history.py --unify 代理标识=历史文件 ... [--backend journal] [--target chat_history.json]
+      把旧版每个代理各自的历史合并为所有代理共用的统一历史（主程序首次启动时会自动执行）。
+      重复运行不会产生重复消息。
+"""
+import argparse
+import glob
+import heapq
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Any
+
+from history_archive import HistoryArchive
+from history_store import JournalStore, SQLiteStore, BACKEND_JOURNAL, BACKEND_SQLITE, create_store, agent_key
+
+# 旧版每个代理各保存一份用户消息，同一轮的几份时间戳相差不超过该秒数
+USER_TURN_WINDOW = 5.0
+USER_ROLE = "user"  # RoleType.USER 的序列化值
+
+
+def is_history_file(history_file: str) -> bool:
+    """是否为用户历史文件（用户记录列表），有未合并的日志时也视为历史文件"""
+    if os.path.exists(history_file + '.journal'):
+        return True
+    try:
+        with open(history_file, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+    except (json.JSONDecodeError, UnicodeDecodeError, OSError):
+        return False
+    return isinstance(records, list) and all(isinstance(r, dict) and "user_id" in r for r in records)
+
+
+def migrate(history_files, db_file: str) -> int:
+    """逐个文件导入，返回导入的消息总数"""
+    total = 0
+    for history_file in history_files:
+        if not is_history_file(history_file):
+            print(f"跳过 {history_file}: 不是用户历史文件")
+            continue
+        legacy = JournalStore(history_file)
+        try:
+            records = legacy.records()
+        finally:
+            legacy.close()
+        if not records:
+            print(f"跳过 {history_file}: 没有用户历史记录")
+            continue
+
+        start = time.time()
+        store = SQLiteStore(db_file, agent_key(history_file))
+        try:
+            count = store.import_records(records)
+        finally:
+            store.close()
+        total += count
+        print(f"✅ {history_file} -> {agent_key(history_file)}: "
+              f"{len(records)}个用户，{count}条消息，耗时 {time.time() - start:.2f}s")
+    return total
+
+
+def _seconds_between(a: str, b: str) -> float:
+    try:
+        return abs((datetime.fromisoformat(a) - datetime.fromisoformat(b)).total_seconds())
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+def merge_agent_messages(streams: Dict[str, List[Dict[str, Any]]],
+                         window: float = USER_TURN_WINDOW) -> List[Dict[str, Any]]:
+    """把各代理按时间排序的消息合并为一条时间线
+
+    streams: 来源 -> 消息列表；来源为None表示已是统一格式的消息（保留其 agent 字段）。
+    代理回复标记为所属代理；不同来源中内容相同、时间相近的用户消息是同一轮，只保留一份；
+    时间戳、角色和内容都相同的消息视为重复写入，跳过。
+    """
+    def tagged(source, messages):
+        for message in messages:
+            yield message.get("timestamp", ""), source, message
+
+    merged = []
+    seen = set()
+    turn = None  # 当前用户轮次: [内容, 时间戳, 已出现的来源]
+    for timestamp, source, message in heapq.merge(*(tagged(s, m) for s, m in streams.items()),
+                                                  key=lambda item: item[0]):
+        key = (timestamp, message.get("role"), message.get("content"))
+        if key in seen:
+            continue
+        seen.add(key)
+        message = dict(message)
+        if message.get("role") == USER_ROLE:
+            message.pop("agent", None)
+            content = message.get("content")
+            if (turn is not None and turn[0] == content and source not in turn[2]
+                    and _seconds_between(turn[1], timestamp) <= window):
+                turn[2].add(source)
+                continue
+            turn = [content, timestamp, {source}]
+        elif source is not None:
+            message["agent"] = source
+        merged.append(message)
+    return merged
+
+
+def _message_key(message: Dict[str, Any]):
+    return message.get("timestamp"), message.get("role"), message.get("content")
+
+
+def _split_archived(messages: List[Dict[str, Any]], cutoff: str, live_keys):
+    """按最新归档时间把合并后的消息分为（写入归档的, 写入 store 的）"""
+    old, rest = [], []
+    for message in messages:
+        if message.get("timestamp", "") <= cutoff and _message_key(message) not in live_keys:
+            old.append(message)
+        else:
+            rest.append(message)
+    return old, rest
+
+
+def legacy_records(backend: str, history_file: str, db_file: str = None) -> List[Dict[str, Any]]:
+    """用当前后端读取旧版单个代理的全部用户记录"""
+    if backend != BACKEND_SQLITE and not any(os.path.exists(history_file + suffix)
+                                             for suffix in ("", ".journal", ".seg")):
+        return []
+    store = create_store(backend, history_file, db_file)
+    try:
+        return store.records()
+    finally:
+        store.close()
+
+
+def unify(store, agent_files: Dict[str, str], backend: str = BACKEND_JOURNAL, db_file: str = None,
+          archive=None) -> int:
+    """把各代理的旧历史合并进统一历史 store，返回合并后的消息总数
+
+    统一历史中已有的消息（含 archive 中的归档）一并参与合并，每个用户整体替换一次；
+    早于最新归档消息的旧记录写入归档，其余写入 store。
+    各代理的滚动摘要保存到 {"agents": {代理标识: 摘要}}。
+    """
+    users = {}  # user_id -> {来源: 消息列表}
+    summaries = {}
+    for agent, history_file in agent_files.items():
+        for record in legacy_records(backend, history_file, db_file):
+            user_id = record["user_id"]
+            users.setdefault(user_id, {})[agent] = record.get("messages", [])
+            if record.get("summary"):
+                summaries.setdefault(user_id, {})[agent] = record["summary"]
+
+    total = 0
+    for user_id, streams in users.items():
+        live = store.load(user_id)
+        archived = list(archive.iter_messages(user_id)) if archive is not None else []
+        streams[None] = archived + live
+        messages = merge_agent_messages(streams)
+        if archived:
+            # 早于最新归档消息的记录（统一历史中已有的除外）放回归档
+            cutoff = archived[-1].get("timestamp", "")
+            live_keys = {_message_key(m) for m in live}
+            old, messages = _split_archived(messages, cutoff, live_keys)
+            if len(old) > len(archived) and not archive.replace(user_id, old):
+                print(f"⚠️ 用户 {user_id} 的归档合并失败")
+                continue
+            total += len(old)
+        if not store.replace(user_id, messages):
+            print(f"⚠️ 用户 {user_id} 的历史合并失败")
+            continue
+        if user_id in summaries:
+            current = store.load_summary(user_id) or {}
+            agents = dict(summaries[user_id], **current.get("agents", {}))
+            store.save_summary(user_id, dict(current, agents=agents))
+        total += len(messages)
+    return total
+
+
+def unify_once(store, history_file: str, agent_files: Dict[str, str],
+               backend: str = BACKEND_JOURNAL, db_file: str = None, archive=None) -> int:
+    """统一历史首次使用时自动合并旧版分代理历史，完成后写入标记文件，之后不再执行"""
+    marker = history_file + '.unified'
+    if os.path.exists(marker):
+        return 0
+    start = time.time()
+    total = unify(store, agent_files, backend, db_file, archive)
+    with open(marker, 'w', encoding='utf-8') as f:
+        f.write(datetime.now().isoformat())
+    if total:
+        print(f"✅ 已把各代理的历史合并为统一历史: {total}条消息，耗时 {time.time() - start:.2f}s")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把JSON聊天历史导入SQLite数据库，或合并为统一历史")
+    parser.add_argument("files", nargs="*", help="历史文件，默认为 chat_history_*.json；"
+                                                 "--unify 时为 代理标识=历史文件")
+    parser.add_argument("--db", default="chat_history.db", help="目标数据库文件")
+    parser.add_argument("--unify", action="store_true", help="合并各代理的历史为统一历史")
+    parser.add_argument("--backend", default=BACKEND_JOURNAL, help="--unify 时使用的存储后端")
+    parser.add_argument("--target", default="chat_history.json", help="--unify 时的统一历史文件")
+    args = parser.parse_args()
+
+    if args.unify:
+        agent_files = dict(item.split("=", 1) for item in args.files if "=" in item)
+        if not agent_files:
+            print("请以 代理标识=历史文件 的形式指定各代理的历史")
+            return
+        store = create_store(args.backend, args.target, args.db)
+        archive = HistoryArchive(args.target + ".archive")
+        try:
+            total = unify(store, agent_files, args.backend, args.db, archive)
+        finally:
+            store.close()
+            archive.close()
+        print(f"合并完成，统一历史 {args.target} 共 {total} 条消息")
+        return
+
+    files = args.files or sorted(glob.glob("chat_history_*.json"))
+    files = [f for f in files if os.path.isfile(f)]
+    if not files:
+        print("没有找到需要迁移的历史文件")
+        return
+    total = migrate(files, args.db)
+    print(f"迁移完成，共导入 {total} 条消息到 {args.db}")
+
+
+if __name__ == "__main__":
+    main()
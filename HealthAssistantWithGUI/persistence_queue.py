@@ -0,0 +1,110 @@
+# persistence_queue.py
+import queue
+import threading
+import time
+from typing import Callable, Dict, Any
+
+
+class PersistenceQueue:
+    """异步持久化队列
+
+    界面线程把写历史的操作（如 HistoryManager.append）提交到有界队列，由唯一的写线程
+    按提交顺序依次执行，磁盘读写不再阻塞 Tk 主循环。队列满时 submit 阻塞等待（背压），
+    写入跟不上时内存不会无限增长；界面线程应使用 try_submit，队列满时立即返回而不等待。
+    drain 等待已提交的操作全部完成，close 在此之后停止写线程。
+    """
+
+    def __init__(self, maxsize: int = 1000):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+        # 统计信息
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.blocked = 0
+        self.blocked_time = 0.0
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        """尚未执行完的操作数（含正在执行的一个）"""
+        return self._queue.unfinished_tasks
+
+    def submit(self, func: Callable, *args, **kwargs):
+        """提交一个写操作，队列已满时阻塞到有空位为止"""
+        if self._closed:
+            raise RuntimeError("持久化队列已关闭")
+        job = (func, args, kwargs)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            start = time.perf_counter()
+            self._queue.put(job)
+            self.blocked += 1
+            self.blocked_time += time.perf_counter() - start
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self.depth)
+
+    def try_submit(self, func: Callable, *args, **kwargs) -> bool:
+        """提交一个写操作，队列已满时不等待，直接返回False"""
+        if self._closed:
+            raise RuntimeError("持久化队列已关闭")
+        try:
+            self._queue.put_nowait((func, args, kwargs))
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        return True
+
+    def drain(self, timeout: float = None) -> bool:
+        """等待已提交的操作全部完成，超时返回False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout: float = None) -> bool:
+        """写完已提交的操作后停止写线程，可重复调用"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "max_depth": self.max_depth,
+            "blocked": self.blocked,
+            "blocked_time": self.blocked_time,
+            "rejected": self.rejected
+        }
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                func, args, kwargs = job
+                try:
+                    func(*args, **kwargs)
+                    self.completed += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"⚠️ 历史写入失败: {str(e)}")
+            finally:
+                self._queue.task_done()
@@ -1,8 +1,94 @@
 # preprocessor.py
+import argparse
+import copy
+import itertools
+import json
+import os
 import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List
+
+from rule_config import CompiledRules, RULE_FIELDS, load_rules
+
+
+class PreprocessResult:
+    """一次预处理的结果
+
+    text: 规范化后的输入（拼写纠正、术语标准化或命令映射之后），拒绝时为检查所用的文本
+    verdict: 判定结果，见 VERDICT_* 常量
+    error_type / message: 拒绝时的错误类型（"输入错误"、"敏感内容过滤"、"安全防护"）和提示
+    rule: 触发拒绝的规则（敏感词、黑名单命令、正则或 "max_length"）
+    spans: 触发规则在 text 中的位置 [(起始, 结束), ...]
+    elapsed: 预处理耗时（秒），记忆命中时为首次计算的耗时
+    rules_version: 所用规则的版本
+    cached: 是否直接取自记忆
+    """
+
+    VERDICT_OK = "ok"
+    VERDICT_COMMAND = "command"
+    VERDICT_INPUT_ERROR = "input_error"
+    VERDICT_SENSITIVE = "sensitive"
+    VERDICT_BLOCKED = "blocked"
+
+    def __init__(self, text: str, verdict: str = VERDICT_OK, error_type: str = None, message: str = None,
+                 rule: str = None, spans: list = None, elapsed: float = 0.0, rules_version=None):
+        self.text = text
+        self.verdict = verdict
+        self.error_type = error_type
+        self.message = message
+        self.rule = rule
+        self.spans = spans or []
+        self.elapsed = elapsed
+        self.rules_version = rules_version
+        self.cached = False
+
+    @property
+    def ok(self) -> bool:
+        """输入是否可以继续处理（普通输入或命令）"""
+        return self.verdict in (self.VERDICT_OK, self.VERDICT_COMMAND)
+
+    @property
+    def is_command(self) -> bool:
+        return self.verdict == self.VERDICT_COMMAND
+
+    def as_text(self) -> str:
+        """旧版 preprocess 的返回格式：拒绝时为 "[错误类型] 提示"，否则为规范化后的文本"""
+        return self.text if self.ok else f"[{self.error_type}] {self.message}"
+
+    def copy(self, **changes) -> "PreprocessResult":
+        result = PreprocessResult.__new__(PreprocessResult)
+        result.__dict__.update(self.__dict__, **changes)
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "text": self.text,
+            "verdict": self.verdict,
+            "error_type": self.error_type,
+            "message": self.message,
+            "rule": self.rule,
+            "spans": self.spans,
+            "elapsed": self.elapsed,
+            "rules_version": self.rules_version,
+            "cached": self.cached
+        }
+
+    def __repr__(self):
+        return (f"PreprocessResult(verdict={self.verdict!r}, text={self.text!r}, rule={self.rule!r}, "
+                f"spans={self.spans!r}, elapsed={self.elapsed * 1000:.3f}ms)")
+
 
 class InputPreprocessor:
-    def __init__(self):
+    # 输入超过该长度时不记忆结果
+    MEMO_MAX_INPUT = 2000
+    # preprocess_many 的输入多于该数量时使用进程池
+    PARALLEL_THRESHOLD = 5000
+
+    def __init__(self, memo_size: int = 4096):
         # 初始化预处理配置
         self.max_length = 500
         self.sensitive_words = ["暴力", "色情", "政治敏感词"]  # 示例敏感词列表
@@ -41,10 +127,142 @@ class InputPreprocessor:
             r"eval\s*\(", r"execfile\s*\(", r"__import__\s*\(",
             r"pickle\.load", r"yaml\.load", r"json\.loads"
         ]
+        self.sql_injection_patterns = [
+            r"[\s;]--", r"[\s;]#", r"[\s;]/\*", r"union[\s]+select",
+            r"drop[\s]+table", r"delete[\s]+from", r"insert[\s]+into",
+            r"update[\s]+\w+[\s]+set", r"xp_cmdshell", r"waitfor[\s]+delay"
+        ]
+        # 规则版本，使用外部规则文件时为文件中的 version
+        self.rules_version = None
+        # 内置规则：规则文件中没有的字段使用这里的值
+        self.default_rules = {field: copy.copy(value) for field, value in self.rule_dict().items()}
+        self.compile_rules()
+
+        # 结果记忆：(规则指纹, 原始输入) -> PreprocessResult，按LRU淘汰
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+    def rule_dict(self) -> dict:
+        """当前规则的字典形式（规则文件中的字段）"""
+        return {field: getattr(self, field) for field in RULE_FIELDS}
+
+    def compile_rules(self):
+        """按当前词表和正则重新编译，直接修改词表后需调用"""
+        self._compiled = CompiledRules(self.rule_dict(), self.rules_version)
+
+    def apply_rules(self, rules: dict, compiled: CompiledRules):
+        """换用另一版本的规则（由 RuleWatcher 在后台编译好后调用）
+
+        编译结果整体替换，正在执行的预处理继续使用旧版本，之后的调用使用新版本。
+        """
+        # 复制一份，load_config 等原地修改不会影响内置规则
+        for field in RULE_FIELDS:
+            setattr(self, field, copy.copy(rules[field]))
+        self.rules_version = compiled.version
+        self._compiled = compiled
+
+    def find_sensitive(self, text: str):
+        """返回文本中第一个敏感词，没有时返回None"""
+        detector = self._compiled.detector
+        for _, _, index in detector.iter_matches(text.lower()):
+            kind, word = detector.values[index]
+            if kind == "敏感内容过滤":
+                return word
+        return None
+
+    def _memo_get(self, rules: CompiledRules, user_input: str):
+        key = (rules.fingerprint, user_input)
+        with self._memo_lock:
+            result = self._memo.get(key)
+            if result is None:
+                self.memo_misses += 1
+                return None
+            self._memo.move_to_end(key)
+            self.memo_hits += 1
+        return result.copy(cached=True)
+
+    def _memo_put(self, rules: CompiledRules, user_input: str, result: PreprocessResult):
+        if self.memo_size <= 0 or len(user_input) > self.MEMO_MAX_INPUT:
+            return
+        with self._memo_lock:
+            self._memo[(rules.fingerprint, user_input)] = result
+            self._memo.move_to_end((rules.fingerprint, user_input))
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
 
-    def preprocess(self, user_input: str) -> str:
+    def _memoized(self, rules: CompiledRules, user_input: str) -> PreprocessResult:
+        result = self._memo_get(rules, user_input)
+        if result is None:
+            result = self._run(rules, user_input)
+            self._memo_put(rules, user_input, result)
+        return result
+
+    def preprocess(self, user_input: str) -> PreprocessResult:
+        """输入预处理，返回 PreprocessResult
+
+        结果按 (规则指纹, 原始输入) 记忆，重复的输入直接返回记忆的结果；
+        规则热加载后指纹改变，旧结果不会再被使用，随LRU淘汰
         """
-        输入预处理函数
+        # 整个处理过程使用同一版本的规则，不受热加载影响
+        return self._memoized(self._compiled, user_input)
+
+    def preprocess_many(self, inputs: Iterable[str], workers: int = None, parallel_threshold: int = None,
+                        chunk_size: int = 256) -> Iterator[PreprocessResult]:
+        """批量预处理，按输入顺序逐个产出结果
+
+        整批使用调用时的规则版本。输入不超过 parallel_threshold（默认 PARALLEL_THRESHOLD）条时
+        在本进程内逐条处理；更多时按 chunk_size 分块交给进程池，同时在途的块不超过进程数的两倍，
+        输入可以是不定长的流。记忆在本进程内查询和更新，同一块内的重复输入只计算一次。
+        """
+        rules = self._compiled
+        workers = workers or os.cpu_count() or 1
+        threshold = self.PARALLEL_THRESHOLD if parallel_threshold is None else parallel_threshold
+        iterator = iter(inputs)
+        head = list(itertools.islice(iterator, threshold + 1))
+        if len(head) <= threshold or workers < 2:
+            for user_input in itertools.chain(head, iterator):
+                yield self._memoized(rules, user_input)
+            return
+        yield from self._preprocess_parallel(rules, itertools.chain(head, iterator), workers, chunk_size)
+
+    def _preprocess_parallel(self, rules: CompiledRules, iterator: Iterator[str], workers: int,
+                             chunk_size: int) -> Iterator[PreprocessResult]:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rules,))
+        pending = deque()  # (输入块, 记忆命中的结果, 待计算的输入, future)
+        try:
+            while True:
+                chunk = list(itertools.islice(iterator, chunk_size))
+                if chunk:
+                    results = [self._memo_get(rules, user_input) for user_input in chunk]
+                    misses = list(dict.fromkeys(u for u, r in zip(chunk, results) if r is None))
+                    future = pool.submit(_preprocess_chunk, misses) if misses else None
+                    pending.append((chunk, results, misses, future))
+                    if len(pending) < workers * 2:
+                        continue
+                if not pending:
+                    break
+                chunk, results, misses, future = pending.popleft()
+                if future is not None:
+                    computed = {u: PreprocessResult(*fields, rules_version=rules.version)
+                                for u, fields in zip(misses, future.result())}
+                    for user_input, result in computed.items():
+                        self._memo_put(rules, user_input, result)
+                    results = [r if r is not None else computed[u] for u, r in zip(chunk, results)]
+                yield from results
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def memo_stats(self) -> dict:
+        with self._memo_lock:
+            return {"entries": len(self._memo), "hits": self.memo_hits, "misses": self.memo_misses}
+
+    @staticmethod
+    def _run(rules: CompiledRules, user_input: str) -> PreprocessResult:
+        """
+        输入预处理函数，一遍完成规范化和检查
         1. 清理多余空格和特殊字符
         2. 处理常见拼写错误
         3. 标准化医疗术语
@@ -52,57 +270,69 @@ class InputPreprocessor:
         5. 输入长度检查
         6. 命令映射
         """
+        start = time.perf_counter()
+
+        def finish(text, verdict=PreprocessResult.VERDICT_OK, error_type=None, message=None, rule=None, spans=None):
+            return PreprocessResult(text, verdict, error_type, message, rule, spans,
+                                    time.perf_counter() - start, rules.version)
+
         # 0. 基本清理
         processed = re.sub(r'\s+', ' ', user_input).strip()
 
         # 1. 输入长度检查
-        if len(processed) > self.max_length:
-            return f"[输入错误] 输入过长（{len(processed)}字符），请控制在{self.max_length}字符内"
-        
-        # 2. 检查是否为命令
-        if processed.startswith('/'):
-            return processed
+        if len(processed) > rules.max_length:
+            return finish(processed, PreprocessResult.VERDICT_INPUT_ERROR, "输入错误",
+                          f"输入过长（{len(processed)}字符），请控制在{rules.max_length}字符内", "max_length")
         
+        # 2. 检查是否为命令（命令只检查敏感词）
         # 3. 映射常见命令
-        for chinese_cmd, english_cmd in self.command_mapping.items():
-            if processed == chinese_cmd:
-                return english_cmd
+        command = processed if processed.startswith('/') else rules.command_mapping.get(processed)
+        if command is not None:
+            for start_offset, end_offset, index in rules.detector.iter_matches(command.lower()):
+                kind, word = rules.detector.values[index]
+                if kind == "敏感内容过滤":
+                    return finish(command, PreprocessResult.VERDICT_SENSITIVE, kind, f"输入包含敏感词'{word}'",
+                                  word, [(start_offset, end_offset)])
+            return finish(command, PreprocessResult.VERDICT_COMMAND)
         
-        # 4. 替换常见拼写错误
-        for wrong, correct in self.spelling_corrections.items():
-            processed = processed.replace(wrong, correct)
+        # 4-5. 一遍扫描替换常见拼写错误并标准化医疗术语
+        processed = rules.replacer.replace(processed)
         
-        # 5. 标准化医疗术语
-        for term, standard in self.medical_terms.items():
-            processed = processed.replace(term, standard)
+        # 6-7. 一遍扫描检查敏感词和黑名单命令
+        # 敏感词优先；命中多个黑名单命令时按黑名单中的顺序报告
+        sensitive = []
+        blocked = None
+        blocked_spans = {}
+        for start_offset, end_offset, index in rules.detector.iter_matches(processed.lower()):
+            if rules.detector.values[index][0] == "敏感内容过滤":
+                sensitive.append((start_offset, end_offset, index))
+            elif not sensitive:
+                blocked_spans.setdefault(index, []).append((start_offset, end_offset))
+                if blocked is None or index < blocked:
+                    blocked = index
+        if sensitive:
+            sensitive.sort()
+            return finish(processed, PreprocessResult.VERDICT_SENSITIVE, "敏感内容过滤",
+                          "您的问题包含不适当内容，请重新表述", rules.detector.values[sensitive[0][2]][1],
+                          [(start_offset, end_offset) for start_offset, end_offset, _ in sensitive])
+        if blocked is not None:
+            cmd = rules.detector.values[blocked][1]
+            return finish(processed, PreprocessResult.VERDICT_BLOCKED, "安全防护",
+                          f"检测到潜在危险命令 '{cmd}'，已阻止执行", cmd, blocked_spans[blocked])
         
-        # 6. 敏感词过滤
-        for word in self.sensitive_words:
-            if word in processed:
-                return f"[敏感内容过滤] 您的问题包含不适当内容，请重新表述"
-    
-        # 7. 指令注入防护
-        # 检查黑名单命令
-        for cmd in self.command_blacklist:
-            if cmd in processed.lower():
-                return f"[安全防护] 检测到潜在危险命令 '{cmd}'，已阻止执行"
-        
-        # 检查注入模式
-        for pattern in self.injection_patterns:
-            if re.search(pattern, processed, re.IGNORECASE):
-                return f"[安全防护] 检测到潜在代码注入模式，已阻止执行"
-        
-        # 8. SQL注入防护
-        sql_injection_patterns = [
-            r"[\s;]--", r"[\s;]#", r"[\s;]/\*", r"union[\s]+select",
-            r"drop[\s]+table", r"delete[\s]+from", r"insert[\s]+into",
-            r"update[\s]+\w+[\s]+set", r"xp_cmdshell", r"waitfor[\s]+delay"
-        ]
-        for pattern in sql_injection_patterns:
-            if re.search(pattern, processed, re.IGNORECASE):
-                return f"[安全防护] 检测到SQL注入尝试，已阻止执行"
+        # 8. 一遍扫描检查代码注入和SQL注入模式
+        hit = rules.engine.search(processed)
+        if hit is not None:
+            category, pattern, match = hit
+            message = "检测到SQL注入尝试，已阻止执行" if category == "sql" else "检测到潜在代码注入模式，已阻止执行"
+            return finish(processed, PreprocessResult.VERDICT_BLOCKED, "安全防护", message, pattern, [match.span()])
+
+        # 9. 术语标准化可能使文本变长，再检查一次长度
+        if len(processed) > rules.max_length:
+            return finish(processed, PreprocessResult.VERDICT_INPUT_ERROR, "输入错误",
+                          f"输入过长（{len(processed)}字符），请控制在{rules.max_length}字符内", "max_length")
         
-        return processed
+        return finish(processed)
 
     # def validate(self, text: str) -> tuple:
     #     """统一验证输入，返回 (是否有效, 错误信息)"""
@@ -123,8 +353,14 @@ class InputPreprocessor:
         
     #     # 其他可能的验证规则...
     #     return True, ""
-    def validate(self, text: str) -> tuple:
-        """统一验证输入，返回 (是否有效, 错误信息)"""
+    def validate(self, text) -> tuple:
+        """统一验证输入，返回 (是否有效, 错误信息)
+
+        传入 PreprocessResult 时直接使用其中的判定结果，不再重复检查；
+        传入字符串时按旧版 preprocess 的返回格式解析
+        """
+        if isinstance(text, PreprocessResult):
+            return (True, "") if text.ok else (False, (text.error_type, text.message))
         # 检查预处理阶段标记的错误
         if text.startswith(("[输入错误]", "[敏感内容过滤]", "[安全防护]")):
             error_type = text.split("]", 1)[0][1:]  # 提取错误类型
@@ -132,9 +368,9 @@ class InputPreprocessor:
             return False, (error_type, error_msg)
     
         # 双重检查敏感词（简化版）
-        for word in self.sensitive_words:
-            if word in text:
-                return False, ("敏感内容过滤", f"输入包含敏感词'{word}'")
+        word = self.find_sensitive(text)
+        if word is not None:
+            return False, ("敏感内容过滤", f"输入包含敏感词'{word}'")
         
         # 检查输入长度（即使预处理已检查，这里作为双重保障）
         if len(text) > self.max_length:
@@ -152,5 +388,60 @@ class InputPreprocessor:
             self.sensitive_words.extend(config['sensitive_words'])
         if 'command_mapping' in config:
             self.command_mapping.update(config['command_mapping'])
-    
-    
\ No newline at end of file
+        self.compile_rules()
+
+
+# 进程池工作进程使用的规则，由 _init_worker 在进程启动时设置
+_worker_rules = None
+
+
+def _init_worker(rules: CompiledRules):
+    global _worker_rules
+    _worker_rules = rules
+
+
+def _preprocess_chunk(inputs: List[str]) -> List[tuple]:
+    """在工作进程中预处理一块输入；结果以元组返回，序列化开销比对象小得多"""
+    results = []
+    for user_input in inputs:
+        r = InputPreprocessor._run(_worker_rules, user_input)
+        results.append((r.text, r.verdict, r.error_type, r.message, r.rule, r.spans, r.elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量预处理输入（每行一条），按JSONL输出结果")
+    parser.add_argument("input", help="输入文件，- 表示标准输入")
+    parser.add_argument("-o", "--output", help="输出文件，默认输出到标准输出")
+    parser.add_argument("--rules", help="规则文件（.json 或 .toml），默认使用内置规则")
+    parser.add_argument("--workers", type=int, help="进程数，默认为CPU核数")
+    parser.add_argument("--parallel-threshold", type=int, help="输入多于该数量时使用进程池")
+    args = parser.parse_args()
+
+    preprocessor = InputPreprocessor()
+    if args.rules:
+        rules, compiled, _ = load_rules(args.rules, preprocessor.default_rules)
+        preprocessor.apply_rules(rules, compiled)
+
+    source = sys.stdin if args.input == "-" else open(args.input, 'r', encoding='utf-8')
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    start = time.time()
+    count = rejected = 0
+    try:
+        lines = (line.rstrip("\n") for line in source)
+        for result in preprocessor.preprocess_many(lines, args.workers, args.parallel_threshold):
+            output.write(json.dumps(result.to_dict(), ensure_ascii=False) + "\n")
+            count += 1
+            rejected += not result.ok
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    stats = preprocessor.memo_stats()
+    print(f"预处理完成：{count}条，拒绝{rejected}条，记忆命中{stats['hits']}次，"
+          f"耗时 {time.time() - start:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
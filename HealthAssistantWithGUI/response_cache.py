@@ -0,0 +1,179 @@
+# response_cache.py
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from schemas import HealthOutputSchema
+
+
+class ResponseCache:
+    """AgentService 的精确匹配回复缓存
+
+    键由系统提示词哈希、模型参数(temperature/top_p等)、代理记忆的摘要和规范化后的输入组成，
+    值为校验通过的 HealthOutputSchema。按LRU淘汰并带TTL过期，
+    可选地持久化到磁盘，重启后继续生效。写入后由后台线程延迟 save_delay 秒再落盘，
+    期间的多次写入合并为一次，回复路径上不做文件I/O；退出前调用 close 写入剩余改动。
+    """
+
+    FORMAT_VERSION = 2
+
+    def __init__(self, max_entries: int = 512, ttl: float = 7 * 24 * 3600, persist_file: str = None,
+                 save_delay: float = 2.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist_file = persist_file
+        self.save_delay = save_delay
+        self._entries = OrderedDict()  # key -> (写入时间, 回复字典)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._saver = None
+
+        # 统计计数
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if persist_file:
+            self._load()
+            self._saver = threading.Thread(target=self._save_loop, name="response-cache-saver", daemon=True)
+            self._saver.start()
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """规范化输入：合并空白字符"""
+        return re.sub(r'\s+', ' ', message).strip()
+
+    @classmethod
+    def make_key(cls, system_prompt: str, config: Dict[str, Any], message: str, context: str = "") -> str:
+        """生成缓存键
+
+        context: 本轮之前代理记忆中对话的摘要（AgentService 维护），记忆不同的会话互不命中
+        """
+        prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+        payload = json.dumps(
+            {"system": prompt_hash, "config": config, "context": context, "message": cls.normalize(message)},
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[HealthOutputSchema]:
+        """查询缓存，命中时返回新的 HealthOutputSchema"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            created_at, output = entry
+            if self._expired(created_at):
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return HealthOutputSchema(**output)
+
+    def put(self, key: str, output: HealthOutputSchema):
+        """写入缓存"""
+        with self._lock:
+            self._entries[key] = (time.time(), output.dict())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        if self.persist_file:
+            self._dirty.set()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+        if self.persist_file:
+            self._dirty.set()
+
+    def close(self, timeout: float = None):
+        """停止后台线程，并把尚未落盘的改动写入磁盘"""
+        self._stop.set()
+        self._dirty.set()
+        if self._saver is not None:
+            self._saver.join(timeout)
+            self._saver = None
+
+    def _save_loop(self):
+        """后台落盘：有改动后等待 save_delay 秒，把这段时间内的写入合并为一次保存"""
+        while True:
+            self._dirty.wait()
+            self._stop.wait(self.save_delay)
+            self._dirty.clear()
+            self.save()
+            if self._stop.is_set():
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def save(self):
+        """原子写入磁盘"""
+        with self._lock:
+            data = {
+                "version": self.FORMAT_VERSION,
+                "entries": [
+                    {"key": key, "created_at": created_at, "output": output}
+                    for key, (created_at, output) in self._entries.items()
+                ]
+            }
+        temp_file = f"{self.persist_file}.{os.getpid()}.tmp"
+        with self._save_lock:
+            try:
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(temp_file, self.persist_file)
+            except Exception as e:
+                print(f"⚠️ 回复缓存写入失败: {str(e)}")
+
+    def _load(self):
+        """从磁盘加载未过期的缓存"""
+        if not os.path.exists(self.persist_file):
+            return
+        try:
+            with open(self.persist_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"⚠️ 回复缓存加载失败: {str(e)}")
+            return
+
+        if not isinstance(data, dict) or data.get("version") != self.FORMAT_VERSION:
+            return
+        for entry in data.get("entries", []):
+            try:
+                if self._expired(entry["created_at"]):
+                    continue
+                self._entries[entry["key"]] = (entry["created_at"], entry["output"])
+            except (KeyError, TypeError):
+                continue
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
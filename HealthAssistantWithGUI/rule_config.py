@@ -0,0 +1,288 @@
+# rule_config.py
+"""预处理规则文件与热加载
+
+词表和正则规则可以写在外部 JSON 或 TOML 文件中（需带 version 字段），文件里没有的字段
+使用 InputPreprocessor 的内置规则。RuleWatcher 在后台监视规则文件，内容变化后重新编译，
+再整体替换预处理器的规则，无需重启。编译结果（自动机状态表和合并后的正则文本）以JSON
+缓存在规则文件旁的 .compiled.json 文件中，键为规则内容的指纹加缓存格式版本；规则未变时
+启动直接载入状态表，不必重新构建大词表的自动机。缓存只含数据，载入时经校验后通过
+AhoCorasick.shared 注册，键不符或文件损坏时重新编译并覆盖。
+
+规则文件示例（JSON）:
+  {"version": 3, "sensitive_words": ["赌博", "毒品"], "medical_terms": {"头疼": "头痛"}}
+
+命令行用法:
+  python -m rule_config --dump preprocess_rules.json   # 把内置规则写成规则文件模板
+  python -m rule_config preprocess_rules.json          # 检查规则文件并报告编译耗时
+  python -m rule_config preprocess_rules.json --no-cache
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+try:
+    import tomllib
+except ImportError:  # Python 3.10 及更早只支持 JSON 规则文件
+    tomllib = None
+
+from aho_corasick import AhoCorasick
+from rule_engine import RuleEngine
+
+# 规则字段 -> 类型
+RULE_FIELDS = {
+    "max_length": int,
+    "spelling_corrections": dict,
+    "medical_terms": dict,
+    "sensitive_words": list,
+    "command_mapping": dict,
+    "command_blacklist": list,
+    "injection_patterns": list,
+    "sql_injection_patterns": list
+}
+
+# 规则指纹格式版本，CompiledRules 的编译方式变化时递增，使旧指纹下的预处理结果记忆失效
+RULES_KEY_VERSION = 2
+# 编译缓存文件的格式版本，状态表的结构变化时递增
+CACHE_FORMAT_VERSION = 3
+CACHE_SUFFIX = ".compiled.json"
+
+
+class CompiledRules:
+    """一个版本的规则编译结果
+
+    编译后只读。预处理器整体替换该对象完成规则切换，正在执行的预处理继续使用旧对象。
+    tables 为 tables() 导出的编译结果，给出时从中载入自动机和合并正则。
+    """
+
+    def __init__(self, rules: Dict[str, Any], version=None, tables: Dict[str, Any] = None):
+        self.version = version
+        # 规则内容的指纹：version 相同但内容不同的规则也能区分，用作预处理结果记忆的键
+        self.fingerprint = rules_key(rules, version)
+        self.max_length = rules["max_length"]
+        self.command_mapping = dict(rules["command_mapping"])
+
+        # 拼写纠正与医疗术语合并为一个替换自动机，同一词条以拼写纠正为准
+        replacements = dict(rules["spelling_corrections"])
+        for term, standard in rules["medical_terms"].items():
+            replacements.setdefault(term, standard)
+        self.replacer = AhoCorasick.shared(replacements, tables and tables["replacer"])
+
+        # 敏感词与黑名单命令合并为一个检测自动机，在小写化的文本上匹配
+        detections = {}
+        for word in rules["sensitive_words"]:
+            detections.setdefault(word.lower(), ("敏感内容过滤", word))
+        for cmd in rules["command_blacklist"]:
+            detections.setdefault(cmd.lower(), ("安全防护", cmd))
+        self.detector = AhoCorasick.shared(detections, tables and tables["detector"])
+
+        # 代码注入与SQL注入模式合并为一个正则
+        self.engine = RuleEngine({"injection": rules["injection_patterns"], "sql": rules["sql_injection_patterns"]},
+                                 source=tables and tables["regex"])
+
+    def tables(self) -> Dict[str, Any]:
+        """导出编译结果（JSON可表示），写入编译缓存"""
+        return {"replacer": self.replacer.tables(), "detector": self.detector.tables(), "regex": self.engine.source}
+
+
+def read_rule_file(rules_file: str) -> Dict[str, Any]:
+    """读取并校验规则文件，返回其中的字段（含 version）"""
+    with open(rules_file, 'rb') as f:
+        data = f.read()
+    if rules_file.lower().endswith(".toml"):
+        if tomllib is None:
+            raise ValueError("读取 TOML 规则文件需要 Python 3.11 及以上版本")
+        rules = tomllib.loads(data.decode('utf-8'))
+    else:
+        rules = json.loads(data.decode('utf-8'))
+    if not isinstance(rules, dict):
+        raise ValueError("规则文件内容不是对象")
+    if "version" not in rules:
+        raise ValueError("规则文件缺少 version 字段")
+    for field, value in rules.items():
+        if field == "version":
+            continue
+        if field not in RULE_FIELDS:
+            print(f"⚠️ 忽略规则文件中的未知字段: {field}")
+        elif not isinstance(value, RULE_FIELDS[field]) or isinstance(value, bool):
+            raise ValueError(f"规则字段 {field} 应为 {RULE_FIELDS[field].__name__}")
+    return {k: v for k, v in rules.items() if k == "version" or k in RULE_FIELDS}
+
+
+def rules_key(rules: Dict[str, Any], version) -> str:
+    """规则内容的哈希，用于判断规则是否变化"""
+    payload = json.dumps([RULES_KEY_VERSION, version, rules], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def merge_rules(rules_file: str, defaults: Dict[str, Any]) -> Tuple[Dict[str, Any], Any]:
+    """读取规则文件并与内置规则合并，返回 (合并后的规则, version)
+
+    defaults: 内置规则，文件中没有的字段使用这里的值
+    """
+    file_rules = read_rule_file(rules_file)
+    version = file_rules.pop("version")
+    rules = dict(defaults)
+    rules.update(file_rules)
+    return rules, version
+
+
+def compile_rules(rules: Dict[str, Any], version, cache_file: str = None) -> Tuple[CompiledRules, bool]:
+    """编译规则，返回 (编译结果, 是否来自缓存)
+
+    cache_file: 编译缓存文件，为None时不读写缓存
+    """
+    key = rules_key(rules, version)
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get("format") == CACHE_FORMAT_VERSION and cached.get("key") == key:
+                return CompiledRules(rules, version, cached["tables"]), True
+        except Exception as e:
+            print(f"⚠️ 规则编译缓存无效，重新编译: {str(e)}")
+
+    compiled = CompiledRules(rules, version)
+    if cache_file:
+        temp_file = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump({"format": CACHE_FORMAT_VERSION, "key": key, "tables": compiled.tables()},
+                          f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(temp_file, cache_file)
+        except Exception as e:
+            print(f"⚠️ 规则编译缓存写入失败: {str(e)}")
+    return compiled, False
+
+
+def load_rules(rules_file: str, defaults: Dict[str, Any],
+               use_cache: bool = True) -> Tuple[Dict[str, Any], CompiledRules, bool]:
+    """读取规则文件并编译，返回 (合并后的规则, 编译结果, 是否来自缓存)"""
+    rules, version = merge_rules(rules_file, defaults)
+    compiled, from_cache = compile_rules(rules, version, rules_file + CACHE_SUFFIX if use_cache else None)
+    return rules, compiled, from_cache
+
+
+class RuleWatcher:
+    """监视规则文件并热加载
+
+    后台线程每隔 interval 秒检查一次文件的修改时间和大小，变化后在该线程内读取和编译，
+    完成后调用 preprocessor.apply_rules 一次性替换。启动时文件不存在则使用内置规则，
+    运行中删除文件或加载失败（格式错误、正则无法编译等）时保留当前规则并打印警告。
+    文件被重写但内容和 version 都未变时不重新编译。
+    """
+
+    def __init__(self, rules_file: str, preprocessor, interval: float = 2.0, use_cache: bool = True):
+        self.rules_file = rules_file
+        self.preprocessor = preprocessor
+        self.interval = interval
+        self.use_cache = use_cache
+        self._stamp = None
+        self._key = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        # 统计信息
+        self.reloads = 0
+        self.failures = 0
+        self.last_latency = None
+        self.last_from_cache = False
+        self.unchanged = 0
+
+        # 启动时同步加载一次，之后的请求都使用文件中的规则
+        self.check()
+
+    def check(self) -> bool:
+        """文件有变化时重新加载，返回是否换用了新规则"""
+        try:
+            stat = os.stat(self.rules_file)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        return self.reload() if stamp is not None else False
+
+    def reload(self) -> bool:
+        start = time.perf_counter()
+        try:
+            rules, version = merge_rules(self.rules_file, self.preprocessor.default_rules)
+            if rules_key(rules, version) == self._current_key():
+                self.unchanged += 1
+                return False
+            compiled, from_cache = compile_rules(
+                rules, version, self.rules_file + CACHE_SUFFIX if self.use_cache else None)
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ 规则文件加载失败，继续使用版本 {self.preprocessor.rules_version}: {str(e)}")
+            return False
+        key = rules_key(rules, None)
+        if self._key is not None and key != self._key and compiled.version == self.preprocessor.rules_version:
+            print(f"⚠️ 规则内容已变化，但 version 仍为 {compiled.version}")
+        self._key = key
+        self.preprocessor.apply_rules(rules, compiled)
+        self.last_latency = time.perf_counter() - start
+        self.last_from_cache = from_cache
+        self.reloads += 1
+        print(f"预处理规则已加载：版本 {compiled.version}，耗时 {self.last_latency * 1000:.1f}ms"
+              + ("（使用编译缓存）" if from_cache else ""))
+        return True
+
+    def _current_key(self) -> str:
+        return rules_key(self.preprocessor.rule_dict(), self.preprocessor.rules_version)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rule-watcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def close(self, timeout: float = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.preprocessor.rules_version,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_latency": self.last_latency,
+            "last_from_cache": self.last_from_cache,
+            "unchanged": self.unchanged
+        }
+
+
+def main():
+    from preprocessor import InputPreprocessor
+
+    parser = argparse.ArgumentParser(description="检查预处理规则文件")
+    parser.add_argument("rules_file", help="规则文件（.json 或 .toml）")
+    parser.add_argument("--dump", action="store_true", help="把内置规则写入该文件作为模板")
+    parser.add_argument("--no-cache", action="store_true", help="不读写编译缓存")
+    args = parser.parse_args()
+
+    preprocessor = InputPreprocessor()
+    if args.dump:
+        with open(args.rules_file, 'w', encoding='utf-8') as f:
+            json.dump(dict(version=1, **preprocessor.default_rules), f, ensure_ascii=False, indent=2)
+        print(f"已写入内置规则: {args.rules_file}")
+        return
+
+    start = time.perf_counter()
+    rules, compiled, from_cache = load_rules(args.rules_file, preprocessor.default_rules, not args.no_cache)
+    elapsed = time.perf_counter() - start
+    print(f"规则版本 {compiled.version}：{len(compiled.replacer)} 条替换词，{len(compiled.detector)} 条检测词，"
+          f"{len(compiled.engine.rules)} 条正则，耗时 {elapsed * 1000:.1f}ms"
+          + ("（使用编译缓存）" if from_cache else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# rule_engine.py
+"""预编译的正则规则引擎
+
+把多组正则规则合并为一个带命名分组的多选正则，初始化时编译一次，扫描一遍文本即可
+知道命中了哪一条规则。
+
+命令行用法（对比逐条 re.search 与合并正则的单条输入耗时）:
+  python -m rule_engine [--iterations 2000]
+"""
+import argparse
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python 3.10 及更早
+    import sre_parse
+
+# 字符类中的类别 -> 正则写法
+_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: r"\d", sre_parse.CATEGORY_NOT_DIGIT: r"\D",
+    sre_parse.CATEGORY_SPACE: r"\s", sre_parse.CATEGORY_NOT_SPACE: r"\S",
+    sre_parse.CATEGORY_WORD: r"\w", sre_parse.CATEGORY_NOT_WORD: r"\W"
+}
+
+
+def _first_chars(items) -> Optional[List[str]]:
+    """分析解析后的正则，返回匹配第一个字符的字符类片段；可能匹配任意字符或空串时返回None"""
+    for op, av in items:
+        if op is sre_parse.AT:
+            continue  # ^、\b 等零宽断言不消耗字符
+        if op is sre_parse.LITERAL:
+            return [re.escape(chr(av))]
+        if op is sre_parse.IN:
+            fragments = []
+            for item_op, item_av in av:
+                if item_op is sre_parse.LITERAL:
+                    fragments.append(re.escape(chr(item_av)))
+                elif item_op is sre_parse.RANGE:
+                    fragments.append(f"{re.escape(chr(item_av[0]))}-{re.escape(chr(item_av[1]))}")
+                elif item_op is sre_parse.CATEGORY and item_av in _CATEGORIES:
+                    fragments.append(_CATEGORIES[item_av])
+                else:
+                    return None
+            return fragments
+        if op is sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, pattern = av
+            return None if add_flags or del_flags else _first_chars(pattern)
+        if op is sre_parse.BRANCH:
+            fragments = []
+            for pattern in av[1]:
+                first = _first_chars(pattern)
+                if first is None:
+                    return None
+                fragments.extend(first)
+            return fragments
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, _, pattern = av
+            return _first_chars(pattern) if low > 0 else None
+        return None
+    return None
+
+
+class RuleEngine:
+    """合并正则规则引擎
+
+    rules 为 规则类别 -> 正则列表，每条正则放进名为 r<序号> 的分组，所有分组用 | 连接。
+    search 的结果与按类别顺序逐条 re.search 一致：报告靠前类别中的命中，同一类别取文本中
+    最先出现的一处，同一位置有多条规则可以匹配时取列表中靠前的一条。合并正则扫描一遍找到最先
+    出现的命中；只有它不属于第一个类别时，才在其后的文本中再查找更靠前类别的规则。
+    规则中不能使用按序号的反向引用（分组序号会因合并而改变）。
+
+    re 对多选分组不做首字符优化，会在每个位置逐条尝试全部分支。能确定所有规则可能的
+    首字符时，在最前面加上首字符的前瞻断言，不可能命中的位置直接跳过。
+    合并后的正则文本保存在 source 中；给出 source 参数时直接编译，不再分析首字符。
+    """
+
+    def __init__(self, rules: Dict[str, List[str]], flags: int = re.IGNORECASE, source: str = None):
+        self.rules: List[Tuple[str, str]] = [
+            (category, pattern) for category, patterns in rules.items() for pattern in patterns
+        ]
+        self.flags = flags
+        self._categories = [category for category, patterns in rules.items() if patterns]
+        self._category_regex = {}  # 规则类别 -> 只含该类别规则的合并正则，需要时才编译
+        if source is None and self.rules:
+            source = "|".join(f"(?P<r{i}>{pattern})" for i, (_, pattern) in enumerate(self.rules))
+            first = []
+            for _, pattern in self.rules:
+                chars = _first_chars(sre_parse.parse(pattern, flags))
+                if chars is None:
+                    first = None
+                    break
+                first.extend(chars)
+            if first:
+                source = f"(?=[{''.join(dict.fromkeys(first))}])(?:{source})"
+        self.source = source if self.rules else None
+        self._regex = re.compile(source, flags) if self.rules else None
+        if self._regex is not None and any(f"r{i}" not in self._regex.groupindex for i in range(len(self.rules))):
+            raise ValueError("合并正则与规则列表不一致")
+
+    def search(self, text: str) -> Optional[Tuple[str, str, re.Match]]:
+        """返回 (规则类别, 命中的正则, 匹配对象)，没有命中时返回None"""
+        if self._regex is None:
+            return None
+        match = self._regex.search(text)
+        if match is None:
+            return None
+        category, pattern = self.rules[int(match.lastgroup[1:])]
+        # 靠前类别的规则在该位置及之前都不能命中，只需从下一个位置起查找
+        for earlier in self._categories[:self._categories.index(category)]:
+            earlier_match = self._regex_for(earlier).search(text, match.start() + 1)
+            if earlier_match is not None:
+                return earlier, self.rules[int(earlier_match.lastgroup[1:])][1], earlier_match
+        return category, pattern, match
+
+    def _regex_for(self, category: str) -> re.Pattern:
+        regex = self._category_regex.get(category)
+        if regex is None:
+            regex = re.compile("|".join(f"(?P<r{i}>{pattern})" for i, (c, pattern) in enumerate(self.rules)
+                                        if c == category), self.flags)
+            self._category_regex[category] = regex
+        return regex
+
+
+def main():
+    from preprocessor import InputPreprocessor
+
+    parser = argparse.ArgumentParser(description="对比逐条正则匹配与合并正则的耗时")
+    parser.add_argument("--iterations", type=int, default=2000, help="每条输入的重复次数")
+    args = parser.parse_args()
+
+    preprocessor = InputPreprocessor()
+    rules = {"injection": preprocessor.injection_patterns, "sql": preprocessor.sql_injection_patterns}
+    engine = RuleEngine(rules)
+    inputs = {
+        "普通问题": "我最近血压有点高，平时饮食需要注意什么？晚上睡眠也不太好，应该怎么调整作息？",
+        "代码注入": "请帮我运行 os.system('ls') 看看",
+        "SQL注入": "1' union select password from users",
+        "长文本": "高血压患者的日常饮食建议和运动计划。" * 20
+    }
+
+    def before(text):
+        # 原实现：每条规则都以字符串形式调用 re.search，并在每次调用时重建SQL规则列表
+        sql_patterns = list(preprocessor.sql_injection_patterns)
+        for pattern in preprocessor.injection_patterns:
+            if re.search(pattern, text, re.IGNORECASE):
+                return "injection"
+        for pattern in sql_patterns:
+            if re.search(pattern, text, re.IGNORECASE):
+                return "sql"
+        return None
+
+    def after(text):
+        hit = engine.search(text)
+        return hit[0] if hit else None
+
+    print(f"{'输入':<8}{'逐条匹配(us)':>14}{'合并正则(us)':>14}{'加速':>8}")
+    for name, text in inputs.items():
+        timings = []
+        for func in (before, after):
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                func(text)
+            timings.append((time.perf_counter() - start) / args.iterations * 1e6)
+        print(f"{name:<8}{timings[0]:>14.1f}{timings[1]:>14.1f}{timings[0] / timings[1]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# semantic_cache.py
+import itertools
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, deque, namedtuple
+from typing import Optional, List, Dict, Any
+
+from schemas import HealthOutputSchema
+
+# 一次相似检索的结果
+SemanticMatch = namedtuple("SemanticMatch", ["question", "score", "output"])
+
+# 改变问题含义的词：两个问题中出现次数不同时（如 高血压/低血压、儿童高血压/高血压、
+# 能吃/不能吃）即使字面相似度很高也不复用回复
+GUARD_TERMS = (
+    # 否定
+    "不", "没", "无", "非", "别", "勿", "未", "忌",
+    # 方向相反的程度和变化
+    "高", "低", "多", "少", "增", "减", "升", "降", "快", "慢", "大", "小",
+    "长", "短", "胖", "瘦", "热", "冷", "早", "晚", "前", "后", "急", "缓",
+    # 人群
+    "儿童", "小孩", "婴", "幼", "孕", "哺乳", "老人", "老年", "青少年", "男", "女", "糖尿病", "肾",
+)
+
+
+class SemanticCache:
+    """近似问题缓存
+
+    对经过 InputPreprocessor.preprocess 规范化后的问题做字符n-gram切分，
+    以TF-IDF加余弦相似度在本地倒排索引中检索最相近的历史问题，
+    相似度不低于阈值、且两个问题中否定词、反义词和人群词（GUARD_TERMS）一致时
+    直接复用其回复，不访问网络。字符相似度分不清只差一个字的相反问题，阈值应取得很高。
+    条目数有上限（LRU淘汰），可持久化到磁盘：加入后由后台线程延迟 save_delay 秒再落盘，
+    期间的多次加入合并为一次，退出前调用 close 写入剩余改动。每次查询的最高相似度都会记录在内存中，
+    便于根据实际流量调整阈值。指定 score_log_file 时同时追加写入该文件，
+    其中包含问题原文，只应在调整阈值期间开启。
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 2000, ngram_range: tuple = (1, 2),
+                 persist_file: str = None, score_log_size: int = 500, score_log_file: str = None,
+                 save_delay: float = 2.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ngram_range = ngram_range
+        self.persist_file = persist_file
+        self.score_log_file = score_log_file
+        self.save_delay = save_delay
+
+        self._entries = OrderedDict()   # 条目ID -> 条目
+        self._postings = {}             # n-gram -> 包含它的条目ID集合
+        self._df = Counter()            # n-gram -> 文档频率
+        self._by_question = {}          # (命名空间, 规范化问题) -> 条目ID
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._saver = None
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.score_log = deque(maxlen=score_log_size)
+
+        if persist_file:
+            self._load()
+            self._saver = threading.Thread(target=self._save_loop, name="semantic-cache-saver", daemon=True)
+            self._saver.start()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """去除空白和标点，统一小写"""
+        return re.sub(r'[\s\W_]+', '', text).lower()
+
+    def ngrams(self, text: str) -> Counter:
+        """字符n-gram切分"""
+        text = self.normalize(text)
+        low, high = self.ngram_range
+        grams = Counter()
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                grams[text[i:i + n]] += 1
+        return grams
+
+    @classmethod
+    def conflicts(cls, question: str, other: str) -> bool:
+        """两个问题的否定词、反义词或人群词不一致时返回True"""
+        a, b = cls.normalize(question), cls.normalize(other)
+        return any(a.count(term) != b.count(term) for term in GUARD_TERMS)
+
+    def search(self, namespace: str, question: str, top_k: int = 1) -> List[SemanticMatch]:
+        """返回相似度最高的 top_k 个历史问题（不论是否超过阈值）"""
+        query = self.ngrams(question)
+        if not query:
+            return []
+
+        with self._lock:
+            total = len(self._entries)
+
+            def idf(term):
+                return math.log((total + 1) / (self._df.get(term, 0) + 1)) + 1.0
+
+            query_weights = {term: tf * idf(term) for term, tf in query.items()}
+            query_norm = math.sqrt(sum(w * w for w in query_weights.values()))
+
+            candidates = set()
+            for term in query_weights:
+                candidates.update(self._postings.get(term, ()))
+
+            scored = []
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry["namespace"] != namespace:
+                    continue
+                dot = 0.0
+                doc_norm = 0.0
+                for term, tf in entry["grams"].items():
+                    weight = tf * idf(term)
+                    doc_norm += weight * weight
+                    if term in query_weights:
+                        dot += weight * query_weights[term]
+                if dot and doc_norm:
+                    score = dot / (query_norm * math.sqrt(doc_norm))
+                    scored.append((score, entry_id))
+
+            scored.sort(reverse=True)
+            return [
+                SemanticMatch(self._entries[entry_id]["question"], score, self._entries[entry_id]["output"])
+                for score, entry_id in scored[:top_k]
+            ]
+
+    def get(self, namespace: str, question: str) -> Optional[SemanticMatch]:
+        """查询近似问题，相似度不低于阈值时返回匹配结果"""
+        matches = self.search(namespace, question)
+        best = matches[0] if matches else None
+        hit = best is not None and best.score >= self.threshold and not self.conflicts(question, best.question)
+
+        with self._lock:
+            if hit:
+                self.hits += 1
+                entry_id = self._by_question.get((namespace, self.normalize(best.question)))
+                if entry_id is not None:
+                    self._entries.move_to_end(entry_id)
+            else:
+                self.misses += 1
+        self._log_score(question, best, hit)
+
+        if not hit:
+            return None
+        return SemanticMatch(best.question, best.score, HealthOutputSchema(**best.output))
+
+    def add(self, namespace: str, question: str, output: HealthOutputSchema):
+        """加入一个问题及其回复"""
+        grams = self.ngrams(question)
+        if not grams:
+            return
+        key = (namespace, self.normalize(question))
+
+        with self._lock:
+            if key in self._by_question:
+                self._remove(self._by_question[key])
+            self._insert({
+                "namespace": namespace,
+                "question": question,
+                "output": output.dict(),
+                "created_at": time.time(),
+                "grams": grams
+            })
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        if self.persist_file:
+            self._dirty.set()
+
+    def close(self, timeout: float = None):
+        """停止后台线程，并把尚未落盘的改动写入磁盘"""
+        self._stop.set()
+        self._dirty.set()
+        if self._saver is not None:
+            self._saver.join(timeout)
+            self._saver = None
+
+    def _save_loop(self):
+        """后台落盘：有改动后等待 save_delay 秒，把这段时间内的加入合并为一次保存"""
+        while True:
+            self._dirty.wait()
+            self._stop.wait(self.save_delay)
+            self._dirty.clear()
+            self.save()
+            if self._stop.is_set():
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中统计和最近查询的相似度分布"""
+        with self._lock:
+            scores = [record["score"] for record in self.score_log]
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "avg_best_score": sum(scores) / len(scores) if scores else 0.0,
+                "max_best_score": max(scores) if scores else 0.0
+            }
+
+    def _insert(self, entry: dict):
+        entry_id = next(self._ids)
+        self._entries[entry_id] = entry
+        self._by_question[(entry["namespace"], self.normalize(entry["question"]))] = entry_id
+        for term in entry["grams"]:
+            self._postings.setdefault(term, set()).add(entry_id)
+            self._df[term] += 1
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        self._by_question.pop((entry["namespace"], self.normalize(entry["question"])), None)
+        for term in entry["grams"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.discard(entry_id)
+                if not postings:
+                    del self._postings[term]
+            self._df[term] -= 1
+            if self._df[term] <= 0:
+                del self._df[term]
+
+    def _log_score(self, question: str, best: Optional[SemanticMatch], hit: bool):
+        """记录本次查询的最高相似度（指定了日志文件时才写入磁盘）"""
+        record = {
+            "time": time.time(),
+            "question": question,
+            "matched": best.question if best else None,
+            "score": round(best.score, 4) if best else 0.0,
+            "hit": hit
+        }
+        with self._lock:
+            self.score_log.append(record)
+        if self.score_log_file:
+            try:
+                with open(self.score_log_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"⚠️ 相似度日志写入失败: {str(e)}")
+
+    def save(self):
+        """原子写入磁盘（n-gram索引在加载时重建）"""
+        with self._lock:
+            data = {
+                "version": self.FORMAT_VERSION,
+                "entries": [
+                    {
+                        "namespace": entry["namespace"],
+                        "question": entry["question"],
+                        "output": entry["output"],
+                        "created_at": entry["created_at"]
+                    }
+                    for entry in self._entries.values()
+                ]
+            }
+        temp_file = f"{self.persist_file}.{os.getpid()}.tmp"
+        with self._save_lock:
+            try:
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(temp_file, self.persist_file)
+            except Exception as e:
+                print(f"⚠️ 语义缓存写入失败: {str(e)}")
+
+    def _load(self):
+        """从磁盘加载并重建索引"""
+        if not os.path.exists(self.persist_file):
+            return
+        try:
+            with open(self.persist_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"⚠️ 语义缓存加载失败: {str(e)}")
+            return
+
+        if not isinstance(data, dict) or data.get("version") != self.FORMAT_VERSION:
+            return
+        for entry in data.get("entries", [])[-self.max_entries:]:
+            try:
+                grams = self.ngrams(entry["question"])
+                if not grams:
+                    continue
+                self._insert({
+                    "namespace": entry["namespace"],
+                    "question": entry["question"],
+                    "output": entry["output"],
+                    "created_at": entry["created_at"],
+                    "grams": grams
+                })
+            except (KeyError, TypeError):
+                continue
@@ -0,0 +1,96 @@
+# session_pool.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Any
+
+
+class SessionPool:
+    """按 (user_id, 代理序号) 隔离的 AgentService 会话池
+
+    每个用户与每个代理拥有独立的 ChatAgent，对话记忆不会在用户之间串用。
+    会话数超过 max_sessions 时淘汰最久未使用的会话，闲置超过 idle_timeout 秒的会话
+    也会被回收；用户再次访问时由 factory 新建会话，并通过 rehydrate 从历史记录恢复。
+    """
+
+    def __init__(self, factory: Callable[[int], Any], rehydrate: Callable[[Any, int, str], None] = None,
+                 max_sessions: int = 64, idle_timeout: float = 30 * 60):
+        """
+        factory: factory(代理序号) -> AgentService
+        rehydrate: rehydrate(service, 代理序号, user_id)，新建会话后调用
+        """
+        self.factory = factory
+        self.rehydrate = rehydrate
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+
+        self._sessions = OrderedDict()  # (user_id, 代理序号) -> [service, 最近使用时间]
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def get(self, user_id: str, agent_index: int):
+        """获取会话，不存在或已被回收时新建并恢复"""
+        key = (user_id, agent_index)
+        now = time.monotonic()
+        with self._lock:
+            self._expire_idle(now)
+            session = self._sessions.get(key)
+            if session is not None:
+                session[1] = now
+                self._sessions.move_to_end(key)
+                return session[0]
+
+        # 新建会话在锁外进行，避免加载历史时阻塞其他用户
+        service = self.factory(agent_index)
+        if self.rehydrate is not None:
+            self.rehydrate(service, agent_index, user_id)
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                # 其他线程已抢先创建
+                session[1] = now
+                self._sessions.move_to_end(key)
+                return session[0]
+            self._sessions[key] = [service, now]
+            self.created += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        return service
+
+    def discard(self, user_id: str, agent_index: int = None):
+        """丢弃用户的会话（如清除历史后），agent_index为None时丢弃该用户所有代理的会话"""
+        with self._lock:
+            for key in list(self._sessions):
+                if key[0] == user_id and (agent_index is None or key[1] == agent_index):
+                    del self._sessions[key]
+
+    def evict_idle(self):
+        """回收所有闲置超时的会话"""
+        with self._lock:
+            self._expire_idle(time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "created": self.created,
+                "evicted": self.evicted,
+                "expired": self.expired
+            }
+
+    def _expire_idle(self, now: float):
+        if self.idle_timeout is None:
+            return
+        # OrderedDict 按最近使用排序，最旧的在前
+        while self._sessions:
+            key, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.idle_timeout:
+                break
+            del self._sessions[key]
+            self.expired += 1
@@ -0,0 +1,169 @@
+# stream_parser.py
+"""从流式返回的JSON片段中增量提取 "content" 字段"""
+
+
+class ContentStreamParser:
+    """增量解析器
+
+    模型按 {"content": "...", "sources": [...], ...} 的格式逐段返回，
+    feed() 每收到一段就返回 content 字段中新解码出的文本，
+    不需要等到右花括号出现。若模型没有输出JSON，则原样透传。
+    """
+
+    _ESCAPES = {
+        '"': '"', '\\': '\\', '/': '/',
+        'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'
+    }
+    _HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+    # 解析状态
+    _START = "start"            # 等待第一个非空字符
+    _FENCE = "fence"            # 跳过 ```json 代码块前缀
+    _SEEK = "seek"              # 在JSON对象中寻找 content 键
+    _COLON = "colon"            # 已读到 content 键，等待冒号
+    _VALUE = "value"            # 已读到冒号，等待字符串开头
+    _CONTENT = "content"        # 正在输出 content 字符串
+    _DONE = "done"              # content 已结束，忽略剩余部分
+    _RAW = "raw"                # 非JSON输出，原样透传
+
+    def __init__(self, key: str = "content"):
+        self.key = key
+        self.state = self._START
+        self.emitted = False
+        # _SEEK 状态下的JSON扫描信息
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._token = []
+        self._last_string = None
+        # _CONTENT 状态下未完成的转义序列
+        self._pending = ""
+        self._high_surrogate = None
+
+    def feed(self, chunk: str) -> str:
+        """输入一段原始文本，返回新解析出的 content 文本"""
+        out = []
+        for ch in chunk:
+            if self.state == self._CONTENT:
+                self._feed_content(ch, out)
+            elif self.state == self._RAW:
+                out.append(ch)
+            elif self.state == self._DONE:
+                break
+            elif self.state == self._START:
+                if ch.isspace():
+                    continue
+                if ch == '{':
+                    self.state = self._SEEK
+                    self._depth = 1
+                elif ch == '`':
+                    self.state = self._FENCE
+                else:
+                    self.state = self._RAW
+                    out.append(ch)
+            elif self.state == self._FENCE:
+                if ch == '{':
+                    self.state = self._SEEK
+                    self._depth = 1
+            else:
+                self._feed_structure(ch)
+
+        text = "".join(out)
+        if text:
+            self.emitted = True
+        return text
+
+    def _feed_structure(self, ch: str):
+        """扫描JSON结构，定位顶层的 content 字符串"""
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+                self._token.append(ch)
+            elif ch == '\\':
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                self._last_string = "".join(self._token)
+                self._token = []
+                if self.state == self._SEEK and self._depth == 1 and self._last_string == self.key:
+                    self.state = self._COLON
+            else:
+                self._token.append(ch)
+            return
+
+        if ch.isspace():
+            return
+
+        if self.state == self._COLON:
+            self.state = self._VALUE if ch == ':' else self._SEEK
+            if ch != ':':
+                self._feed_structure(ch)
+            return
+
+        if self.state == self._VALUE:
+            if ch == '"':
+                self.state = self._CONTENT
+                return
+            # content 不是字符串，放弃解析
+            self.state = self._SEEK
+
+        if ch == '"':
+            self._in_string = True
+        elif ch in '{[':
+            self._depth += 1
+        elif ch in '}]':
+            self._depth -= 1
+            if self._depth <= 0:
+                self.state = self._DONE
+
+    def _feed_content(self, ch: str, out: list):
+        """解码 content 字符串，处理跨片段的转义序列"""
+        if self._pending:
+            if self._pending == '\\' and ch != 'u':
+                self._flush_surrogate(out)
+                out.append(self._ESCAPES.get(ch, ch))
+                self._pending = ""
+                return
+            if len(self._pending) >= 2 and ch not in self._HEX_DIGITS:
+                # 不合法的 \\u 转义：原样输出已读到的部分，当前字符按正常内容处理
+                self._flush_surrogate(out)
+                out.append(self._pending)
+                self._pending = ""
+                self._feed_content(ch, out)
+                return
+            self._pending += ch
+            if len(self._pending) == 6:
+                self._emit_unicode(int(self._pending[2:6], 16), out)
+                self._pending = ""
+            return
+
+        if ch == '\\':
+            self._pending = ch
+        elif ch == '"':
+            self._flush_surrogate(out)
+            self.state = self._DONE
+        else:
+            self._flush_surrogate(out)
+            out.append(ch)
+
+    def _flush_surrogate(self, out: list):
+        """没有配对的高位代理无法输出，用替换字符代替"""
+        if self._high_surrogate is not None:
+            self._high_surrogate = None
+            out.append('\ufffd')
+
+    def _emit_unicode(self, code: int, out: list):
+        """处理 \\uXXXX，包括UTF-16代理对；不成对的代理项输出为替换字符"""
+        if 0xD800 <= code <= 0xDBFF:
+            self._flush_surrogate(out)
+            self._high_surrogate = code
+            return
+        if 0xDC00 <= code <= 0xDFFF:
+            if self._high_surrogate is None:
+                out.append('\ufffd')
+                return
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+        else:
+            self._flush_surrogate(out)
+        out.append(chr(code))
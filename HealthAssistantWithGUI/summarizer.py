@@ -0,0 +1,90 @@
+# summarizer.py
+import queue
+import threading
+from datetime import datetime
+from typing import Dict, Any
+
+from context_assembler import ContextAssembler
+
+
+class HistoryCompactor:
+    """后台滚动摘要
+
+    每轮对话结束后调度一次：把最近 keep_recent 条之前、尚未被摘要覆盖的消息
+    分批交给模型压缩进该用户的滚动摘要，摘要与消息一起保存在 HistoryManager 中。
+    组装上下文时用摘要代替这些旧消息，从而在保留长期信息的同时限制提示词长度。
+    """
+
+    def __init__(self, keep_recent: int = 6, min_new_messages: int = 10, batch_size: int = 40):
+        self.keep_recent = keep_recent
+        self.min_new_messages = min_new_messages
+        self.batch_size = batch_size
+
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="history-compactor", daemon=True)
+        self._thread.start()
+
+    def schedule(self, service, manager, user_id: str):
+        """调度一次摘要任务（同一用户的同一历史已在排队时忽略）"""
+        key = (id(manager), user_id)
+        with self._pending_lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._queue.put((key, service, manager, user_id))
+
+    def close(self, timeout: float = None):
+        """处理完已排队的任务后停止后台线程"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            key, service, manager, user_id = task
+            with self._pending_lock:
+                self._pending.discard(key)
+            try:
+                self.compact(service, manager, user_id)
+            except Exception as e:
+                print(f"⚠️ 对话摘要失败: {str(e)}")
+
+    def compact(self, service, manager, user_id: str) -> Dict[str, Any]:
+        """把较早的消息合并进滚动摘要，返回最新摘要"""
+        summary = manager.load_summary(user_id) or {}
+        covered_until = summary.get("covered_until", "")
+
+        # 从最新的消息向前逐步扩大读取窗口，读到已被摘要覆盖的位置为止，不加载完整历史。
+        # 每次都从最新处读取而不是以时间戳翻页，时间戳相同的消息不会在页边界被跳过
+        limit = self.batch_size
+        while True:
+            history = list(manager.iter_history(user_id, limit=limit))
+            if len(history) < limit or history[0].get("timestamp", "") <= covered_until:
+                break
+            limit *= 2
+
+        older = history[:-self.keep_recent] if len(history) > self.keep_recent else []
+        pending = [m for m in older if m.get("timestamp", "") > covered_until]
+        if len(pending) < self.min_new_messages:
+            return summary
+
+        text = summary.get("text", "")
+        covered_count = summary.get("covered_count", 0)
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            transcript = "\n".join(ContextAssembler.format_message(m) for m in batch)
+            text = service.summarize(text, transcript)
+            covered_count += len(batch)
+            summary = {
+                "text": text,
+                "covered_until": batch[-1].get("timestamp", ""),
+                "covered_count": covered_count,
+                "updated_at": datetime.now().isoformat()
+            }
+            # 每批完成即保存，中途失败时已完成的部分不必重做
+            manager.save_summary(user_id, summary)
+        return summary
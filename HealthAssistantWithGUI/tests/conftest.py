@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# 各模块按平铺方式互相导入（from history_store import ...），测试时把应用目录加入搜索路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
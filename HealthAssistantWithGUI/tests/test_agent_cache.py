@@ -0,0 +1,113 @@
+# tests/test_agent_cache.py
+"""AgentService 的缓存键与语义缓存的使用条件（不访问模型）"""
+import pytest
+
+agent = pytest.importorskip("agent")
+from semantic_cache import SemanticCache
+from schemas import HealthOutputSchema
+
+
+class FakeAgent:
+    def update_memory(self, message, role):
+        pass
+
+    def record_message(self, message):
+        pass
+
+    def reset(self):
+        pass
+
+
+def make_service(use_memory=True):
+    service = agent.AgentService.__new__(agent.AgentService)
+    service.system_prompt = "提示词"
+    service.use_memory = use_memory
+    service.cache = None
+    service.semantic_cache = SemanticCache(threshold=0.8)
+    service.cache_namespace = "ns"
+    service.memory_digest = ""
+    service.agent = FakeAgent()
+    return service
+
+
+def reply(content):
+    return HealthOutputSchema(content=content, sources=[], advice_type="general", needs_follow_up=False).to_json()
+
+
+def test_semantic_cache_used_without_context():
+    service = make_service()
+    service._finish("好的", reply("第一次回复"), question="好的", context="")
+    assert service._lookup_cache("好的", "好的", "").content == "第一次回复"
+
+
+def test_follow_up_with_memory_skips_semantic_cache():
+    first = make_service()
+    first._finish("好的", reply("别人的回复"), question="好的", context="")
+
+    other = make_service()
+    other.semantic_cache = first.semantic_cache
+    other._remember_user("我血压高")
+    other._record_reply(reply("建议低盐饮食"))
+    context = other._cache_context()
+    assert context
+    assert other._lookup_cache("好的", "好的", context) is None
+
+    other._finish("好的", reply("继续低盐饮食"), question="好的", context=context)
+    assert len(first.semantic_cache._entries) == 1
+
+
+def test_assembled_history_skips_semantic_cache():
+    service = make_service(use_memory=False)
+    service._finish("好的", reply("无上下文的回复"), question="好的", context="")
+    assembled = "对话上下文:\n用户: 我血压高\n\n请回复: 好的"
+    assert service._cache_context() == ""
+    assert service._lookup_cache(assembled, "好的", "") is None
+
+
+def test_memory_digest_tracks_conversation():
+    a, b = make_service(), make_service()
+    a._remember_user("我血压高")
+    b._remember_user("我血糖高")
+    assert a.memory_digest != b.memory_digest
+    a._forget_if_stateless()
+    assert a.memory_digest
+    stateless = make_service(use_memory=False)
+    stateless._remember_user("我血压高")
+    stateless._forget_if_stateless()
+    assert stateless.memory_digest == ""
+
+
+class FakeModel:
+    """按 camel 的 OpenAI 兼容模型构造内部客户端：额外参数同时传给同步和异步客户端"""
+
+    def __init__(self, model_type, model_config_dict, api_key=None, url=None, **kwargs):
+        http_client = kwargs.get("http_client")
+        if http_client is not None and not isinstance(http_client, agent.http_pool.httpx.AsyncClient):
+            # AsyncOpenAI 只接受 httpx.AsyncClient
+            raise TypeError("Invalid `http_client` argument; Expected an instance of `httpx.AsyncClient`")
+        self.model_type = model_type
+        self.model_config_dict = model_config_dict
+        self._client = object()
+        self._async_client = object()
+
+
+class FakeModelFactory:
+    @staticmethod
+    def create(model_platform, model_type, model_config_dict, url=None, api_key=None, **kwargs):
+        return FakeModel(model_type, model_config_dict, api_key=api_key, url=url, **kwargs)
+
+
+class FakeChatAgent(FakeAgent):
+    def __init__(self, model, **kwargs):
+        self.model = model
+
+
+def test_constructor_shares_sync_client(monkeypatch):
+    shared = object()
+    monkeypatch.setattr(agent, "ModelFactory", FakeModelFactory)
+    monkeypatch.setattr(agent, "ChatAgent", FakeChatAgent)
+    monkeypatch.setattr(agent.http_pool, "get_openai_client", lambda api_key: shared)
+    service = agent.AgentService({"temperature": 0.5}, "提示词")
+    assert service.client is shared
+    assert service.model._client is shared
+    assert service.agent.model is service.model
@@ -0,0 +1,190 @@
+# tests/test_agent_history.py
+import sqlite3
+
+import pytest
+
+history_manager = pytest.importorskip("history_manager")
+from history_store import BACKEND_JOURNAL, BACKEND_SEGMENT, BACKEND_SQLITE, SQLiteStore, create_store
+
+HistoryManager, AgentHistory = history_manager.HistoryManager, history_manager.AgentHistory
+
+
+def message(i, role="user", agent=None, timestamp=None):
+    m = {"role": role, "content": f"消息{i}", "timestamp": timestamp or f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}"}
+    if agent:
+        m["agent"] = agent
+    return m
+
+
+def timeline(turns, timestamp=None, agents=("gentle", "creative")):
+    """每轮一条用户消息加各代理的回复"""
+    messages = []
+    for turn in range(turns):
+        i = turn * (len(agents) + 1)
+        messages.append(message(i, timestamp=timestamp))
+        for offset, agent in enumerate(agents, 1):
+            messages.append(message(i + offset, "assistant", agent, timestamp))
+    return messages
+
+
+@pytest.fixture(params=[BACKEND_JOURNAL, BACKEND_SEGMENT, BACKEND_SQLITE])
+def manager(request, tmp_path):
+    store = create_store(request.param, str(tmp_path / "chat_history.json"), str(tmp_path / "history.db"))
+    manager = HistoryManager(store=store, flush_every=1)
+    yield manager
+    manager.close()
+
+
+def seed(manager, messages):
+    # 绕过写回缓存直接写入后端，读取时走存储后端的筛选
+    manager.store.append("u1", 0, messages)
+
+
+def test_agent_window_contains_user_messages_and_own_replies(manager):
+    messages = timeline(30)
+    seed(manager, messages)
+    gentle = AgentHistory(manager, "gentle")
+    expected = [m for m in messages if m.get("agent") in (None, "gentle")]
+    recent = gentle.load_recent("u1", 7)
+    assert [m["content"] for m in recent] == [m["content"] for m in expected[-7:]]
+    assert all(m.get("agent") in (None, "gentle") for m in recent)
+
+    before = expected[-10]["timestamp"]
+    page = list(gentle.iter_history("u1", before=before, limit=5))
+    assert [m["content"] for m in page] == [m["content"] for m in expected[-15:-10]]
+
+
+def test_equal_timestamps_are_not_skipped(manager):
+    # 本代理可见的消息比例较低，需要跨过多页旧消息才能凑够窗口
+    messages = timeline(20, timestamp="2024-01-01T00:00:00", agents=("gentle", "a", "b", "c"))
+    seed(manager, messages)
+    gentle = AgentHistory(manager, "gentle")
+    expected = [m for m in messages if m.get("agent") in (None, "gentle")]
+    recent = gentle.load_recent("u1", 10)
+    assert [m["content"] for m in recent] == [m["content"] for m in expected[-10:]]
+
+
+def test_sqlite_agent_column(tmp_path):
+    db_file = str(tmp_path / "history.db")
+    store = SQLiteStore(db_file, "chat_history")
+    try:
+        store.append("u1", 0, timeline(2))
+        rows = sqlite3.connect(db_file).execute(
+            "SELECT history, agent, extra FROM messages ORDER BY id").fetchall()
+        assert rows == [("chat_history", "", None), ("chat_history", "gentle", None), ("chat_history", "creative", None)] * 2
+        assert store.load("u1") == timeline(2)
+    finally:
+        store.close()
+
+
+def test_sqlite_histories_share_database(tmp_path):
+    db_file = str(tmp_path / "history.db")
+    store = SQLiteStore(db_file, "chat_history")
+    legacy = SQLiteStore(db_file, "chat_history_1")
+    try:
+        store.append("u1", 0, [
+            {"role": "user", "content": "你好", "timestamp": "2024-01-01T00:00:00"},
+            {"role": "assistant", "content": "您好", "timestamp": "2024-01-01T00:00:01",
+             "agent": "gentle", "sources": ["指南"]}
+        ])
+        store.save_summary("u1", {"text": "摘要"})
+        legacy.append("u1", 0, [{"role": "user", "content": "旧版", "timestamp": "2024-01-01T00:00:00"}])
+
+        assert [m["content"] for m in store.load("u1")] == ["你好", "您好"]
+        assert store.load("u1")[1]["sources"] == ["指南"]
+        assert store.load_summary("u1") == {"text": "摘要"}
+        assert store.load_before("u1", None, 10, agent="creative") == store.load("u1")[:1]
+        assert [m["content"] for m in legacy.load("u1")] == ["旧版"]
+        assert legacy.load_summary("u1") is None
+        legacy.clear("u1")
+        assert len(store.load("u1")) == 2
+    finally:
+        store.close()
+        legacy.close()
+
+
+def test_bulk_import_validates_and_dedupes(manager):
+    from camel.types import RoleType
+
+    seed(manager, [message(0), message(2, "assistant", "gentle")])
+    records = [
+        message(0),                                                 # 已有
+        dict(message(0), content="消息0 "),                          # 内容不同，不算重复
+        {"role": RoleType.USER, "content": "消息1", "timestamp": message(1)["timestamp"]},
+        message(1),                                                 # 与本批前一条重复
+        message(3, "assistant"),                                    # 未注明代理，归属默认代理
+        message(4, "assistant", "creative"),
+        dict(message(5), agent="gentle"),                           # 用户消息不属于任何代理
+        "不是字典",
+        {"role": "doctor", "content": "角色无效", "timestamp": message(6)["timestamp"]},
+        {"role": "user", "content": "  ", "timestamp": message(7)["timestamp"]},
+        {"role": "user", "content": "时间无效", "timestamp": "昨天"},
+        {"role": "user", "content": "缺少时间"},
+    ]
+    result = manager.bulk_import("u1", records, agent="gentle")
+    assert result == {"imported": 5, "duplicates": 2, "invalid": 5, "archived": 0}
+
+    stored = manager.load("u1")
+    assert [m["timestamp"] for m in stored] == sorted(m["timestamp"] for m in stored)
+    by_content = {m["content"]: m for m in stored}
+    assert set(by_content) == {"消息0", "消息0 ", "消息1", "消息2", "消息3", "消息4", "消息5"}
+    assert by_content["消息3"]["agent"] == "gentle"
+    assert by_content["消息4"]["agent"] == "creative"
+    assert "agent" not in by_content["消息5"]
+
+    # 再次导入同一批全部视为重复
+    again = manager.bulk_import("u1", records, agent="gentle")
+    assert again == {"imported": 0, "duplicates": 7, "invalid": 5, "archived": 0}
+    assert len(manager.load("u1")) == 7
+
+
+def test_bulk_import_after_archive_old(manager, tmp_path):
+    from datetime import datetime
+
+    from history_archive import HistoryArchive
+
+    manager.archive = HistoryArchive(str(tmp_path / "archive.bin"), chunk_size=4)
+    manager.archive_age = 3600
+    messages = [message(i) for i in range(10)]
+    seed(manager, messages)
+    # 前6条早于截止时间，移入归档
+    assert manager.archive_old("u1", now=datetime(2024, 1, 1, 1, 0, 6)) == 6
+
+    records = [
+        messages[2],                                                # 已在归档中
+        messages[8],                                                # 已在热存储中
+        message(100, timestamp="2024-01-01T00:00:03"),              # 早于最新归档消息
+        message(101, timestamp="2024-01-01T00:00:05"),              # 与最新归档消息同一时刻
+        message(102, timestamp="2024-01-01T00:00:07"),              # 落在热存储范围内
+        message(103, timestamp="2024-01-01T00:01:00"),
+    ]
+    result = manager.bulk_import("u1", records)
+    assert result == {"imported": 4, "duplicates": 2, "invalid": 0, "archived": 1}
+
+    stored = list(manager.stream("u1"))
+    timestamps = [m["timestamp"] for m in stored]
+    assert timestamps == sorted(timestamps)
+    contents = [m["content"] for m in stored]
+    assert len(contents) == len(set(contents)) == 14
+    assert "消息100" in contents
+    # 早于最新归档消息的记录合并进归档
+    assert manager.archive.count("u1") == 7
+    assert [m["content"] for m in manager.archive.iter_messages("u1")][:5] == ["消息0", "消息1", "消息2", "消息3", "消息100"]
+
+
+def test_bulk_import_fails_when_archive_write_fails(manager, tmp_path):
+    from datetime import datetime
+
+    from history_archive import HistoryArchive
+
+    manager.archive = HistoryArchive(str(tmp_path / "archive.bin"), chunk_size=4)
+    manager.archive_age = 3600
+    seed(manager, [message(i) for i in range(10)])
+    manager.archive_old("u1", now=datetime(2024, 1, 1, 1, 0, 6))
+    manager.archive.replace = lambda user_id, messages: False
+
+    records = [message(100, timestamp="2024-01-01T00:00:03"), message(101, timestamp="2024-01-01T00:01:00")]
+    result = manager.bulk_import("u1", records)
+    assert result["imported"] == 0
+    contents = [m["content"] for m in manager.stream("u1")]
+    assert "消息100" not in contents and "消息101" not in contents
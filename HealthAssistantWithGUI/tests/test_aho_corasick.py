@@ -0,0 +1,110 @@
+# tests/test_aho_corasick.py
+import json
+import random
+from collections import OrderedDict
+
+import pytest
+
+from aho_corasick import AhoCorasick
+
+WORDS = ["he", "she", "his", "hers", "e", "头", "头疼", "疼痛", "痛"]
+
+
+def naive_matches(words, text):
+    return sorted((start, start + len(word), index)
+                  for index, word in enumerate(words)
+                  for start in range(len(text)) if text.startswith(word, start))
+
+
+def naive_replace(patterns, text):
+    """逐个位置取最长、其次优先级最高的词条"""
+    words = list(patterns)
+    out, position = [], 0
+    while position < len(text):
+        candidates = [(-len(w), i) for i, w in enumerate(words) if w and text.startswith(w, position)]
+        if candidates:
+            word = words[min(candidates)[1]]
+            out.append(patterns[word])
+            position += len(word)
+        else:
+            out.append(text[position])
+            position += 1
+    return "".join(out)
+
+
+def random_texts(alphabet, count=200, seed=7):
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        for _ in range(count)
+    ]
+
+
+def test_iter_matches_finds_every_occurrence():
+    automaton = AhoCorasick({w: w.upper() for w in WORDS})
+    for text in random_texts("hersi头疼痛 ") + ["ushers", "头疼痛"]:
+        matches = list(automaton.iter_matches(text))
+        assert sorted(matches) == naive_matches(WORDS, text)
+        # 按结束位置顺序产出
+        assert [m[1] for m in matches] == sorted(m[1] for m in matches)
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("ushers", "uSHErs"),        # she 与 hers 重叠，取最左
+    ("头疼痛", "<头疼>痛"),        # 头 与 头疼 同起点，取最长；疼痛 与 头疼 重叠被跳过
+    ("没有命中", "没有命中"),
+    ("", ""),
+])
+def test_replace_examples(text, expected):
+    patterns = {w: w.upper() for w in WORDS}
+    patterns["头疼"] = "<头疼>"
+    assert AhoCorasick(patterns).replace(text) == expected
+
+
+def test_replace_matches_reference():
+    patterns = {w: f"[{i}]" for i, w in enumerate(WORDS)}
+    automaton = AhoCorasick(patterns)
+    for text in random_texts("hersi头疼痛 ", seed=11):
+        assert automaton.replace(text) == naive_replace(patterns, text)
+
+
+def test_empty_word_is_ignored():
+    automaton = AhoCorasick({"": "x", "a": "b"})
+    assert len(automaton) == 1
+    assert automaton.replace("aa") == "bb"
+
+
+def test_tables_round_trip_through_json():
+    patterns = {w: i for i, w in enumerate(WORDS)}
+    automaton = AhoCorasick(patterns)
+    loaded = AhoCorasick(patterns, json.loads(json.dumps(automaton.tables(), ensure_ascii=False)))
+    for text in random_texts("hersi头疼痛 ", count=50):
+        assert list(loaded.iter_matches(text)) == list(automaton.iter_matches(text))
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda t: t.update(words=t["words"][:-1]),
+    lambda t: t.update(fail=t["fail"][:-1]),
+    lambda t: t.update(children=[len(t["chars"])] + t["children"][1:]),
+    lambda t: t.update(output=t["output"] + [[0, 99]]),
+])
+def test_inconsistent_tables_are_rejected(corrupt):
+    patterns = {w: i for i, w in enumerate(WORDS)}
+    tables = AhoCorasick(patterns).tables()
+    corrupt(tables)
+    with pytest.raises(ValueError):
+        AhoCorasick(patterns, tables)
+
+
+def test_shared_cache_reuses_and_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(AhoCorasick, "_shared", OrderedDict())
+    monkeypatch.setattr(AhoCorasick, "SHARED_MAX", 2)
+    a = AhoCorasick.shared({"a": 1})
+    assert AhoCorasick.shared({"a": 1}) is a
+    # 值不同的词表是不同的自动机
+    assert AhoCorasick.shared({"a": 2}) is not a
+    AhoCorasick.shared({"a": 1})          # a 变为最近使用
+    AhoCorasick.shared({"b": 1})          # 淘汰 {"a": 2}
+    assert len(AhoCorasick._shared) == 2
+    assert AhoCorasick.shared({"a": 1}) is a
+    assert tuple({"a": 2}.items()) not in AhoCorasick._shared
@@ -0,0 +1,55 @@
+# tests/test_cli_import.py
+import builtins
+import json
+
+import pytest
+
+cli_interface = pytest.importorskip("cli_interface")
+from context_assembler import ContextAssembler
+from history_manager import AgentHistory, HistoryManager
+from history_store import BACKEND_JOURNAL, create_store
+
+
+@pytest.fixture
+def cli(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    history = HistoryManager(store=create_store(BACKEND_JOURNAL, str(tmp_path / "chat_history.json")), flush_every=1)
+    history.store.append("u1", 0, [
+        {"role": "user", "content": "头疼", "timestamp": "2024-01-01T08:00:00"},
+        {"role": "assistant", "content": "多休息", "timestamp": "2024-01-01T08:00:01", "agent": "gentle"},
+    ])
+    agents = [{"id": "gentle", "name": "温和医生", "service": None,
+               "context": ContextAssembler(), "history": AgentHistory(history, "gentle")}]
+    cli = cli_interface.CLIInterface(agents, history, "u1")
+    yield cli
+    cli.fanout.shutdown()
+    history.close()
+
+
+def test_import_command_bulk_imports_file(cli, tmp_path, monkeypatch, capsys):
+    export = tmp_path / "导出 记录.jsonl"
+    rows = [
+        {"timestamp": "2024-01-01T08:00:00", "role": "user", "agent": "", "content": "头疼"},       # 重复
+        {"timestamp": "2024-01-01T07:00:00", "role": "user", "agent": "", "content": "失眠"},
+        {"timestamp": "2024-01-01T07:00:01", "role": "assistant", "agent": "温和医生", "content": "早点睡"},
+        {"timestamp": "不是时间", "role": "user", "agent": "", "content": "无效"},
+    ]
+    export.write_text("\n".join(json.dumps(r, ensure_ascii=False) for r in rows) + "\n", encoding="utf-8")
+
+    inputs = iter([f"/import {export}", "/exit"])
+    monkeypatch.setattr(builtins, "input", lambda prompt="": next(inputs))
+    cli.run()
+
+    out = capsys.readouterr().out
+    assert "✅ 导入2条，重复1条，无效1条，其中写入归档0条" in out
+    stored = cli.history.load("u1")
+    assert [m["content"] for m in stored] == ["失眠", "早点睡", "头疼", "多休息"]
+    assert stored[1]["agent"] == "gentle"
+
+
+def test_import_command_reports_unreadable_file(cli, tmp_path, capsys):
+    cli.import_history(str(tmp_path / "不存在.json"))
+    assert "⚠️ 读取失败" in capsys.readouterr().out
+    cli.import_history("")
+    assert "用法: /import 文件名" in capsys.readouterr().out
+    assert len(cli.history.load("u1")) == 2
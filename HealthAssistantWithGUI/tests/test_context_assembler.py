@@ -0,0 +1,76 @@
+# tests/test_context_assembler.py
+import pytest
+
+context_assembler = pytest.importorskip("context_assembler")
+from camel.types import RoleType
+
+ContextAssembler = context_assembler.ContextAssembler
+
+
+def turns(count, text="内容"):
+    messages = []
+    for i in range(count):
+        messages.append({"role": RoleType.USER, "content": f"问题{i}{text}",
+                         "timestamp": f"2024-01-01T00:00:{2 * i:02d}"})
+        messages.append({"role": RoleType.ASSISTANT, "content": f"回答{i}{text}",
+                         "timestamp": f"2024-01-01T00:00:{2 * i + 1:02d}"})
+    return messages
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("", 0),
+    ("高血压", 3),
+    ("abcd", 1),
+    ("abcde", 2),
+    ("血压 is high", 2 + 2),          # 空白不计，6个非中日韩字符约2个
+    ("你好，世界！", 6),               # 全角标点按中日韩字符计
+])
+def test_count_tokens(text, expected):
+    assert ContextAssembler.count_tokens(text) == expected
+
+
+def test_keeps_newest_messages_within_budget():
+    history = turns(30, "很长的一段对话内容" * 3)
+    assembler = ContextAssembler(token_budget=200)
+    prompt = assembler.build(history, "今天怎么样")
+
+    assert prompt.endswith("请回复: 今天怎么样")
+    assert assembler.last_prompt_tokens <= 200
+    # 逐行估算的进位只会高估，整段提示词不会超出预算
+    assert assembler.last_prompt_tokens >= ContextAssembler.count_tokens(prompt)
+    # 最新一轮保留，最旧的对话被丢弃，保留的消息按时间顺序排列
+    assert "回答29" in prompt and "问题0" not in prompt
+    lines = prompt.split("\n")
+    kept = [line for line in lines if line.startswith(("用户: ", "助手: "))]
+    assert kept == [ContextAssembler.format_message(m) for m in history[-len(kept):]]
+
+
+def test_summary_replaces_covered_turns():
+    history = turns(5)
+    summary = {"text": "用户有高血压", "covered_until": history[5]["timestamp"]}
+    prompt = ContextAssembler(token_budget=1000).build(history, "怎么办", summary)
+
+    assert prompt.startswith("既往对话摘要:\n用户有高血压\n\n对话上下文:\n")
+    assert "问题2内容" not in prompt and "回答2内容" not in prompt
+    assert "问题3内容" in prompt and "回答4内容" in prompt
+
+
+def test_summary_only_when_all_turns_covered():
+    history = turns(2)
+    summary = {"text": "摘要", "covered_until": history[-1]["timestamp"]}
+    prompt = ContextAssembler().build(history, "继续", summary)
+    assert prompt == "既往对话摘要:\n摘要\n\n对话上下文:\n\n\n请回复: 继续"
+
+
+def test_plain_input_without_history_or_in_memory_mode():
+    assert ContextAssembler().build([], "你好") == "你好"
+    assembler = ContextAssembler(mode=ContextAssembler.MODE_MEMORY)
+    assert assembler.build(turns(3), "你好") == "你好"
+    assert assembler.last_prompt_tokens == 2
+    # 预算连一条历史都放不下时只发送本轮消息
+    assert ContextAssembler(token_budget=5).build(turns(3), "你好") == "你好"
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        ContextAssembler(mode="other")
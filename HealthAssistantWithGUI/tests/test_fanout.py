@@ -0,0 +1,116 @@
+# tests/test_fanout.py
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from fanout import AgentFanout
+from schemas import HealthOutputSchema
+
+
+def make_output(content):
+    return HealthOutputSchema(content=content, sources=[], advice_type="general", needs_follow_up=False)
+
+
+class FakeService:
+    """按给定的片段依次产出，片段为异常时抛出"""
+
+    def __init__(self, pieces, delay=0.0):
+        self.pieces = pieces
+        self.delay = delay
+        self.calls = []
+
+    def chat_stream(self, message, **kwargs):
+        self.calls.append((message, kwargs))
+        for piece in self.pieces:
+            if self.delay:
+                time.sleep(self.delay)
+            if isinstance(piece, Exception):
+                raise piece
+            yield piece
+
+
+@pytest.fixture
+def fanout():
+    fanout = AgentFanout(max_concurrency=4)
+    yield fanout
+    fanout.shutdown()
+
+
+def test_events_per_agent_are_ordered(fanout):
+    jobs = [
+        (0, FakeService(["你", "好", make_output("你好")], delay=0.01), "问题"),
+        (1, FakeService(["半", RuntimeError("网络错误")]), "问题"),
+        (2, FakeService(["没有结束"]), "问题"),
+    ]
+    events = list(fanout.stream(jobs, question="原问题"))
+
+    by_agent = {}
+    for kind, index, data in events:
+        by_agent.setdefault(index, []).append((kind, data))
+    assert [kind for kind, _ in by_agent[0]] == ["delta", "delta", "done"]
+    assert "".join(data for kind, data in by_agent[0] if kind == "delta") == "你好"
+    assert by_agent[0][-1][1].content == "你好"
+    assert by_agent[1][0] == ("delta", "半")
+    assert by_agent[1][-1][0] == "error" and str(by_agent[1][-1][1]) == "网络错误"
+    # 流结束却没有完整回复也报告为错误
+    assert [kind for kind, _ in by_agent[2]] == ["delta", "error"]
+    # 每个代理恰好一个结束事件，且是该代理的最后一个事件
+    assert sum(kind != "delta" for kind, _, _ in events) == 3
+    assert jobs[0][1].calls == [("问题", {"question": "原问题"})]
+
+
+def test_cancel_stops_streaming_workers(fanout):
+    release = threading.Event()
+    stopped = threading.Event()
+    produced = []
+
+    class SlowService:
+        def chat_stream(self, message, **kwargs):
+            try:
+                for i in range(100):
+                    if i:
+                        release.wait(1)
+                    produced.append(i)
+                    yield str(i)
+                yield make_output("完成")
+            finally:
+                stopped.set()
+
+    stream = fanout.stream([(0, SlowService(), "问题")])
+    assert next(stream) == ("delta", 0, "0")
+    # 调用方提前退出，工作线程在下一片段处停止
+    stream.close()
+    release.set()
+    assert stopped.wait(2)
+    assert len(produced) == 2
+
+
+def test_max_concurrency_limits_parallel_requests():
+    fanout = AgentFanout(max_concurrency=2)
+    lock = threading.Lock()
+    running = [0, 0]  # 当前并发数, 最大并发数
+
+    class CountingService:
+        def chat_stream(self, message, **kwargs):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            yield make_output(message)
+
+    try:
+        events = list(fanout.stream([(i, CountingService(), f"问题{i}") for i in range(6)]))
+    finally:
+        fanout.shutdown()
+    assert sorted(index for kind, index, _ in events if kind == "done") == list(range(6))
+    assert running[1] == 2
+
+
+def test_invalid_max_concurrency():
+    with pytest.raises(ValueError):
+        AgentFanout(max_concurrency=0)
@@ -0,0 +1,93 @@
+# tests/test_gui_processing.py
+"""get_all_agents_response 出错时也要结束“思考中”状态（不创建真实窗口）"""
+from types import SimpleNamespace
+
+import pytest
+
+gui_tkinter = pytest.importorskip("gui_tkinter")
+from fanout import AgentFanout
+
+
+class ImmediateRoot:
+    """root.after 直接在当前线程执行回调"""
+
+    def after(self, delay, callback):
+        callback()
+
+
+class FakeHistory:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def load_recent(self, user_id, limit):
+        if self.fail:
+            raise OSError("磁盘错误")
+        return []
+
+    def load_summary(self, user_id):
+        return None
+
+
+class FakeContext:
+    history_window = 10
+
+    def build(self, history, question, summary):
+        return question
+
+
+class FakePersistence:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def drain(self, timeout=None):
+        if self.fail:
+            raise RuntimeError("队列已关闭")
+        return True
+
+
+class FakeFanout:
+    def stream(self, jobs, question=None):
+        for index, service, full_input in jobs:
+            yield AgentFanout.DELTA, index, "回"
+            yield AgentFanout.DONE, index, SimpleNamespace(content="回复", advice_type="general")
+
+
+def make_gui(agent_histories, persistence=None):
+    gui = gui_tkinter.HealthAgentGUI.__new__(gui_tkinter.HealthAgentGUI)
+    gui.root = ImmediateRoot()
+    gui.agents = [
+        {"name": f"代理{i}", "history": history, "context": FakeContext(), "service": object()}
+        for i, history in enumerate(agent_histories)
+    ]
+    gui.persistence = persistence or FakePersistence()
+    gui.fanout = FakeFanout()
+    gui.compactor = None
+    gui.sessions = None
+    gui.user_id = "u1"
+    gui.is_processing = True
+    gui.status_var = SimpleNamespace(set=lambda text: setattr(gui, "status", text))
+    gui.messages = []
+    gui.finalized = []
+    gui.display_message = lambda sender, message, tag=None: gui.messages.append((sender, message, tag))
+    gui.begin_stream = lambda name, stream_id=None: None
+    gui.append_stream = lambda text, stream_id=None: None
+    gui.end_stream = lambda stream_id=None: None
+    gui.finalize_response = gui.finalized.append
+    gui.save_to_history = lambda *args, **kwargs: None
+    return gui
+
+
+def test_context_error_is_reported_for_that_agent_only():
+    gui = make_gui([FakeHistory(fail=True), FakeHistory()])
+    gui.get_all_agents_response("高血压饮食")
+    assert gui.is_processing is False
+    assert [m for m in gui.messages if m[2] == "error"] == [("系统", "代理0处理出错：磁盘错误", "error")]
+    assert [r["agent_index"] for r in gui.finalized] == [1]
+
+
+def test_unexpected_error_resets_processing_and_reports_every_agent():
+    gui = make_gui([FakeHistory(), FakeHistory()], persistence=FakePersistence(fail=True))
+    gui.get_all_agents_response("高血压饮食")
+    assert gui.is_processing is False
+    assert len([m for m in gui.messages if m[2] == "error"]) == 2
+    assert gui.status == "处理出错"
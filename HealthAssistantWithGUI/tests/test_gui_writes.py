@@ -0,0 +1,231 @@
+# tests/test_gui_writes.py
+"""界面线程提交写入、导入导出和关闭窗口时不等待写线程（不创建真实窗口）"""
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+gui_tkinter = pytest.importorskip("gui_tkinter")
+from persistence_queue import PersistenceQueue
+
+
+class ManualRoot:
+    """记录 root.after 的回调，由测试在“界面线程”中执行"""
+
+    def __init__(self):
+        self.callbacks = deque()
+        self.lock = threading.Lock()
+        self.destroyed = False
+
+    def after(self, delay, callback, *args):
+        with self.lock:
+            self.callbacks.append((callback, args))
+
+    def run_pending(self):
+        with self.lock:
+            callbacks, self.callbacks = self.callbacks, deque()
+        for callback, args in callbacks:
+            callback(*args)
+
+    def destroy(self):
+        self.destroyed = True
+
+
+class FakeHistory:
+    def __init__(self):
+        self.appended = []
+        self.flushed = 0
+
+    def append(self, user_id, messages):
+        self.appended.extend(m["content"] for m in messages)
+
+    def flush(self):
+        self.flushed += 1
+
+    def load(self, user_id):
+        return []
+
+    def iter_history(self, user_id, before=None, limit=50, agent=None):
+        self.read_by = threading.current_thread().name
+        self.read_limit = limit
+        yield from [{"role": gui_tkinter.RoleType.USER, "content": "旧消息"}]
+
+
+def make_gui(persistence):
+    gui = gui_tkinter.HealthAgentGUI.__new__(gui_tkinter.HealthAgentGUI)
+    gui.root = ManualRoot()
+    gui.history = FakeHistory()
+    gui.agents = []
+    gui.user_id = "u1"
+    gui.is_processing = False
+    gui.persistence = persistence
+    gui._overflow = deque()
+    gui._overflow_lock = threading.Lock()
+    gui.max_overflow = 200
+    gui.display_limit = 50
+    gui.status_var = SimpleNamespace(set=lambda text: setattr(gui, "status", text))
+    return gui
+
+
+@pytest.fixture
+def blocked_queue():
+    """写线程卡在第一个操作上、队列只有一个空位"""
+    persistence = PersistenceQueue(maxsize=1)
+    release = threading.Event()
+    persistence.submit(release.wait)
+    deadline = time.monotonic() + 5
+    while persistence._queue.qsize() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield persistence, release
+    release.set()
+    persistence.close(timeout=5)
+
+
+def test_save_to_history_does_not_block_when_queue_is_full(blocked_queue):
+    persistence, release = blocked_queue
+    gui = make_gui(persistence)
+    start = time.monotonic()
+    for content in ("一", "二", "三"):
+        gui.save_to_history(gui_tkinter.RoleType.USER, content)
+    assert time.monotonic() - start < 1
+    assert len(gui._overflow) == 2
+    gui.root.run_pending()
+    assert "稍后写入" in gui.status
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while (gui._overflow or persistence.depth) and time.monotonic() < deadline:
+        gui.root.run_pending()
+        time.sleep(0.01)
+    assert gui.history.appended == ["一", "二", "三"]
+
+
+def test_run_after_writes_runs_on_writer_thread():
+    persistence = PersistenceQueue()
+    try:
+        gui = make_gui(persistence)
+        seen = {}
+        gui.run_after_writes(lambda: threading.current_thread().name, lambda name: seen.update(name=name), "导出")
+        assert persistence.drain(timeout=5)
+        gui.root.run_pending()
+        assert seen["name"] == "history-writer"
+    finally:
+        persistence.close(timeout=5)
+
+
+def test_run_after_writes_reports_errors(monkeypatch):
+    errors = []
+    monkeypatch.setattr(gui_tkinter.messagebox, "showerror", lambda title, message: errors.append(message))
+    persistence = PersistenceQueue()
+    try:
+        gui = make_gui(persistence)
+
+        def work():
+            raise OSError("磁盘已满")
+
+        gui.run_after_writes(work, lambda result: None, "导出")
+        assert persistence.drain(timeout=5)
+        gui.root.run_pending()
+        assert errors == ["导出失败：磁盘已满"]
+        assert gui.status == "导出失败"
+    finally:
+        persistence.close(timeout=5)
+
+
+def test_on_closing_waits_without_blocking(blocked_queue, monkeypatch):
+    persistence, release = blocked_queue
+    monkeypatch.setattr(gui_tkinter.messagebox, "askokcancel", lambda *args: True)
+    gui = make_gui(persistence)
+    start = time.monotonic()
+    gui.on_closing()
+    gui.root.run_pending()
+    assert time.monotonic() - start < 1
+    assert not gui.root.destroyed
+    assert "正在保存历史记录" in gui.status
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while not gui.root.destroyed and time.monotonic() < deadline:
+        gui.root.run_pending()
+        time.sleep(0.01)
+    assert gui.root.destroyed
+    assert gui.history.flushed == 1
+
+
+def test_overflow_is_bounded(blocked_queue, monkeypatch):
+    persistence, release = blocked_queue
+    warnings = []
+    monkeypatch.setattr(gui_tkinter.messagebox, "showwarning", lambda title, message: warnings.append(message))
+    gui = make_gui(persistence)
+    gui.max_overflow = 3
+    assert gui.submit_write(gui.history.append, "u1", [{"content": "一"}])   # 进入队列
+    for content in ("二", "三", "四"):
+        assert gui.submit_write(gui.history.append, "u1", [{"content": content}])
+    assert len(gui._overflow) == 3
+    # 暂存已满：普通操作被拒绝，界面不再接受新消息
+    assert not gui.submit_write(gui.history.flush)
+    assert gui.writes_backlogged()
+    gui.run_after_writes(lambda: None, lambda result: None, "导出")
+    assert warnings and "暂时无法导出" in warnings[0]
+    assert len(gui._overflow) == 3
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while (gui._overflow or persistence.depth) and time.monotonic() < deadline:
+        gui.root.run_pending()
+        time.sleep(0.01)
+    assert gui.history.appended == ["一", "二", "三", "四"]
+    assert not gui.writes_backlogged()
+
+
+def test_blocking_write_waits_when_overflow_is_full(blocked_queue):
+    persistence, release = blocked_queue
+    gui = make_gui(persistence)
+    gui.max_overflow = 1
+    gui.submit_write(gui.history.append, "u1", [{"content": "一"}])
+    gui.submit_write(gui.history.append, "u1", [{"content": "二"}])
+    threading.Timer(0.2, release.set).start()
+    # 对话消息不丢弃：等待写线程腾出空位后按顺序提交
+    assert gui.submit_write(gui.history.append, "u1", [{"content": "三"}], block=True)
+    assert not gui._overflow
+    assert persistence.drain(timeout=5)
+    assert gui.history.appended == ["一", "二", "三"]
+
+
+def test_on_closing_drains_overflow_before_close(blocked_queue, monkeypatch):
+    persistence, release = blocked_queue
+    monkeypatch.setattr(gui_tkinter.messagebox, "askokcancel", lambda *args: True)
+    gui = make_gui(persistence)
+    for content in ("一", "二", "三"):
+        gui.save_to_history(gui_tkinter.RoleType.USER, content)
+    assert len(gui._overflow) == 2
+    threading.Timer(0.2, release.set).start()
+    gui.on_closing()
+    # 暂存的操作已在关闭前全部提交，窗口关闭后不依赖 root.after 重试
+    assert not gui._overflow
+    deadline = time.monotonic() + 5
+    while not gui.root.destroyed and time.monotonic() < deadline:
+        gui.root.run_pending()
+        time.sleep(0.01)
+    assert gui.root.destroyed
+    assert gui.history.appended == ["一", "二", "三"]
+    assert gui.history.flushed == 1
+
+
+def test_load_history_reads_recent_window_on_writer_thread():
+    persistence = PersistenceQueue()
+    try:
+        gui = make_gui(persistence)
+        shown = []
+        gui.display_history = shown.append
+        gui.load_history()
+        assert persistence.drain(timeout=5)
+        gui.root.run_pending()
+        assert gui.history.read_by == "history-writer"
+        assert gui.history.read_limit == 50
+        assert [r["content"] for r in shown[0]] == ["旧消息"]
+        assert gui.status == "就绪"
+    finally:
+        persistence.close(timeout=5)
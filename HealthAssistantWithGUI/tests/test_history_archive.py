@@ -0,0 +1,114 @@
+# tests/test_history_archive.py
+import os
+
+from history_archive import HistoryArchive
+
+
+def messages(start, stop, prefix="消息"):
+    return [{"role": "user", "content": f"{prefix}{i}", "timestamp": f"2024-01-01T00:00:{i:02d}"}
+            for i in range(start, stop)]
+
+
+def contents(archive, user_id="u1"):
+    return [m["content"] for m in archive.iter_messages(user_id)]
+
+
+def test_replace_is_visible_to_other_instances(tmp_path):
+    path = str(tmp_path / "archive.bin")
+    archive = HistoryArchive(path, chunk_size=3)
+    other = HistoryArchive(path)
+    try:
+        archive.add("u1", messages(0, 5))
+        archive.replace("u1", messages(0, 8))
+        assert contents(archive) == [f"消息{i}" for i in range(8)]
+        assert contents(other) == contents(archive)
+        assert other.count("u1") == 8
+    finally:
+        archive.close()
+        other.close()
+
+
+def test_replace_without_commit_keeps_old_chunks(tmp_path):
+    path = str(tmp_path / "archive.bin")
+    archive = HistoryArchive(path, chunk_size=3)
+    archive.add("u1", messages(0, 5))
+    # 模拟替换写完暂存块后、提交标记写入前中断
+    with open(path, "ab") as f:
+        for block in archive._blocks("u1", messages(0, 8, "新"), staged="crashed"):
+            f.write(block)
+    archive.close()
+
+    reopened = HistoryArchive(path)
+    try:
+        assert contents(reopened) == [f"消息{i}" for i in range(5)]
+        assert reopened.garbage() > 0
+        # 之后的写入不受暂存块影响
+        reopened.add("u1", messages(5, 6))
+        assert reopened.count("u1") == 6
+    finally:
+        reopened.close()
+
+
+def test_clear_compacts_the_file(tmp_path):
+    path = str(tmp_path / "archive.bin")
+    archive = HistoryArchive(path, chunk_size=3)
+    other = HistoryArchive(path)
+    try:
+        archive.add("u1", messages(0, 9, "秘密"))
+        archive.add("u2", messages(0, 3))
+        size = os.path.getsize(path)
+        assert archive.clear("u1")
+        assert os.path.getsize(path) < size
+        with open(path, "rb") as f:
+            assert b'"u1"' not in f.read()
+        assert archive.garbage() == 0
+        assert archive.users() == ["u2"]
+        # 其他实例发现文件被替换后重新建立索引
+        assert other.count("u1") == 0
+        assert contents(other, "u2") == [f"消息{i}" for i in range(3)]
+        other.add("u2", messages(3, 4))
+        assert archive.count("u2") == 4
+    finally:
+        archive.close()
+        other.close()
+
+
+def test_close_compacts_when_mostly_garbage(tmp_path):
+    path = str(tmp_path / "archive.bin")
+    archive = HistoryArchive(path, chunk_size=3, min_compact_bytes=0)
+    archive.add("u1", messages(0, 6))
+    archive.replace("u1", messages(0, 6))
+    archive.replace("u1", messages(0, 6))
+    assert archive.compactions == 1
+    archive.close()
+    reopened = HistoryArchive(path)
+    try:
+        assert reopened.garbage() == 0
+        assert contents(reopened) == [f"消息{i}" for i in range(6)]
+    finally:
+        reopened.close()
+
+
+def test_unify_merges_old_agent_history_into_archive(tmp_path):
+    import json
+
+    from history_store import BACKEND_JOURNAL, create_store
+    from migrate_history import unify
+
+    target = str(tmp_path / "chat_history.json")
+    store = create_store(BACKEND_JOURNAL, target)
+    archive = HistoryArchive(target + ".archive", chunk_size=3)
+    try:
+        archive.add("u1", messages(0, 4))
+        store.replace("u1", messages(10, 12))
+        legacy = str(tmp_path / "chat_history_gentle.json")
+        reply = {"role": "assistant", "content": "旧回复", "timestamp": "2024-01-01T00:00:02"}
+        with open(legacy, "w", encoding="utf-8") as f:
+            json.dump([{"user_id": "u1", "messages": [reply]}], f, ensure_ascii=False)
+
+        assert unify(store, {"gentle": legacy}, BACKEND_JOURNAL, archive=archive) == 7
+        assert contents(archive) == ["消息0", "消息1", "旧回复", "消息2", "消息3"]
+        assert [m["content"] for m in store.load("u1")] == ["消息10", "消息11"]
+    finally:
+        store.close()
+        archive.close()
@@ -0,0 +1,123 @@
+# tests/test_history_export.py
+import csv
+import io
+import json
+
+import pytest
+
+from history_export import FORMATS, export_messages, export_to_file, format_for, merge_streams, read_records
+
+AGENT_NAMES = {"gentle": "温和医生", "creative": "创意医生"}
+
+
+def message(second, content, role="user", agent=None):
+    m = {"role": role, "content": content, "timestamp": f"2024-01-01T08:00:{second:02d}"}
+    if agent:
+        m["agent"] = agent
+    return m
+
+
+def streams():
+    return {
+        "u1": [message(0, "头疼"), message(2, "多休息", "assistant", "gentle"), message(5, "还有呢")],
+        "u2": [message(1, "失眠"), message(3, "少喝咖啡", "assistant", "creative"), message(4, "好的")],
+    }
+
+
+class FakeManager:
+    def __init__(self, data):
+        self.data = data
+        self.batch_sizes = []
+
+    def stream(self, user_id, batch_size=500):
+        self.batch_sizes.append(batch_size)
+        return iter(self.data.get(user_id, []))
+
+
+def test_merge_streams_orders_by_timestamp():
+    merged = list(merge_streams(streams()))
+    assert [m["content"] for m in merged] == ["头疼", "失眠", "多休息", "少喝咖啡", "好的", "还有呢"]
+    assert [m["user_id"] for m in merged] == ["u1", "u2", "u1", "u2", "u2", "u1"]
+    # 原消息不被修改
+    assert "user_id" not in streams()["u1"][0]
+
+
+def test_merge_streams_is_lazy():
+    def endless():
+        second = 0
+        while True:
+            yield message(second % 60, f"消息{second}")
+            second += 1
+
+    merged = merge_streams({"u1": endless()})
+    assert next(merged)["content"] == "消息0"
+
+
+def export(fmt, data=None):
+    f = io.StringIO()
+    count = export_messages(data or streams(), f, fmt, AGENT_NAMES)
+    return count, f.getvalue()
+
+
+def test_text_format():
+    count, text = export("txt", {"u1": streams()["u1"]})
+    assert count == 3
+    assert text.startswith("[2024-01-01 08:00:00] 您：\n头疼\n\n[2024-01-01 08:00:02] 温和医生：\n多休息\n\n")
+
+
+def test_jsonl_format():
+    count, text = export("jsonl")
+    rows = [json.loads(line) for line in text.splitlines()]
+    assert count == len(rows) == 6
+    assert rows[1] == {"timestamp": "2024-01-01T08:00:01", "user_id": "u2", "role": "user",
+                       "agent": "", "speaker": "u2", "content": "失眠"}
+    assert rows[3]["agent"] == rows[3]["speaker"] == "创意医生"
+
+
+def test_csv_format():
+    count, text = export("csv")
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert count == len(rows) == 6
+    assert list(rows[0]) == ["timestamp", "user_id", "role", "agent", "speaker", "content"]
+    assert [r["content"] for r in rows] == ["头疼", "失眠", "多休息", "少喝咖啡", "好的", "还有呢"]
+
+
+def test_markdown_format():
+    count, text = export("md", {"u1": streams()["u1"]})
+    assert count == 3
+    assert text.startswith("# 聊天记录导出\n\n导出时间：")
+    assert "### 温和医生 · 2024-01-01 08:00:02\n\n多休息\n\n" in text
+
+
+@pytest.mark.parametrize("filename,fmt", [
+    ("a.txt", "txt"), ("a.JSONL", "jsonl"), ("a.csv", "csv"), ("a.md", "md"), ("a.log", "txt")
+])
+def test_format_for(filename, fmt):
+    assert format_for(filename) == fmt
+
+
+@pytest.mark.parametrize("fmt", ["jsonl", "csv"])
+def test_exported_file_reads_back(tmp_path, fmt):
+    filename = str(tmp_path / f"history{FORMATS[fmt].extension}")
+    manager = FakeManager(streams())
+    assert export_to_file(manager, ["u1", "u2"], filename, agent_names=AGENT_NAMES, batch_size=2) == 6
+    assert manager.batch_sizes == [2, 2]
+    if fmt == "csv":
+        with open(filename, "rb") as f:
+            assert f.read(3) == b"\xef\xbb\xbf"
+
+    records = read_records(filename, {name: agent for agent, name in AGENT_NAMES.items()})
+    assert [(r["user_id"], r["role"], r["content"], r["timestamp"]) for r in records] == [
+        (m["user_id"], m["role"], m["content"], m["timestamp"]) for m in merge_streams(streams())]
+    # 代理显示名称还原为代理标识
+    assert [r["agent"] for r in records if r["role"] == "assistant"] == ["gentle", "creative"]
+
+
+def test_read_json_message_list(tmp_path):
+    filename = tmp_path / "history.json"
+    filename.write_text(json.dumps(streams()["u1"], ensure_ascii=False), encoding="utf-8")
+    assert read_records(str(filename)) == streams()["u1"]
+
+    filename.write_text(json.dumps({"messages": []}), encoding="utf-8")
+    with pytest.raises(ValueError):
+        read_records(str(filename))
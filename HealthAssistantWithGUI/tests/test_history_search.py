@@ -0,0 +1,51 @@
+# tests/test_history_search.py
+import pytest
+
+history_manager = pytest.importorskip("history_manager")
+from history_search import HistorySearch, index_terms, tokenize
+from history_store import BACKEND_JOURNAL, create_store
+
+
+@pytest.fixture
+def manager(tmp_path):
+    store = create_store(BACKEND_JOURNAL, str(tmp_path / "chat_history.json"), str(tmp_path / "history.db"))
+    manager = history_manager.HistoryManager(store=store, flush_every=1)
+    yield manager
+    manager.close()
+
+
+def message(content, timestamp, role="user", agent=None):
+    m = {"role": role, "content": content, "timestamp": timestamp}
+    if agent:
+        m["agent"] = agent
+    return m
+
+
+def test_index_terms_include_cjk_unigrams():
+    assert tokenize("头痛") == ["头痛"]
+    assert index_terms("头痛 headache") == {"头痛": 1, "headache": 1, "头": 1, "痛": 1}
+
+
+def test_single_character_query_matches(manager):
+    manager.store.append("u1", 0, [
+        message("我最近经常头痛", "2024-01-01T00:00:00"),
+        message("睡眠不太好", "2024-01-01T00:00:01"),
+    ])
+    search = HistorySearch(manager)
+    results = search.search("痛")
+    assert [r["content"] for r in results] == ["我最近经常头痛"]
+
+
+def test_filters_apply_before_or_fallback(manager):
+    manager.store.append("u1", 0, [
+        # 另一代理的回复包含全部词项
+        message("头痛 失眠 都要注意", "2024-01-01T00:00:00", "assistant", "creative"),
+        message("头痛可以先休息", "2024-01-01T00:00:01", "assistant", "gentle"),
+        message("失眠时不要喝咖啡", "2024-01-01T00:00:02", "assistant", "gentle"),
+    ])
+    search = HistorySearch(manager)
+    results = search.search("头痛 失眠", agent="gentle")
+    assert {r["content"] for r in results} == {"头痛可以先休息", "失眠时不要喝咖啡"}
+
+    results = search.search("头痛 失眠", date_from="2024-01-02")
+    assert results == []
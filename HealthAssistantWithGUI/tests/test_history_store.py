@@ -0,0 +1,259 @@
+# tests/test_history_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from history_store import (BACKEND_JOURNAL, BACKEND_JSON, BACKEND_SEGMENT, BACKEND_SQLITE,
+                           FileLock, JournalStore, SQLiteStore, SegmentStore, create_store)
+
+BACKENDS = [BACKEND_JSON, BACKEND_JOURNAL, BACKEND_SQLITE, BACKEND_SEGMENT]
+
+
+def message(i, role="user", **extra):
+    return dict({"role": role, "content": f"消息{i}", "timestamp": f"2024-01-01T00:00:{i:02d}"}, **extra)
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    stores = []
+
+    def factory(backend):
+        store = create_store(backend, str(tmp_path / "chat_history.json"), str(tmp_path / "history.db"))
+        stores.append(store)
+        return store
+
+    yield factory
+    for store in stores:
+        store.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_round_trip(open_store, backend):
+    store = open_store(backend)
+    first = [message(0), message(1, "assistant", agent="agent_1")]
+    assert store.append("u1", 0, first)
+    assert store.append("u1", 2, [message(2)])
+    assert store.append("u2", 0, [message(3)])
+    store.save_summary("u1", {"text": "摘要", "covered_until": "2024-01-01T00:00:01"})
+    store.close()
+
+    store = open_store(backend)
+    expected = first + [message(2)]
+    assert store.load("u1") == expected
+    assert store.load("u2") == [message(3)]
+    assert store.load("nobody") == []
+    assert store.tail("u1") == (3, message(2))
+    assert store.load_recent("u1", 2) == expected[1:]
+    assert store.load_before("u1", "2024-01-01T00:00:02", 10) == expected[:2]
+    assert list(store.iter_messages("u1", batch_size=1)) == expected
+    assert store.load_summary("u1")["text"] == "摘要"
+
+    assert store.replace("u1", [message(9)])
+    assert store.load("u1") == [message(9)]
+    assert store.load_summary("u1")["text"] == "摘要"
+    assert store.clear("u1")
+    assert store.load("u1") == []
+    assert store.load("u2") == [message(3)]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_stale_append_merges_instead_of_overwriting(open_store, backend):
+    writer, other = open_store(backend), open_store(backend)
+    writer.append("u1", 0, [message(0)])
+    other.append("u1", 1, [message(1)])
+    # writer 仍以为只有一条消息，再次写入 message(1) 时不应重复
+    writer.append("u1", 1, [message(1), message(2)])
+    assert other.load("u1") == [message(0), message(1), message(2)]
+    assert writer.conflicts == 1
+
+
+def test_segment_append_writes_only_the_delta(tmp_path):
+    store = SegmentStore(str(tmp_path / "h.json"), fsync=False)
+    try:
+        store.append("u1", 0, [message(i) for i in range(50)])
+        before = os.path.getsize(store.data_file)
+        store.append("u1", 50, [message(50)])
+        grown = os.path.getsize(store.data_file) - before
+        assert grown < len(SegmentStore._encode(message(50))) + 200
+        assert len(store.load("u1")) == 51
+    finally:
+        store.close()
+
+
+def test_segment_folds_long_delta_chains(tmp_path):
+    store = SegmentStore(str(tmp_path / "h.json"), fsync=False, max_deltas=4)
+    try:
+        for i in range(10):
+            store.append("u1", i, [message(i)])
+        assert len(store._index["u1"]) <= 5
+        assert store.load("u1") == [message(i) for i in range(10)]
+    finally:
+        store.close()
+
+
+def test_segment_compact_and_reopen_keep_deltas(tmp_path):
+    path = str(tmp_path / "h.json")
+    store = SegmentStore(path, fsync=False)
+    store.append("u1", 0, [message(0)])
+    store.append("u1", 1, [message(1)])
+    store.save_summary("u1", {"text": "摘要"})
+    store.append("u2", 0, [message(2)])
+    store.close()
+
+    store = SegmentStore(path, fsync=False)
+    try:
+        assert store.load("u1") == [message(0), message(1)]
+        store.compact()
+        assert store._index["u1"] == [store._index["u1"][0]]
+        assert store.load("u1") == [message(0), message(1)]
+        assert store.load_summary("u1") == {"text": "摘要"}
+        assert store.load("u2") == [message(2)]
+    finally:
+        store.close()
+
+
+def test_segment_recovers_unindexed_delta(tmp_path):
+    path = str(tmp_path / "h.json")
+    store = SegmentStore(path, fsync=False)
+    store.append("u1", 0, [message(0)])
+    size = os.path.getsize(store.index_file)
+    store.append("u1", 1, [message(1)])
+    store.close()
+    # 模拟崩溃：增量段已写入数据文件，但索引行没有写入
+    with open(path + ".seg.idx", "r+b") as f:
+        f.truncate(size)
+
+    store = SegmentStore(path, fsync=False)
+    try:
+        assert store.load("u1") == [message(0), message(1)]
+    finally:
+        store.close()
+
+
+def test_file_lock_is_reentrant_and_excludes_other_holders(tmp_path):
+    path = str(tmp_path / "history.lock")
+    lock, other = FileLock(path), FileLock(path)
+    try:
+        with lock:
+            with lock:
+                assert not other.acquire(blocking=False)
+        held = threading.Event()
+
+        def hold():
+            with lock:
+                held.set()
+                time.sleep(0.05)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait(2)
+        with other:
+            pass
+        holder.join()
+        assert other.stats()["lock_contended"] == 1
+        assert other.stats()["lock_wait_max"] >= 0.04
+    finally:
+        lock.close()
+        other.close()
+
+
+def test_journal_compacts_in_background_after_threshold(tmp_path):
+    history_file = str(tmp_path / "chat_history.json")
+    store = JournalStore(history_file, compact_threshold=3, fsync=False)
+    try:
+        for i in range(3):
+            assert store.append("u1", i, [message(i)])
+        store._compact_thread.join(2)
+        # 日志已合并进快照，轮转日志已删除
+        assert not os.path.exists(store.journal_file)
+        assert not os.path.exists(store.rotated_journal_file)
+        with open(history_file, encoding="utf-8") as f:
+            assert json.load(f)[0]["messages"] == [message(i) for i in range(3)]
+        assert store.append("u1", 3, [message(3)])
+    finally:
+        store.close()
+
+    reopened = JournalStore(history_file)
+    try:
+        assert reopened.load("u1") == [message(i) for i in range(4)]
+    finally:
+        reopened.close()
+
+
+def test_journal_finishes_interrupted_compaction(tmp_path):
+    history_file = str(tmp_path / "chat_history.json")
+    store = JournalStore(history_file, fsync=False)
+    store.append("u1", 0, [message(0), message(1)])
+    store.close()
+    # 模拟轮转日志后、写快照前崩溃，重启后又有新的日志
+    os.replace(history_file + ".journal", history_file + ".journal.1")
+    with open(history_file + ".journal", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"op": "append", "user_id": "u1", "start": 2, "messages": [message(2)]}) + "\n")
+        f.write('{"op": "append", "user_id": "u1", "sta')     # 写入中断的半行
+
+    store = JournalStore(history_file, fsync=False)
+    try:
+        assert store.load("u1") == [message(0), message(1), message(2)]
+        assert not os.path.exists(history_file + ".journal.1")
+        assert store.append("u1", 3, [message(3)])
+        assert store.load("u1") == [message(i) for i in range(4)]
+    finally:
+        store.close()
+
+
+def test_journal_reloads_after_other_instance_compacts(tmp_path):
+    history_file = str(tmp_path / "chat_history.json")
+    writer = JournalStore(history_file, fsync=False)
+    reader = JournalStore(history_file, fsync=False)
+    try:
+        writer.append("u1", 0, [message(0)])
+        assert reader.load("u1") == [message(0)]
+        assert writer.compact()
+        writer.append("u1", 1, [message(1)])
+        assert reader.load("u1") == [message(0), message(1)]
+        # 读方也能继续写入，不会与轮转后的日志错位
+        reader.append("u1", 2, [message(2)])
+        assert writer.load("u1") == [message(i) for i in range(3)]
+    finally:
+        writer.close()
+        reader.close()
+
+
+def test_sqlite_write_retries_while_database_is_locked(tmp_path):
+    db_file = str(tmp_path / "history.db")
+    store = SQLiteStore(db_file, "chat_history", busy_timeout=2)
+    other = sqlite3.connect(db_file, isolation_level=None, timeout=0, check_same_thread=False)
+    try:
+        other.execute("BEGIN IMMEDIATE")
+        released = threading.Timer(0.1, other.execute, ["COMMIT"])
+        released.start()
+        start = time.perf_counter()
+        assert store.append("u1", 0, [message(0)])
+        released.join()
+        assert time.perf_counter() - start >= 0.09
+        assert store.load("u1") == [message(0)]
+        stats = store.stats()
+        assert stats["lock_contended"] == 1
+        assert stats["lock_wait_max"] >= 0.09
+    finally:
+        store.close()
+        other.close()
+
+
+def test_sqlite_write_gives_up_after_busy_timeout(tmp_path):
+    db_file = str(tmp_path / "history.db")
+    store = SQLiteStore(db_file, "chat_history", busy_timeout=0.1)
+    other = sqlite3.connect(db_file, isolation_level=None, timeout=0, check_same_thread=False)
+    try:
+        other.execute("BEGIN IMMEDIATE")
+        assert not store.append("u1", 0, [message(0)])
+        other.execute("COMMIT")
+        assert store.load("u1") == []
+        assert store.append("u1", 0, [message(0)])
+    finally:
+        store.close()
+        other.close()
@@ -0,0 +1,60 @@
+# tests/test_http_pool.py
+import asyncio
+
+import pytest
+
+http_pool = pytest.importorskip("http_pool")
+
+
+class FakeAsyncClient:
+    def __init__(self, *args, **kwargs):
+        self.is_closed = False
+
+    async def aclose(self):
+        self.is_closed = True
+
+
+class FakeAsyncOpenAI:
+    def __init__(self, base_url=None, api_key=None, http_client=None):
+        self.api_key = api_key
+        self.http_client = http_client
+
+
+@pytest.fixture(autouse=True)
+def fake_clients(monkeypatch):
+    monkeypatch.setattr(http_pool.httpx, "AsyncClient", FakeAsyncClient)
+    monkeypatch.setattr(http_pool, "AsyncOpenAI", FakeAsyncOpenAI)
+    monkeypatch.setattr(http_pool, "_async_clients", type(http_pool._async_clients)())
+
+
+async def fetch(api_key="key"):
+    return http_pool.get_async_openai_client(api_key), http_pool.get_async_openai_client(api_key)
+
+
+def test_async_client_shared_within_loop():
+    first, second = asyncio.run(fetch())
+    assert first is second
+    assert first.http_client is not None
+
+
+def test_each_event_loop_gets_its_own_client():
+    first, _ = asyncio.run(fetch())
+    second, _ = asyncio.run(fetch())
+    assert first is not second
+    assert first.http_client is not second.http_client
+
+
+def test_aclose_closes_current_loop_client_only():
+    async def use_and_close():
+        client = http_pool.get_async_http_client()
+        await http_pool.aclose()
+        return client, http_pool.get_async_http_client()
+
+    closed, fresh = asyncio.run(use_and_close())
+    assert closed.is_closed
+    assert fresh is not closed and not fresh.is_closed
+
+
+def test_requires_running_loop():
+    with pytest.raises(RuntimeError):
+        http_pool.get_async_http_client()
@@ -0,0 +1,111 @@
+# tests/test_persistence_queue.py
+import threading
+
+import pytest
+
+from persistence_queue import PersistenceQueue
+
+
+@pytest.fixture
+def gate():
+    """写线程执行到 blocker 时停住，直到测试放行"""
+    started, release = threading.Event(), threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(2)
+
+    yield started, release, blocker
+    release.set()
+
+
+def test_jobs_run_in_order_and_failures_do_not_stop_the_writer():
+    persistence = PersistenceQueue()
+    done = []
+
+    def fail():
+        raise IOError("磁盘已满")
+
+    try:
+        persistence.submit(done.append, 1)
+        persistence.submit(fail)
+        persistence.submit(done.append, 2)
+        assert persistence.try_submit(done.append, 3)
+        assert persistence.drain(timeout=2)
+        assert done == [1, 2, 3]
+        stats = persistence.stats()
+        assert stats["submitted"] == 4 and stats["completed"] == 3 and stats["failed"] == 1
+        assert stats["depth"] == 0
+    finally:
+        persistence.close(timeout=2)
+
+
+def test_try_submit_rejects_when_full(gate):
+    started, release, blocker = gate
+    persistence = PersistenceQueue(maxsize=2)
+    done = []
+    try:
+        persistence.submit(blocker)
+        started.wait(2)
+        assert persistence.try_submit(done.append, 1)
+        assert persistence.try_submit(done.append, 2)
+        assert not persistence.try_submit(done.append, 3)
+        assert persistence.stats()["rejected"] == 1
+        assert persistence.depth == 3      # 含正在执行的 blocker
+        release.set()
+        assert persistence.drain(timeout=2)
+        assert done == [1, 2]
+        assert persistence.stats()["max_depth"] == 3
+    finally:
+        persistence.close(timeout=2)
+
+
+def test_submit_blocks_when_full(gate):
+    started, release, blocker = gate
+    persistence = PersistenceQueue(maxsize=1)
+    done = []
+    try:
+        persistence.submit(blocker)
+        started.wait(2)
+        persistence.submit(done.append, 1)
+        submitter = threading.Thread(target=persistence.submit, args=(done.append, 2))
+        submitter.start()
+        submitter.join(0.1)
+        assert submitter.is_alive()        # 队列已满，等待空位
+        release.set()
+        submitter.join(2)
+        assert persistence.drain(timeout=2)
+        assert done == [1, 2]
+        assert persistence.stats()["blocked"] == 1
+    finally:
+        persistence.close(timeout=2)
+
+
+def test_drain_times_out_while_a_job_is_running(gate):
+    started, release, blocker = gate
+    persistence = PersistenceQueue()
+    try:
+        persistence.submit(blocker)
+        started.wait(2)
+        assert not persistence.drain(timeout=0.05)
+        release.set()
+        assert persistence.drain(timeout=2)
+    finally:
+        persistence.close(timeout=2)
+
+
+def test_close_finishes_pending_jobs_and_rejects_new_ones(gate):
+    started, release, blocker = gate
+    persistence = PersistenceQueue()
+    done = []
+    persistence.submit(blocker)
+    started.wait(2)
+    persistence.submit(done.append, 1)
+    assert not persistence.close(timeout=0.05)   # 写线程仍在执行
+    release.set()
+    assert persistence.close(timeout=2)
+    assert done == [1]
+    with pytest.raises(RuntimeError):
+        persistence.submit(done.append, 2)
+    with pytest.raises(RuntimeError):
+        persistence.try_submit(done.append, 2)
@@ -0,0 +1,120 @@
+# tests/test_preprocessor.py
+import re
+
+import pytest
+
+from preprocessor import InputPreprocessor, PreprocessResult
+
+SQL_PATTERNS = [
+    r"[\s;]--", r"[\s;]#", r"[\s;]/\*", r"union[\s]+select",
+    r"drop[\s]+table", r"delete[\s]+from", r"insert[\s]+into",
+    r"update[\s]+\w+[\s]+set", r"xp_cmdshell", r"waitfor[\s]+delay"
+]
+
+
+def baseline_preprocess(p, user_input):
+    """改写前逐条检查的 preprocess，作为对照"""
+    processed = re.sub(r'\s+', ' ', user_input).strip()
+    if len(processed) > p.max_length:
+        return f"[输入错误] 输入过长（{len(processed)}字符），请控制在{p.max_length}字符内"
+    if processed.startswith('/'):
+        return processed
+    for chinese_cmd, english_cmd in p.command_mapping.items():
+        if processed == chinese_cmd:
+            return english_cmd
+    for wrong, correct in p.spelling_corrections.items():
+        processed = processed.replace(wrong, correct)
+    for term, standard in p.medical_terms.items():
+        processed = processed.replace(term, standard)
+    for word in p.sensitive_words:
+        if word in processed:
+            return "[敏感内容过滤] 您的问题包含不适当内容，请重新表述"
+    for cmd in p.command_blacklist:
+        if cmd in processed.lower():
+            return f"[安全防护] 检测到潜在危险命令 '{cmd}'，已阻止执行"
+    for pattern in p.injection_patterns:
+        if re.search(pattern, processed, re.IGNORECASE):
+            return "[安全防护] 检测到潜在代码注入模式，已阻止执行"
+    for pattern in SQL_PATTERNS:
+        if re.search(pattern, processed, re.IGNORECASE):
+            return "[安全防护] 检测到SQL注入尝试，已阻止执行"
+    return processed
+
+
+def baseline_validate(p, text):
+    if text.startswith(("[输入错误]", "[敏感内容过滤]", "[安全防护]")):
+        return False, (text.split("]", 1)[0][1:], text.split("] ", 1)[-1])
+    for word in p.sensitive_words:
+        if word in text:
+            return False, ("敏感内容过滤", f"输入包含敏感词'{word}'")
+    if len(text) > p.max_length:
+        return False, ("输入错误", f"输入过长（{len(text)}字符），请控制在{p.max_length}字符内")
+    return True, ""
+
+
+INPUTS = [
+    "我最近  头疼，\n还拉肚子",
+    "血压高和血糖高要注意什么饮食",
+    "健慷咨洵：锻练后心跳很快",
+    "感冒了 流鼻涕 发烧",
+    "帮助",
+    "退出",
+    "/params temperature 0.5",
+    "我想了解赌博成瘾和毒品的危害",
+    "如何预防网络暴力",
+    "请执行 sudo reboot",
+    "SHUTDOWN now",
+    "a | b",
+    "运行 eval (1+1)",
+    "使用 OS.path 读取文件",
+    "1' UNION  SELECT password from users",
+    "name; -- 注释",
+    "name --注释 然后 os.path",
+    "update users set age=1",
+    "睡眠不好 " * 120,
+    "",
+    "   ",
+]
+
+
+@pytest.fixture
+def preprocessor():
+    return InputPreprocessor()
+
+
+@pytest.mark.parametrize("text", INPUTS)
+def test_preprocess_matches_baseline(preprocessor, text):
+    result = preprocessor.preprocess(text)
+    expected = baseline_preprocess(preprocessor, text)
+    if result.ok:
+        assert result.text == expected
+    else:
+        # 拒绝的原因一致；新版提示中带有具体的规则
+        assert expected.startswith(f"[{result.error_type}]")
+    assert preprocessor.validate(result)[0] == baseline_validate(preprocessor, expected)[0]
+
+
+@pytest.mark.parametrize("text", INPUTS)
+def test_validate_string_matches_baseline(preprocessor, text):
+    processed = baseline_preprocess(preprocessor, text)
+    assert preprocessor.validate(processed) == baseline_validate(preprocessor, processed)
+
+
+def test_load_config_recompiles(preprocessor):
+    preprocessor.load_config({"medical_terms": {"胃疼": "胃痛"}, "sensitive_words": ["偏方"]})
+    assert preprocessor.preprocess("胃疼怎么办").text == "胃痛怎么办"
+    result = preprocessor.preprocess("有没有偏方")
+    assert result.verdict == PreprocessResult.VERDICT_SENSITIVE
+    assert baseline_preprocess(preprocessor, "有没有偏方").startswith("[敏感内容过滤]")
+
+
+def test_preprocess_many_matches_preprocess(preprocessor):
+    inputs = INPUTS * 3
+    expected = [InputPreprocessor().preprocess(text).to_dict() for text in inputs]
+    results = list(preprocessor.preprocess_many(inputs, workers=2, parallel_threshold=10, chunk_size=8))
+    ignored = ("elapsed", "cached")
+    assert [{k: v for k, v in r.to_dict().items() if k not in ignored} for r in results] == \
+        [{k: v for k, v in e.items() if k not in ignored} for e in expected]
+    # 记忆命中的结果与首次计算一致
+    again = preprocessor.preprocess(INPUTS[0])
+    assert again.cached and again.text == results[0].text
@@ -0,0 +1,65 @@
+# tests/test_response_cache.py
+import os
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from response_cache import ResponseCache
+from schemas import HealthOutputSchema
+
+
+def make_output(content="多喝水，注意休息。"):
+    return HealthOutputSchema(content=content, sources=["《指南》"], advice_type="general", needs_follow_up=False)
+
+
+def test_key_depends_on_memory_context():
+    config = {"temperature": 0.7}
+    plain = ResponseCache.make_key("提示词", config, "好的")
+    assert plain == ResponseCache.make_key("提示词", config, "好的")
+    assert plain == ResponseCache.make_key("提示词", config, "  好的 ")
+    assert plain != ResponseCache.make_key("提示词", config, "好的", context="a" * 64)
+    assert (ResponseCache.make_key("提示词", config, "好的", context="a" * 64)
+            != ResponseCache.make_key("提示词", config, "好的", context="b" * 64))
+
+
+def test_put_does_not_write_synchronously(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = ResponseCache(persist_file=path, save_delay=60)
+    try:
+        for i in range(20):
+            cache.put(f"key{i}", make_output(f"回复{i}"))
+        assert not os.path.exists(path)
+        assert cache.get("key3").content == "回复3"
+    finally:
+        cache.close(timeout=5)
+    assert os.path.exists(path)
+
+
+def test_close_persists_and_reloads(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = ResponseCache(persist_file=path, save_delay=60)
+    cache.put("key", make_output())
+    cache.close(timeout=5)
+
+    reloaded = ResponseCache(persist_file=path, save_delay=60)
+    try:
+        assert reloaded.get("key").content == make_output().content
+    finally:
+        reloaded.close(timeout=5)
+
+
+def test_background_save_batches_writes(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.json")
+    cache = ResponseCache(persist_file=path, save_delay=0.2)
+    saves = []
+    original_save = cache.save
+    monkeypatch.setattr(cache, "save", lambda: (saves.append(1), original_save()))
+    try:
+        for i in range(10):
+            cache.put(f"key{i}", make_output())
+        cache._stop.wait(1.0)
+        assert os.path.exists(path)
+        assert len(saves) == 1
+    finally:
+        cache.close(timeout=5)
@@ -0,0 +1,146 @@
+# tests/test_rule_config.py
+import json
+import os
+
+import pytest
+
+from aho_corasick import AhoCorasick
+from preprocessor import InputPreprocessor
+from rule_config import CACHE_FORMAT_VERSION, CACHE_SUFFIX, RuleWatcher, load_rules
+
+
+def write_rules(path, rules, mtime=None):
+    path.write_text(json.dumps(rules, ensure_ascii=False), encoding="utf-8")
+    if mtime is not None:
+        # 保证修改时间变化，不依赖文件系统的时间精度
+        os.utime(path, ns=(mtime, mtime))
+
+
+def test_watcher_reloads_changed_rules(tmp_path):
+    rules_file = tmp_path / "rules.json"
+    write_rules(rules_file, {"version": 1, "sensitive_words": ["赌博"]}, mtime=1_000_000_000)
+    preprocessor = InputPreprocessor()
+    watcher = RuleWatcher(str(rules_file), preprocessor)
+    assert preprocessor.rules_version == 1
+    assert not preprocessor.preprocess("我想戒掉赌博").ok
+    assert preprocessor.preprocess("我有毒品问题").ok
+
+    write_rules(rules_file, {"version": 2, "sensitive_words": ["毒品"]}, mtime=2_000_000_000)
+    assert watcher.check()
+    assert preprocessor.rules_version == 2
+    assert preprocessor.preprocess("我想戒掉赌博").ok
+    assert not preprocessor.preprocess("我有毒品问题").ok
+    assert watcher.stats()["reloads"] == 2
+
+
+def test_bad_rule_file_keeps_current_rules(tmp_path):
+    rules_file = tmp_path / "rules.json"
+    write_rules(rules_file, {"version": 1, "medical_terms": {"头疼": "头痛"}}, mtime=1_000_000_000)
+    preprocessor = InputPreprocessor()
+    watcher = RuleWatcher(str(rules_file), preprocessor)
+
+    write_rules(rules_file, {"version": 2, "injection_patterns": ["("]}, mtime=2_000_000_000)
+    assert not watcher.check()
+    rules_file.write_text("{不是JSON", encoding="utf-8")
+    os.utime(rules_file, ns=(3_000_000_000, 3_000_000_000))
+    assert not watcher.check()
+    assert watcher.failures == 2
+    assert preprocessor.rules_version == 1
+    assert preprocessor.preprocess("头疼怎么办").text == "头痛怎么办"
+
+
+def test_unchanged_content_is_not_recompiled(tmp_path):
+    rules_file = tmp_path / "rules.json"
+    rules = {"version": 1, "sensitive_words": ["赌博"]}
+    write_rules(rules_file, rules, mtime=1_000_000_000)
+    preprocessor = InputPreprocessor()
+    watcher = RuleWatcher(str(rules_file), preprocessor)
+    compiled = preprocessor._compiled
+
+    write_rules(rules_file, rules, mtime=2_000_000_000)
+    assert not watcher.check()
+    assert preprocessor._compiled is compiled
+    assert watcher.stats()["unchanged"] == 1
+
+
+def test_compiled_cache_hit(tmp_path, monkeypatch):
+    rules_file = tmp_path / "rules.json"
+    write_rules(rules_file, {"version": 1, "medical_terms": {"头疼": "头痛", "心口疼": "胸痛"}})
+    defaults = InputPreprocessor().default_rules
+    rules, compiled, from_cache = load_rules(str(rules_file), defaults)
+    assert not from_cache
+    cache_file = str(rules_file) + CACHE_SUFFIX
+    with open(cache_file, encoding="utf-8") as f:
+        assert json.load(f)["format"] == CACHE_FORMAT_VERSION
+
+    # 清空共享自动机，确认命中缓存时从状态表载入而不是重新构建
+    monkeypatch.setattr(AhoCorasick, "_shared", type(AhoCorasick._shared)())
+    monkeypatch.setattr(AhoCorasick, "__init__", no_build(AhoCorasick.__init__))
+    _, cached, from_cache = load_rules(str(rules_file), defaults)
+    assert from_cache
+    assert cached.fingerprint == compiled.fingerprint
+    assert cached.replacer.replace("头疼和心口疼") == compiled.replacer.replace("头疼和心口疼") == "头痛和胸痛"
+    assert cached.engine.source == compiled.engine.source
+    # 载入的自动机已注册为共享实例
+    assert AhoCorasick.shared(dict(zip(cached.replacer.words, cached.replacer.values))) is cached.replacer
+
+
+def no_build(init):
+    def wrapper(self, patterns, tables=None):
+        assert tables is not None, "命中缓存时不应重新构建自动机"
+        init(self, patterns, tables)
+    return wrapper
+
+
+def test_stale_cache_is_rebuilt(tmp_path):
+    rules_file = tmp_path / "rules.json"
+    defaults = InputPreprocessor().default_rules
+    write_rules(rules_file, {"version": 1, "sensitive_words": ["赌博"]})
+    load_rules(str(rules_file), defaults)
+    write_rules(rules_file, {"version": 2, "sensitive_words": ["毒品"]})
+    _, compiled, from_cache = load_rules(str(rules_file), defaults)
+    assert not from_cache
+    assert compiled.version == 2
+    assert compiled.detector.words[0] == "毒品"
+    # 缓存已按新规则重写
+    assert load_rules(str(rules_file), defaults)[2]
+
+
+def corrupt_tables(cache_file):
+    with open(cache_file, encoding="utf-8") as f:
+        cached = json.load(f)
+    cached["tables"]["replacer"]["fail"] = []
+    return json.dumps(cached)
+
+
+@pytest.mark.parametrize("corrupt", [lambda cache_file: "{不是JSON", corrupt_tables])
+def test_corrupt_cache_is_rebuilt(tmp_path, monkeypatch, corrupt):
+    rules_file = tmp_path / "rules.json"
+    defaults = InputPreprocessor().default_rules
+    write_rules(rules_file, {"version": 1})
+    load_rules(str(rules_file), defaults)
+    cache_file = tmp_path / ("rules.json" + CACHE_SUFFIX)
+    cache_file.write_text(corrupt(cache_file), encoding="utf-8")
+    monkeypatch.setattr(AhoCorasick, "_shared", type(AhoCorasick._shared)())
+
+    _, rebuilt, from_cache = load_rules(str(rules_file), defaults)
+    assert not from_cache
+    assert rebuilt.replacer.replace("头疼") == "头痛"
+    assert load_rules(str(rules_file), defaults)[2]
+
+
+def test_corrupt_tables_are_rejected():
+    automaton = AhoCorasick({"头疼": "头痛"})
+    tables = automaton.tables()
+    tables["fail"] = tables["fail"][:-1]
+    with pytest.raises(ValueError):
+        AhoCorasick({"头疼": "头痛"}, tables)
+    with pytest.raises(ValueError):
+        AhoCorasick({"头晕": "眩晕"}, automaton.tables())
+
+
+def test_no_cache_writes_nothing(tmp_path):
+    rules_file = tmp_path / "rules.json"
+    write_rules(rules_file, {"version": 1})
+    assert not load_rules(str(rules_file), InputPreprocessor().default_rules, use_cache=False)[2]
+    assert os.listdir(tmp_path) == ["rules.json"]
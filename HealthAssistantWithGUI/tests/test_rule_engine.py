@@ -0,0 +1,96 @@
+# tests/test_rule_engine.py
+import random
+import re
+
+import pytest
+
+from preprocessor import InputPreprocessor
+from rule_engine import RuleEngine, _first_chars, sre_parse
+
+
+@pytest.fixture(scope="module")
+def rules():
+    preprocessor = InputPreprocessor()
+    return {"injection": preprocessor.injection_patterns, "sql": preprocessor.sql_injection_patterns}
+
+
+def per_rule_search(rules, text, flags=re.IGNORECASE):
+    """原实现：按类别顺序逐条 re.search；同一类别取最先出现的命中"""
+    for category, patterns in rules.items():
+        hits = [(match.start(), i, pattern, match) for i, pattern in enumerate(patterns)
+                for match in [re.search(pattern, text, flags)] if match]
+        if hits:
+            _, _, pattern, match = min(hits, key=lambda hit: hit[:2])
+            return category, pattern, match.span()
+    return None
+
+
+def engine_search(engine, text):
+    hit = engine.search(text)
+    return hit and (hit[0], hit[1], hit[2].span())
+
+
+FRAGMENTS = ["os.", "OS.path", " --", ";#", " /*", "union  select", "UPDATE t SET", "eval (", "Exec(",
+             "json.loads", "__import__(", "xp_cmdshell", "血压", "普通文本", "x", " ", "system", "select"]
+
+CASES = [
+    "我最近血压有点高，饮食需要注意什么？",
+    "name --注释 然后 os.path",          # SQL 规则先出现，仍报告代码注入
+    "1' union select password from users",
+    "请运行 EVAL (1+1)",
+    "waitfor   delay '0:0:5'",
+    "",
+]
+
+
+def random_cases(count=300, seed=3):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 6))) for _ in range(count)]
+
+
+def test_combined_regex_matches_per_rule_results(rules):
+    engine = RuleEngine(rules)
+    for text in CASES + random_cases():
+        assert engine_search(engine, text) == per_rule_search(rules, text), text
+
+
+def test_first_char_lookahead_is_used_and_safe(rules):
+    engine = RuleEngine(rules)
+    assert engine.source.startswith("(?=[")
+    # 有规则可能以任意字符开头时不加前瞻，结果不变
+    loose = dict(rules, other=[r".*password", r"\w+@\w+"])
+    plain = RuleEngine(loose)
+    assert not plain.source.startswith("(?=")
+    for text in CASES + random_cases(100) + ["my password", "a@b"]:
+        assert engine_search(plain, text) == per_rule_search(loose, text), text
+
+
+@pytest.mark.parametrize("pattern,expected", [
+    (r"os\.", ["o"]),
+    (r"[\s;]--", [r"\s", ";"]),
+    (r"[a-c]x", ["a-c"]),
+    (r"(ab|cd)", ["a", "c"]),
+    (r"\bfoo", ["f"]),
+    (r"x+y", ["x"]),
+    (r"x*y", None),
+    (r"a?b", None),
+    (r".b", None),
+    (r"(?i:a)b", None),
+])
+def test_first_chars(pattern, expected):
+    assert _first_chars(sre_parse.parse(pattern)) == expected
+
+
+def test_source_round_trip(rules):
+    engine = RuleEngine(rules)
+    loaded = RuleEngine(rules, source=engine.source)
+    for text in CASES + random_cases(100):
+        assert engine_search(loaded, text) == engine_search(engine, text)
+    with pytest.raises(ValueError):
+        RuleEngine(rules, source="(?P<r0>os\\.)")
+
+
+def test_empty_rules():
+    engine = RuleEngine({"injection": [], "sql": []})
+    assert engine.source is None
+    assert engine.search("os.system(1)") is None
@@ -0,0 +1,82 @@
+# tests/test_semantic_cache.py
+import time
+
+import pytest
+
+from schemas import HealthOutputSchema
+from semantic_cache import SemanticCache
+
+CACHED = "高血压患者的饮食建议有哪些"
+
+
+def reply(content):
+    return HealthOutputSchema(content=content, sources=[], advice_type="general", needs_follow_up=False)
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache(threshold=0.8)
+    cache.add("ns", CACHED, reply("低盐饮食"))
+    return cache
+
+
+def test_same_question_hits(cache):
+    match = cache.get("ns", "高血压患者的饮食建议有哪些？")
+    assert match is not None and match.output.content == "低盐饮食"
+
+
+@pytest.mark.parametrize("question", [
+    "低血压患者的饮食建议有哪些",
+    "儿童高血压患者的饮食建议有哪些",
+    "高血压患者的饮食不建议有哪些",
+])
+def test_meaning_changes_do_not_hit(cache, question):
+    # 字面相似度超过阈值，但问题含义相反或人群不同
+    assert cache.search("ns", question)[0].score >= cache.threshold
+    assert cache.get("ns", question) is None
+
+
+def test_default_threshold_rejects_one_character_changes():
+    cache = SemanticCache()
+    cache.add("ns", CACHED, reply("低盐饮食"))
+    assert cache.search("ns", "高血压患者的饮食建议是哪些")[0].score < cache.threshold
+    assert cache.get("ns", "高血压患者的饮食建议是哪些") is None
+
+
+def test_namespaces_are_separate(cache):
+    assert cache.get("other", CACHED) is None
+
+
+def test_add_does_not_write_on_the_reply_path(tmp_path):
+    path = tmp_path / "semantic.json"
+    cache = SemanticCache(persist_file=str(path), save_delay=60)
+    try:
+        cache.add("ns", CACHED, reply("低盐饮食"))
+        assert not path.exists()
+    finally:
+        cache.close(timeout=5)
+    assert path.exists()
+
+    reloaded = SemanticCache(persist_file=str(path), save_delay=60)
+    try:
+        assert reloaded.get("ns", CACHED).output.content == "低盐饮食"
+    finally:
+        reloaded.close(timeout=5)
+
+
+def test_background_saver_merges_adds(tmp_path, monkeypatch):
+    path = tmp_path / "semantic.json"
+    cache = SemanticCache(persist_file=str(path), save_delay=0.2)
+    saves = []
+    original = cache.save
+    monkeypatch.setattr(cache, "save", lambda: (original(), saves.append(1)))
+    try:
+        for i in range(5):
+            cache.add("ns", f"问题{i}", reply("回复"))
+        deadline = time.time() + 5
+        while not saves and time.time() < deadline:
+            time.sleep(0.05)
+        assert path.exists()
+        assert len(saves) == 1
+    finally:
+        cache.close(timeout=5)
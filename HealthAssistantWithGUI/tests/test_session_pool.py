@@ -0,0 +1,90 @@
+# tests/test_session_pool.py
+import pytest
+
+import session_pool
+from session_pool import SessionPool
+
+
+class FakeService:
+    def __init__(self, agent_index):
+        self.agent_index = agent_index
+        self.memory = []
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_pool.time, "monotonic", clock)
+    return clock
+
+
+def test_sessions_are_isolated_and_reused(clock):
+    pool = SessionPool(FakeService)
+    a = pool.get("u1", 0)
+    assert pool.get("u1", 0) is a
+    assert pool.get("u1", 1) is not a
+    assert pool.get("u2", 0) is not a
+    assert pool.stats() == {"active": 3, "created": 3, "evicted": 0, "expired": 0}
+
+
+def test_lru_eviction(clock):
+    pool = SessionPool(FakeService, max_sessions=2)
+    first = pool.get("u1", 0)
+    second = pool.get("u2", 0)
+    clock.now += 1
+    assert pool.get("u1", 0) is first       # u1 变为最近使用
+    pool.get("u3", 0)                       # 淘汰最久未使用的 u2
+    assert pool.stats()["evicted"] == 1
+    assert pool.get("u1", 0) is first
+    assert pool.get("u2", 0) is not second
+
+
+def test_idle_timeout(clock):
+    pool = SessionPool(FakeService, idle_timeout=60)
+    idle = pool.get("u1", 0)
+    clock.now += 30
+    active = pool.get("u2", 0)
+    clock.now += 31
+    pool.evict_idle()
+    assert pool.stats()["active"] == 1 and pool.stats()["expired"] == 1
+    assert pool.get("u2", 0) is active
+    assert pool.get("u1", 0) is not idle
+
+
+def test_evicted_session_is_rehydrated_from_history(clock):
+    history = {"u1": ["你好", "您好"], "u2": ["头疼"]}
+    calls = []
+
+    def rehydrate(service, agent_index, user_id):
+        calls.append((agent_index, user_id))
+        service.memory = list(history[user_id])
+
+    pool = SessionPool(FakeService, rehydrate=rehydrate, max_sessions=1)
+    first = pool.get("u1", 0)
+    assert first.memory == ["你好", "您好"]
+    history["u1"].append("血压偏高")
+    pool.get("u2", 0)                       # u1 的会话被淘汰
+    restored = pool.get("u1", 0)
+    assert restored is not first
+    assert restored.memory == ["你好", "您好", "血压偏高"]
+    assert calls == [(0, "u1"), (0, "u2"), (0, "u1")]
+
+
+def test_discard(clock):
+    pool = SessionPool(FakeService)
+    pool.get("u1", 0)
+    pool.get("u1", 1)
+    kept = pool.get("u2", 0)
+    pool.discard("u1", 1)
+    assert pool.stats()["active"] == 2
+    pool.discard("u1")
+    assert pool.stats()["active"] == 1
+    assert pool.get("u2", 0) is kept
@@ -0,0 +1,82 @@
+# tests/test_stream_parser.py
+import json
+
+import pytest
+
+from stream_parser import ContentStreamParser
+
+
+def feed_all(chunks):
+    parser = ContentStreamParser()
+    return "".join(parser.feed(chunk) for chunk in chunks)
+
+
+def one_char_chunks(text):
+    return list(text)
+
+
+@pytest.mark.parametrize("content", [
+    "普通文本",
+    "换行\n制表\t引号\"反斜杠\\斜杠/",
+    "表情😀和中文",
+    "",
+])
+def test_content_matches_json_decoding(content):
+    raw = json.dumps({"content": content, "sources": ["《指南》"]})
+    assert feed_all([raw]) == content
+    assert feed_all(one_char_chunks(raw)) == content
+
+
+def test_ascii_escaped_json_split_anywhere():
+    raw = json.dumps({"content": "血压😀", "confidence": 0.9}, ensure_ascii=True)
+    for cut in range(len(raw)):
+        assert feed_all([raw[:cut], raw[cut:]]) == "血压😀"
+
+
+def test_content_key_after_other_fields_and_nested_content():
+    raw = '{"meta": {"content": "内层"}, "sources": [], "content": "外层"}'
+    assert feed_all(one_char_chunks(raw)) == "外层"
+
+
+def test_code_fence_prefix():
+    assert feed_all(['```json\n{"content": "你好"}\n```']) == "你好"
+
+
+def test_non_json_passes_through():
+    assert feed_all(["直接回答", "，没有JSON"]) == "直接回答，没有JSON"
+
+
+def test_stops_after_content_string():
+    parser = ContentStreamParser()
+    assert parser.feed('{"content": "完"') == "完"
+    assert parser.feed('", "sources": ["x"]}') == ""
+    assert parser.state == ContentStreamParser._DONE
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ('{"content": "a\\uZZZZb"}', "a\\uZZZZb"),
+    ('{"content": "a\\u12"}', "a\\u12"),
+    ('{"content": "a\\u12xyb"}', "a\\u12xyb"),
+    ('{"content": "a\\u+12fb"}', "a\\u+12fb"),
+])
+def test_malformed_unicode_escape_is_kept_verbatim(raw, expected):
+    assert feed_all([raw]) == expected
+    assert feed_all(one_char_chunks(raw)) == expected
+
+
+def test_malformed_escape_does_not_swallow_closing_quote():
+    parser = ContentStreamParser()
+    assert parser.feed('{"content": "x\\u1"') == "x\\u1"
+    assert parser.state == ContentStreamParser._DONE
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ('{"content": "\\ud83dA"}', "�A"),
+    ('{"content": "\\ude00A"}', "�A"),
+    ('{"content": "\\ud83d\\ud83d\\ude00"}', "�😀"),
+    ('{"content": "\\ud83d"}', "�"),
+])
+def test_unpaired_surrogates_become_replacement_characters(raw, expected):
+    text = feed_all(one_char_chunks(raw))
+    assert text == expected
+    text.encode("utf-8")
@@ -0,0 +1,126 @@
+# tests/test_summarizer.py
+import threading
+import time
+
+import pytest
+
+history_manager = pytest.importorskip("history_manager")
+from history_store import BACKEND_JOURNAL, create_store
+from summarizer import HistoryCompactor
+
+HistoryManager, AgentHistory = history_manager.HistoryManager, history_manager.AgentHistory
+
+
+def timeline(turns, user_id="u1"):
+    """每轮一条用户消息加两个代理的回复"""
+    messages = []
+    for turn in range(turns):
+        i = turn * 3
+        messages.append({"role": "user", "content": f"问题{turn}", "timestamp": timestamp(i)})
+        messages.append({"role": "assistant", "content": f"温和{turn}", "timestamp": timestamp(i + 1),
+                         "agent": "gentle"})
+        messages.append({"role": "assistant", "content": f"创意{turn}", "timestamp": timestamp(i + 2),
+                         "agent": "creative"})
+    return messages
+
+
+def timestamp(i):
+    return f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}"
+
+
+class FakeService:
+    def __init__(self, gate=None, fail=False):
+        self.calls = []
+        self.gate = gate
+        self.fail = fail
+
+    def summarize(self, text, transcript):
+        if self.gate is not None:
+            self.gate.wait(2)
+        if self.fail:
+            raise RuntimeError("模型不可用")
+        self.calls.append((text, transcript))
+        return f"{text}+{len(transcript.splitlines())}"
+
+
+@pytest.fixture
+def manager(tmp_path):
+    store = create_store(BACKEND_JOURNAL, str(tmp_path / "chat_history.json"))
+    manager = HistoryManager(store=store, flush_every=1)
+    manager.store.append("u1", 0, timeline(10))
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def compactor():
+    compactor = HistoryCompactor(keep_recent=4, min_new_messages=6, batch_size=5)
+    yield compactor
+    compactor.close(timeout=2)
+
+
+def test_compact_saves_per_agent_summary(manager, compactor):
+    gentle, creative = AgentHistory(manager, "gentle"), AgentHistory(manager, "creative")
+    service = FakeService()
+    summary = compactor.compact(service, gentle, "u1")
+
+    # 代理可见20条，最近4条保留，其余16条分4批压缩
+    assert len(service.calls) == 4
+    transcript = "\n".join(t for _, t in service.calls)
+    assert "温和0" in transcript and "创意0" not in transcript
+    assert "问题8" not in transcript and "温和8" not in transcript
+    assert summary["covered_count"] == 16
+    assert summary["covered_until"] == timestamp(7 * 3 + 1)    # 温和7
+    assert summary["text"] == "+5+5+5+1"
+    assert gentle.load_summary("u1") == summary
+    assert creative.load_summary("u1") in (None, {})
+
+    # 再次压缩时已覆盖的消息不再发送
+    assert compactor.compact(service, gentle, "u1") == summary
+    assert len(service.calls) == 4
+
+    # 另一代理的摘要独立保存
+    compactor.compact(FakeService(), creative, "u1")
+    assert creative.load_summary("u1")["covered_until"] == timestamp(7 * 3 + 2)
+    assert gentle.load_summary("u1") == summary
+
+
+def test_compact_waits_for_enough_new_messages(manager):
+    compactor = HistoryCompactor(keep_recent=4, min_new_messages=30)
+    try:
+        service = FakeService()
+        assert compactor.compact(service, AgentHistory(manager, "gentle"), "u1") == {}
+        assert service.calls == []
+    finally:
+        compactor.close(timeout=2)
+
+
+def test_background_thread_dedupes_and_survives_errors(manager, compactor):
+    gate = threading.Event()
+    busy = FakeService(gate=gate)
+    gentle = AgentHistory(manager, "gentle")
+    creative = AgentHistory(manager, "creative")
+
+    # 后台线程被第一个任务占住时，同一历史的任务还在排队，重复调度被忽略
+    compactor.schedule(busy, gentle, "u1")
+    failing = FakeService(fail=True)
+    compactor.schedule(failing, creative, "u1")
+    ignored = FakeService()
+    compactor.schedule(ignored, creative, "u1")
+    gate.set()
+    deadline = time.time() + 2
+    while (compactor._pending or not compactor._queue.empty()) and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert len(busy.calls) == 4
+    assert gentle.load_summary("u1")["covered_count"] == 16
+    assert ignored.calls == []
+    assert creative.load_summary("u1") in (None, {})
+
+    # 失败的任务不影响后台线程，出队后的同一历史可以再次调度
+    service = FakeService()
+    compactor.schedule(service, creative, "u1")
+    compactor.close(timeout=2)
+    assert not compactor._thread.is_alive()
+    assert len(service.calls) == 4
+    assert creative.load_summary("u1")["covered_count"] == 16
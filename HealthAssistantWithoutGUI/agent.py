@@ -8,16 +8,17 @@ import os
 import traceback
 from camel.agents import ChatAgent
 from camel.models import ModelFactory
-from camel.types import ModelPlatformType, RoleType
+from camel.types import ModelPlatformType, RoleType, OpenAIBackendRole
 from camel.messages import BaseMessage
 import time
 import json
 import os
 from datetime import datetime
 import textwrap
-from typing import Union, List, Dict, Any, cast
+from typing import Union, List, Dict, Any, Iterator, cast
 import io
 from schemas import HealthOutputSchema, validate_output
+from stream_parser import ContentStreamParser
 #from utils.retry import retry_on_exception
 import logging
 
@@ -90,41 +91,14 @@ class AgentService:
     def chat(self, message: str) -> Union[HealthOutputSchema, str]:
         """发送消息并返回响应"""
         # 如果是系统命令，直接返回空响应
-        if message.strip().lower() in ['/help', '/history', '/clear', '/params', '/exit']:
-            return HealthOutputSchema(
-                content="",
-                advice_type="general",
-                sources=[],
-                needs_follow_up=False,
-                confidence=1.0
-            )
+        if self._is_command(message):
+            return self._command_output()
         
         try:
             # API调用尝试
             response = self.agent.step(input_message=message)
             raw_content = response.msgs[0].content
-            
-            # 尝试解析为JSON
-            try:
-                parsed = json.loads(raw_content)
-
-                # 在content中添加换行符处理
-                if 'content' in parsed and isinstance(parsed['content'], str):
-                    parsed['content'] = parsed['content'].replace('\\n', '\n')
-
-                # 验证输出格式
-                output_schema = validate_output(parsed)
-                return output_schema
-            except (json.JSONDecodeError, ValueError) as e:
-                # 格式不符合时创建默认结构
-                default_output = HealthOutputSchema(
-                    content=raw_content.replace('\\n', '\n'),
-                    advice_type="general",
-                    sources=["内部知识库"],
-                    needs_follow_up=False
-                )
-                print(f"⚠️ 输出格式错误，使用默认结构: {str(e)}")
-                return default_output
+            return self._parse_output(raw_content)
         
         except Exception as e:
             # API调用失败时的异常处理
@@ -132,10 +106,98 @@ class AgentService:
             # traceback.print_exc()  # 调试时取消注释
             
             # 返回错误响应
-            return HealthOutputSchema(
-                content="服务暂时不可用，请稍后再试",
-                advice_type="warning",
-                sources=["系统错误"],
-                needs_follow_up=False,
-                confidence=0.0
-            )
\ No newline at end of file
+            return self._error_output()
+
+    def chat_stream(self, message: str) -> Iterator[Union[str, HealthOutputSchema]]:
+        """流式发送消息
+
+        依次产出 content 字段的文本增量(str)，
+        结束时产出完整解析后的 HealthOutputSchema
+        """
+        if self._is_command(message):
+            yield self._command_output()
+            return
+
+        try:
+            user_msg = BaseMessage.make_user_message(role_name="user", content=message)
+            self.agent.update_memory(user_msg, OpenAIBackendRole.USER)
+            openai_messages, _ = self.agent.memory.get_context()
+
+            request_config = dict(self.model.model_config_dict)
+            request_config["stream"] = True
+            stream = self.model._client.chat.completions.create(
+                messages=openai_messages,
+                model=self.model.model_type,
+                **request_config
+            )
+
+            parser = ContentStreamParser()
+            chunks = []
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                chunks.append(delta)
+                text = parser.feed(delta)
+                if text:
+                    # 在content中添加换行符处理
+                    yield text.replace('\\n', '\n')
+
+            raw_content = "".join(chunks)
+            self.agent.record_message(
+                BaseMessage.make_assistant_message(role_name="assistant", content=raw_content)
+            )
+        except Exception as e:
+            # API调用失败时的异常处理
+            print(f"❌ API调用异常: {str(e)}")
+            yield self._error_output()
+            return
+
+        yield self._parse_output(raw_content)
+
+    def _parse_output(self, raw_content: str) -> HealthOutputSchema:
+        """解析模型输出"""
+        # 尝试解析为JSON
+        try:
+            parsed = json.loads(raw_content)
+
+            # 在content中添加换行符处理
+            if 'content' in parsed and isinstance(parsed['content'], str):
+                parsed['content'] = parsed['content'].replace('\\n', '\n')
+
+            # 验证输出格式
+            output_schema = validate_output(parsed)
+            return output_schema
+        except (json.JSONDecodeError, ValueError) as e:
+            # 格式不符合时创建默认结构
+            default_output = HealthOutputSchema(
+                content=raw_content.replace('\\n', '\n'),
+                advice_type="general",
+                sources=["内部知识库"],
+                needs_follow_up=False
+            )
+            print(f"⚠️ 输出格式错误，使用默认结构: {str(e)}")
+            return default_output
+
+    def _is_command(self, message: str) -> bool:
+        return message.strip().lower() in ['/help', '/history', '/clear', '/params', '/exit']
+
+    def _command_output(self) -> HealthOutputSchema:
+        return HealthOutputSchema(
+            content="",
+            advice_type="general",
+            sources=[],
+            needs_follow_up=False,
+            confidence=1.0
+        )
+
+    def _error_output(self) -> HealthOutputSchema:
+        return HealthOutputSchema(
+            content="服务暂时不可用，请稍后再试",
+            advice_type="warning",
+            sources=["系统错误"],
+            needs_follow_up=False,
+            confidence=0.0
+        )
@@ -101,16 +101,11 @@ class CLIInterface:
     #     self.simulate_streaming(full_response)
 
     #模拟流式输出，支持换行符
-    def display_output(self, output: HealthOutputSchema):
-        """完整显示自然文本格式，支持换行"""
-        # 创建自然语言格式回复
-        full_response = output.content  # 直接使用可能包含换行的内容
-        
-        # 添加换行分隔的其他信息
-        full_response += "\n\n"
-        
+    def format_footer(self, output: HealthOutputSchema) -> str:
+        """生成回复末尾的来源、建议类型等附加信息"""
+        footer = ""
         if output.sources:
-            full_response += f"🔍 信息来源: {', '.join(output.sources)}\n"
+            footer += f"🔍 信息来源: {', '.join(output.sources)}\n"
         
         advice_types = {
             "general": "💡 一般建议",
@@ -118,16 +113,46 @@ class CLIInterface:
             "exercise": "🏃 运动建议",
             "warning": "⚠️ 重要提示"
         }
-        full_response += f"{advice_types.get(output.advice_type, '💡 建议')}\n"
+        footer += f"{advice_types.get(output.advice_type, '💡 建议')}\n"
         
         if output.needs_follow_up:
-            full_response += "❗ 建议: 请尽快咨询专业医生\n"
+            footer += "❗ 建议: 请尽快咨询专业医生\n"
+        
+        footer += f"📊 置信度: {output.confidence*100:.1f}%"
+        return footer
+
+    def display_output(self, output: HealthOutputSchema):
+        """完整显示自然文本格式，支持换行"""
+        # 创建自然语言格式回复
+        full_response = output.content  # 直接使用可能包含换行的内容
         
-        full_response += f"📊 置信度: {output.confidence*100:.1f}%"
+        # 添加换行分隔的其他信息
+        full_response += "\n\n"
+        full_response += self.format_footer(output)
         
         # 流式输出完整内容
         self.simulate_streaming(full_response)
 
+    def display_stream(self, stream) -> HealthOutputSchema:
+        """实时显示模型的流式回复，返回最终解析结果"""
+        output = None
+        streamed = False
+        for piece in stream:
+            if isinstance(piece, HealthOutputSchema):
+                output = piece
+            else:
+                print(piece, end='', flush=True)
+                streamed = True
+
+        if output is None:
+            raise RuntimeError("流式响应意外中断")
+        if not streamed:
+            # 模型未按JSON输出content时，直接显示完整内容
+            print(output.content, end='')
+        print("\n")
+        print(self.format_footer(output))
+        return output
+
     def show_welcome_messages(self, user_id: str, histories: list):
         """显示欢迎消息"""
         for i, agent_info in enumerate(self.agents):
@@ -141,15 +166,8 @@ class CLIInterface:
             )
 
             try:
-                response = agent_info["service"].chat(prompt)
-
-                # 处理不同类型的响应
-                if isinstance(response, HealthOutputSchema):
-                    self.display_output(response)
-                    assistant_msg = response.content
-                else:
-                    self.simulate_streaming(response)
-                    assistant_msg = response
+                response = self.display_stream(agent_info["service"].chat_stream(prompt))
+                assistant_msg = response.content
                 
                 # 保存到历史记录
                 new_msg = {
@@ -263,8 +281,6 @@ class CLIInterface:
             print(f"\n🤖 {agent_info['name']}: ", end='')
             start_time = time.time()
             try:
-                response = agent_info["service"].chat(full_input)
-                
                 # 处理不同类型的响应
                 # if isinstance(response, HealthOutputSchema):
                 #     self.display_output(response)
@@ -273,16 +289,12 @@ class CLIInterface:
                 #     self.simulate_streaming(response)
                 #     assistant_msg = response
 
-                if isinstance(response, HealthOutputSchema):
-                    # 检查是否是错误响应
-                    if response.advice_type == "warning" and "系统错误" in response.sources:
-                        print("⚠️ 检测到API错误响应")
-                    
-                    self.display_output(response)
-                    assistant_msg = response.content
-                else:
-                    self.simulate_streaming(response)
-                    assistant_msg = response
+                response = self.display_stream(agent_info["service"].chat_stream(full_input))
+                assistant_msg = response.content
+
+                # 检查是否是错误响应
+                if response.advice_type == "warning" and "系统错误" in response.sources:
+                    print("⚠️ 检测到API错误响应")
 
                 # 保存回复
                 histories[i].append({